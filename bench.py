@@ -0,0 +1,296 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from bench_server import BenchServer, add_fault_args, fault_from_args, read_rows
+from scrape import percentile
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIELDS = ["company_name", "market", "feature", "business_composition", "industries", "themes"]
+DEFAULT_RUNS = ["", "--concurrency 4", "--engine async --concurrency 8"]
+
+
+def read_csv(path: str) -> List[Dict[str, str]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def read_metrics(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    out.append(json.loads(line))
+                except ValueError:
+                    pass
+    return out
+
+
+def correctness(source: Dict[str, Dict[str, str]], rows: List[Dict[str, str]]) -> Dict[str, Any]:
+    """取得結果を元CSVと項目ごとに比較する（一致率と不一致例）"""
+    matched = {f: 0 for f in FIELDS}
+    examples: List[str] = []
+    compared = 0
+    for row in rows:
+        expected = source.get(row.get("code") or "")
+        if expected is None:
+            continue
+        compared += 1
+        for f in FIELDS:
+            if f not in row:
+                continue
+            if (row.get(f) or "") == (expected.get(f) or ""):
+                matched[f] += 1
+            elif len(examples) < 5:
+                examples.append(f"{row.get('code')}.{f}: got {row.get(f)!r}, want {expected.get(f)!r}")
+    return {
+        "compared": compared,
+        "fields": {f: (matched[f] / compared if compared else 0.0) for f in FIELDS if rows and f in rows[0]},
+        "examples": examples,
+    }
+
+
+def run_scrape(
+    label: str,
+    extra: str,
+    base_args: str,
+    codes_path: str,
+    target_url: str,
+    workdir: str,
+    source: Dict[str, Dict[str, str]],
+    n_codes: int,
+    verbose: bool,
+) -> Dict[str, Any]:
+    out_path = os.path.join(workdir, f"result_{label}.csv")
+    metrics_path = os.path.join(workdir, f"metrics_{label}.jsonl")
+    cmd = [
+        sys.executable,
+        os.path.join(HERE, "scrape.py"),
+        "--input",
+        codes_path,
+        "--output",
+        out_path,
+        "--target-url",
+        target_url,
+        "--metrics",
+        metrics_path,
+    ]
+    cmd += shlex.split(base_args) + shlex.split(extra)
+    print(f"[BENCH] run {label}: {' '.join(shlex.quote(c) for c in cmd[2:])}", file=sys.stderr)
+    t0 = time.monotonic()
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=None if verbose else subprocess.PIPE)
+    elapsed = time.monotonic() - t0
+    if proc.returncode != 0:
+        tail = (proc.stderr or b"").decode("utf-8", "replace").strip().splitlines()[-5:]
+        print(f"[WARN] run {label} exited with {proc.returncode}: {' / '.join(tail)}", file=sys.stderr)
+
+    rows = read_csv(out_path)
+    metrics = read_metrics(metrics_path)
+    totals = sorted(m.get("total", 0.0) for m in metrics if m.get("status") == "done")
+    gotos = sorted(m["goto"] for m in metrics if "goto" in m)
+    return {
+        "label": label,
+        "args": extra,
+        "returncode": proc.returncode,
+        "elapsed": elapsed,
+        "codes": n_codes,
+        "success": len(rows),
+        "pages_per_sec": len(rows) / elapsed if elapsed > 0 else 0.0,
+        "latency": {q: percentile(totals, v) for q, v in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))},
+        "goto": {q: percentile(gotos, v) for q, v in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))},
+        "correctness": correctness(source, rows),
+    }
+
+
+def print_scrape_report(results: List[Dict[str, Any]]) -> None:
+    print(
+        f"[BENCH] {'run':<6} {'ok':>9} {'elapsed':>8} {'pages/s':>8} {'p50':>7} {'p90':>7} {'p99':>7} "
+        f"{'goto p50':>8}  accuracy  args",
+        file=sys.stderr,
+    )
+    for r in results:
+        acc = r["correctness"]["fields"]
+        worst = min(acc.values()) if acc else 0.0
+        print(
+            f"[BENCH] {r['label']:<6} {r['success']:>4}/{r['codes']:<4} {r['elapsed']:>8.2f} {r['pages_per_sec']:>8.2f} "
+            f"{r['latency']['p50']:>7.3f} {r['latency']['p90']:>7.3f} {r['latency']['p99']:>7.3f} "
+            f"{r['goto']['p50']:>8.3f}  {worst * 100:7.1f}%  {r['args'] or '(default)'}",
+            file=sys.stderr,
+        )
+    for r in results:
+        acc = r["correctness"]["fields"]
+        if acc and min(acc.values()) < 1.0:
+            detail = ", ".join(f"{f}={v * 100:.1f}%" for f, v in acc.items() if v < 1.0)
+            print(f"[BENCH] {r['label']} mismatches: {detail}", file=sys.stderr)
+            for ex in r["correctness"]["examples"]:
+                print(f"[BENCH]   {ex}", file=sys.stderr)
+
+
+def cmd_scrape(args) -> List[Dict[str, Any]]:
+    source = read_rows(args.source)
+    codes = list(source)[: args.limit] if args.limit > 0 else list(source)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_scrape_")
+    os.makedirs(workdir, exist_ok=True)
+    codes_path = os.path.join(workdir, "codes.csv")
+    with open(codes_path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["code"])
+        w.writerows([c] for c in codes)
+
+    server: Optional[BenchServer] = None
+    target_url = args.target_url
+    if not target_url:
+        server = BenchServer(
+            source,
+            fault=fault_from_args(args),
+            padding_kb=args.padding_kb,
+            with_api=args.with_api,
+        ).start()
+        target_url = server.url
+    print(f"[INFO] {len(codes)} codes against {target_url} (workdir: {workdir})", file=sys.stderr)
+
+    results: List[Dict[str, Any]] = []
+    try:
+        for k, extra in enumerate(args.run or DEFAULT_RUNS, 1):
+            results.append(
+                run_scrape(f"run{k}", extra, args.base_args, codes_path, target_url, workdir, source, len(codes), args.verbose)
+            )
+    finally:
+        if server is not None:
+            print(f"[INFO] server: {server.counts}", file=sys.stderr)
+            server.stop()
+    print_scrape_report(results)
+    return results
+
+
+def make_summary_input(source_path: str, n_rows: int, path: str) -> None:
+    """元CSVの行を繰り返して n_rows 行の結果CSVを作る（code は連番で一意にする）"""
+    rows = read_csv(source_path)
+    if not rows:
+        raise ValueError(f"no rows in {source_path}")
+    fieldnames = list(rows[0].keys())
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=fieldnames)
+        w.writeheader()
+        for i in range(n_rows):
+            row = dict(rows[i % len(rows)])
+            row["code"] = f"{i:07d}"
+            w.writerow(row)
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:12]
+
+
+def cmd_summary(args) -> List[Dict[str, Any]]:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_summary_")
+    os.makedirs(workdir, exist_ok=True)
+    input_path = os.path.join(workdir, "99999999_result.csv")
+    t0 = time.monotonic()
+    make_summary_input(args.source, args.rows, input_path)
+    print(f"[INFO] generated {args.rows} rows in {time.monotonic() - t0:.1f}s: {input_path}", file=sys.stderr)
+
+    results: List[Dict[str, Any]] = []
+    for k, extra in enumerate(args.run or [""], 1):
+        label = f"run{k}"
+        out_path = os.path.join(workdir, f"summary_{k}.csv")
+        cmd = [sys.executable, os.path.join(HERE, "summary.py"), "--input", input_path, "--output", out_path]
+        cmd += shlex.split(extra)
+        best = None
+        for _ in range(max(1, args.repeat)):
+            t0 = time.monotonic()
+            proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.PIPE)
+            elapsed = time.monotonic() - t0
+            if proc.returncode != 0:
+                tail = (proc.stderr or b"").decode("utf-8", "replace").strip().splitlines()[-3:]
+                print(f"[WARN] run {label} exited with {proc.returncode}: {' / '.join(tail)}", file=sys.stderr)
+                break
+            best = elapsed if best is None else min(best, elapsed)
+        digest = file_digest(out_path) if os.path.exists(out_path) else ""
+        results.append(
+            {
+                "label": label,
+                "args": extra,
+                "rows": args.rows,
+                "elapsed": best or 0.0,
+                "rows_per_sec": args.rows / best if best else 0.0,
+                "digest": digest,
+            }
+        )
+
+    print(f"[BENCH] {'run':<6} {'rows':>9} {'best s':>8} {'rows/s':>10}  output       args", file=sys.stderr)
+    for r in results:
+        same = "" if r["digest"] == results[0]["digest"] else "  (output differs from #1)"
+        print(
+            f"[BENCH] {r['label']:<6} {r['rows']:>9} {r['elapsed']:>8.2f} {r['rows_per_sec']:>10.0f}  {r['digest'] or '-':<12} "
+            f"{r['args'] or '(default)'}{same}",
+            file=sys.stderr,
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for scrape.py and summary.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_scrape = sub.add_parser("scrape", help="run scrape.py against a local synthetic stock-page server")
+    p_scrape.add_argument("--source", default=os.path.join(HERE, "20250914_result.csv"), help="result CSV to serve and check against")
+    p_scrape.add_argument("--limit", type=int, default=200, help="number of codes (0=all)")
+    p_scrape.add_argument(
+        "--run",
+        action="append",
+        default=[],
+        help="extra scrape.py arguments for one run (repeatable; default: serial, --concurrency 4, async x8)",
+    )
+    p_scrape.add_argument(
+        "--base-args",
+        default="--sleep 0 --retries 2 --retry-base 0.1",
+        help="arguments passed to every run",
+    )
+    p_scrape.add_argument("--target-url", default="", help="use an already running server instead of starting one")
+    add_fault_args(p_scrape)
+
+    p_summary = sub.add_parser("summary", help="run summary.py on a large generated input")
+    p_summary.add_argument("--source", default=os.path.join(HERE, "20250914_result.csv"), help="result CSV to replicate")
+    p_summary.add_argument("--rows", type=int, default=200000, help="number of generated rows")
+    p_summary.add_argument("--run", action="append", default=[], help="extra summary.py arguments for one run (repeatable)")
+    p_summary.add_argument("--repeat", type=int, default=3, help="repetitions per run (best time is reported)")
+
+    for p in (p_scrape, p_summary):
+        p.add_argument("--workdir", default="", help="directory for generated inputs/outputs (default: a temp dir)")
+        p.add_argument("--report", default="", help="also write the results as JSON to this path")
+        p.add_argument("--verbose", action="store_true", help="show the child process logs")
+    args = parser.parse_args()
+
+    try:
+        results = cmd_scrape(args) if args.command == "scrape" else cmd_summary(args)
+    except Exception as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"command": args.command, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"[DONE] report written to {args.report}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import argparse
+import csv
+import gzip
+import html
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+
+# scrape.py の抽出（dt/dd 構造）に合わせた疑似銘柄ページ。ネットワークなしでの性能比較用
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="ja">
+<head><meta charset="utf-8"><title>{title}</title></head>
+<body>
+<header><h1>{company_name}</h1></header>
+<main>
+<section class="summary">
+<p class="market">{code} {market}</p>
+<dl>
+<dt>特色</dt><dd>{feature}</dd>
+<dt>連結事業</dt><dd>{business}</dd>
+<dt>所属業界</dt><dd>{industries}</dd>
+<dt>市場テーマ</dt><dd>{themes}</dd>
+<dt>比較会社</dt><dd>{comparison}</dd>
+</dl>
+</section>
+{padding}
+</main>
+{api_script}
+</body>
+</html>
+"""
+
+API_SCRIPT = """<script>fetch('/api/stocks/{code}').then(r => r.json()).catch(() => null);</script>"""
+
+STOCK_PATH_RE = re.compile(r"^/stocks/([0-9A-Za-z]+)/?$")
+API_PATH_RE = re.compile(r"^/api/stocks/([0-9A-Za-z]+)/?$")
+
+
+def read_rows(csv_path: str) -> Dict[str, Dict[str, str]]:
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        return {(row.get("code") or "").strip(): row for row in csv.DictReader(f) if (row.get("code") or "").strip()}
+
+
+def tags(values: List[str]) -> str:
+    return "".join(f'<a class="tag" href="#">{html.escape(v)}</a>' for v in values)
+
+
+def split_list(value: str) -> List[str]:
+    return [t for t in (value or "").split(",") if t]
+
+
+def render_page(code: str, row: Dict[str, str], comparison: List[str], padding_kb: int = 0, with_api: bool = False) -> str:
+    name = row.get("company_name") or ""
+    # 実ページに近いサイズにするための無関係なブロック（抽出対象のラベルは含まない）
+    filler = ""
+    if padding_kb > 0:
+        line = "<p class=\"news\">ニュース本文のダミーテキストです。</p>\n"
+        filler = "<section class=\"news\">\n" + line * max(1, padding_kb * 1024 // len(line.encode("utf-8"))) + "</section>"
+    return PAGE_TEMPLATE.format(
+        title=html.escape(f"{name}【{code}】"),
+        code=html.escape(code),
+        company_name=html.escape(name),
+        market=html.escape(row.get("market") or ""),
+        feature=html.escape(row.get("feature") or ""),
+        business=html.escape(row.get("business_composition") or ""),
+        industries=tags(split_list(row.get("industries") or "")),
+        themes=tags(split_list(row.get("themes") or "")),
+        comparison=tags(comparison),
+        padding=filler,
+        api_script=API_SCRIPT.format(code=html.escape(code)) if with_api else "",
+    )
+
+
+def render_api(code: str, row: Dict[str, str]) -> str:
+    """--capture-json 用の JSON 応答（scrape.JSON_FIELD_KEYS のキー名に合わせる）"""
+    body = {
+        "code": code,
+        "companyName": row.get("company_name") or "",
+        "market": row.get("market") or "",
+        "feature": row.get("feature") or "",
+        "businessComposition": row.get("business_composition") or "",
+        "industries": [{"name": t} for t in split_list(row.get("industries") or "")],
+        "themes": split_list(row.get("themes") or ""),
+    }
+    return json.dumps({"data": body}, ensure_ascii=False)
+
+
+class Fault:
+    """遅延とエラーの注入設定。seed を固定すると同じコード列に対して同じ結果になる"""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_ms: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def decide(self) -> Tuple[float, Optional[int]]:
+        """(遅延秒, 注入するHTTPステータス or None) を返す"""
+        with self._lock:
+            delay = self.latency_ms + (self.rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0)
+            if self.slow_rate and self.rng.random() < self.slow_rate:
+                delay += self.slow_ms
+            status: Optional[int] = None
+            r = self.rng.random()
+            if r < self.error_rate:
+                status = 503
+            elif r < self.error_rate + self.throttle_rate:
+                status = 429
+        return max(0.0, delay) / 1000.0, status
+
+
+class BenchServer:
+    """疑似銘柄ページを返す HTTP サーバー（別スレッドで起動可能）"""
+
+    def __init__(
+        self,
+        rows: Dict[str, Dict[str, str]],
+        host: str = "127.0.0.1",
+        port: int = 0,
+        fault: Optional[Fault] = None,
+        padding_kb: int = 0,
+        with_api: bool = False,
+        quiet: bool = True,
+    ):
+        self.rows = rows
+        self.fault = fault or Fault()
+        self.padding_kb = padding_kb
+        self.with_api = with_api
+        self.quiet = quiet
+        self.counts: Dict[str, int] = {"pages": 0, "api": 0, "not_found": 0, "injected": 0}
+        self._lock = threading.Lock()
+        # 比較会社は前後の銘柄名を使う（所属業界・テーマからの除外処理を通すため）
+        codes = list(rows)
+        self.comparison: Dict[str, List[str]] = {}
+        for i, code in enumerate(codes):
+            neighbors = [codes[j] for j in (i - 1, i + 1) if 0 <= j < len(codes)]
+            self.comparison[code] = [rows[c].get("company_name") or "" for c in neighbors if rows[c].get("company_name")]
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/stocks/{{code}}"
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.counts[key] += 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # ヘッダと本文を別々に書くため、Nagle が有効だと keep-alive 接続で遅延ACK（約40ms）待ちが入る
+            disable_nagle_algorithm = True
+
+            def log_message(self, fmt, *a) -> None:
+                if not server.quiet:
+                    sys.stderr.write(f"[HTTP] {self.address_string()} {fmt % a}\n")
+
+            def _send(self, status: int, body: str, content_type: str) -> None:
+                data = body.encode("utf-8")
+                gzipped = "gzip" in (self.headers.get("Accept-Encoding") or "")
+                if gzipped:
+                    data = gzip.compress(data)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                if gzipped:
+                    self.send_header("Content-Encoding", "gzip")
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                path = self.path.split("?", 1)[0]
+                if path == "/health":
+                    self._send(200, "ok", "text/plain; charset=utf-8")
+                    return
+                m_page = STOCK_PATH_RE.match(path)
+                m_api = API_PATH_RE.match(path) if server.with_api else None
+                m = m_page or m_api
+                if not m:
+                    self._send(404, "not found", "text/plain; charset=utf-8")
+                    return
+                code = m.group(1)
+                row = server.rows.get(code)
+                if m_page:
+                    delay, status = server.fault.decide()
+                    if delay:
+                        time.sleep(delay)
+                    if status is not None:
+                        server._count("injected")
+                        self._send(status, f"injected {status}", "text/plain; charset=utf-8")
+                        return
+                if row is None:
+                    server._count("not_found")
+                    self._send(404, "not found", "text/plain; charset=utf-8")
+                    return
+                if m_api:
+                    server._count("api")
+                    self._send(200, render_api(code, row), "application/json; charset=utf-8")
+                    return
+                server._count("pages")
+                page = render_page(code, row, server.comparison.get(code, []), server.padding_kb, server.with_api)
+                self._send(200, page, "text/html; charset=utf-8")
+
+        return Handler
+
+    def start(self) -> "BenchServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_fault_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="base response latency in ms")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- latency jitter in ms")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of pages that get --slow-ms extra latency")
+    parser.add_argument("--slow-ms", type=float, default=0.0, help="extra latency for slow pages in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of pages answered with HTTP 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of pages answered with HTTP 429")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for latency/error injection")
+    parser.add_argument("--padding-kb", type=int, default=0, help="add N KB of unrelated markup to each page")
+    parser.add_argument("--with-api", action="store_true", help="pages also fetch /api/stocks/{code} JSON")
+
+
+def fault_from_args(args) -> Fault:
+    return Fault(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic /stocks/{code} pages from a result CSV for benchmarking")
+    parser.add_argument("--source", default="20250914_result.csv", help="result CSV used to generate pages")
+    parser.add_argument("--host", default="127.0.0.1", help="bind address")
+    parser.add_argument("--port", type=int, default=8765, help="bind port (0=any free port)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    add_fault_args(parser)
+    args = parser.parse_args()
+
+    try:
+        rows = read_rows(args.source)
+    except Exception as e:
+        print(f"[ERROR] failed to read {args.source}: {e}", file=sys.stderr)
+        sys.exit(1)
+    server = BenchServer(
+        rows,
+        host=args.host,
+        port=args.port,
+        fault=fault_from_args(args),
+        padding_kb=args.padding_kb,
+        with_api=args.with_api,
+        quiet=not args.verbose,
+    )
+    print(f"[INFO] serving {len(rows)} codes at {server.url}", file=sys.stderr)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"[DONE] {server.counts}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
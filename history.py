@@ -0,0 +1,319 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from table_io import LIST_COLUMNS, open_table_reader, open_table_writer
+
+
+# 銘柄がその日のスナップショットに無い/再び現れたことを記録する擬似フィールド
+STATUS_FIELD = "_status"
+DATE_RE = re.compile(r"(\d{8})_")
+# summary にだけある列。1つの履歴には result と summary のどちらか一方の系列だけを取り込む
+SUMMARY_ONLY_COLUMNS = {"business1", "overseas"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    date TEXT PRIMARY KEY,
+    source TEXT,
+    ingested_at REAL,
+    rows INTEGER,
+    changes INTEGER
+);
+-- 変化した項目だけを (code, field, date) で追記する。ある日の値は date 以前で最新の行
+CREATE TABLE IF NOT EXISTS changes (
+    code TEXT NOT NULL,
+    field TEXT NOT NULL,
+    date TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (code, field, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS changes_by_date ON changes (date, code);
+-- 取り込み時の比較用に、各銘柄の最新値をまとめて持つ
+CREATE TABLE IF NOT EXISTS latest (
+    code TEXT PRIMARY KEY,
+    date TEXT,
+    fields TEXT
+);
+"""
+
+
+def date_of_path(path: str) -> str:
+    m = DATE_RE.match(os.path.basename(path))
+    if not m:
+        raise ValueError(f"cannot tell the snapshot date of {path}; use --date YYYYMMDD")
+    return m.group(1)
+
+
+def kind_of_columns(fieldnames: List[str]) -> str:
+    """スナップショットの種類（"result" / "summary"）を列から判定する"""
+    return "summary" if SUMMARY_ONLY_COLUMNS & set(fieldnames) else "result"
+
+
+def table_kind(path: str) -> str:
+    with open_table_reader(path) as reader:
+        return kind_of_columns(reader.fieldnames or [])
+
+
+def parse_date(value: str) -> str:
+    if not re.fullmatch(r"\d{8}", value or ""):
+        raise ValueError(f"date must be YYYYMMDD: {value!r}")
+    return value
+
+
+class HistoryStore:
+    """(code, date) 単位の追記型履歴。スナップショットを日付順に取り込み、変化した項目だけを保存する"""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def last_date(self) -> str:
+        row = self.conn.execute("SELECT MAX(date) FROM snapshots").fetchone()
+        return row[0] or ""
+
+    def kind(self) -> str:
+        """取り込み済みの種類（"result" / "summary"、未取り込みなら ""）"""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'kind'").fetchone()
+        return row[0] if row else ""
+
+    def dates(self) -> List[Tuple[str, str, int, int]]:
+        return self.conn.execute("SELECT date, source, rows, changes FROM snapshots ORDER BY date").fetchall()
+
+    def ingest(self, path: str, date: str, partial: bool = False) -> Tuple[int, int]:
+        """1スナップショットを取り込み (行数, 変化件数) を返す。
+
+        日付は既存の最新より後であること（追記のみ）。種類（result / summary）は最初に取り込んだものに限る。
+        partial でなければ、スナップショットに無い銘柄は _status=removed として記録する。
+        """
+        last = self.last_date()
+        if last and date <= last:
+            raise ValueError(f"snapshot {date} is not newer than the latest ingested date {last}")
+        stored = self.kind()
+        latest: Dict[str, Dict[str, str]] = {
+            code: json.loads(fields) for code, fields in self.conn.execute("SELECT code, fields FROM latest")
+        }
+        changes: List[Tuple[str, str, str, str]] = []
+        updated: Dict[str, Dict[str, str]] = {}
+        n = 0
+        with open_table_reader(path) as reader:
+            if "code" not in (reader.fieldnames or []):
+                raise ValueError(f"{path} has no 'code' column")
+            kind = kind_of_columns(reader.fieldnames)
+            if stored and kind != stored:
+                raise ValueError(f"{path} is a {kind} table but {stored} snapshots are stored here; use another --db")
+            tracked = [f for f in reader.fieldnames if f != "code"]
+            for row in reader:
+                code = (row.get("code") or "").strip()
+                if not code or code in updated:
+                    continue
+                n += 1
+                prev = latest.get(code, {})
+                cur = dict(prev)
+                if prev.get(STATUS_FIELD) != "listed":
+                    cur[STATUS_FIELD] = "listed"
+                    changes.append((code, STATUS_FIELD, date, "listed"))
+                for f in tracked:
+                    value = row.get(f) or ""
+                    if f not in prev or prev[f] != value:
+                        cur[f] = value
+                        changes.append((code, f, date, value))
+                updated[code] = cur
+        if not partial:
+            for code, prev in latest.items():
+                if code not in updated and prev.get(STATUS_FIELD) != "removed":
+                    cur = dict(prev)
+                    cur[STATUS_FIELD] = "removed"
+                    changes.append((code, STATUS_FIELD, date, "removed"))
+                    updated[code] = cur
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('kind', ?)", (kind,))
+            self.conn.executemany("INSERT INTO changes (code, field, date, value) VALUES (?, ?, ?, ?)", changes)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO latest (code, date, fields) VALUES (?, ?, ?)",
+                [(code, date, json.dumps(fields, ensure_ascii=False)) for code, fields in updated.items()],
+            )
+            self.conn.execute(
+                "INSERT INTO snapshots (date, source, ingested_at, rows, changes) VALUES (?, ?, ?, ?, ?)",
+                (date, os.path.abspath(path), time.time(), n, len(changes)),
+            )
+        return n, len(changes)
+
+    def diff(self, date_a: str, date_b: str, fields: Optional[List[str]] = None) -> List[Tuple[str, str, str, str]]:
+        """date_a 時点と date_b 時点で値が異なる (code, field, old, new)。(a, b] の変更行だけを起点に引く"""
+        if date_a > date_b:
+            date_a, date_b = date_b, date_a
+        rows = self.conn.execute(
+            """
+            SELECT c.code, c.field,
+              (SELECT value FROM changes p WHERE p.code = c.code AND p.field = c.field AND p.date <= :a
+               ORDER BY p.date DESC LIMIT 1) AS old,
+              (SELECT value FROM changes p WHERE p.code = c.code AND p.field = c.field AND p.date <= :b
+               ORDER BY p.date DESC LIMIT 1) AS new
+            FROM (SELECT DISTINCT code, field FROM changes WHERE date > :a AND date <= :b) c
+            ORDER BY c.code, c.field
+            """,
+            {"a": date_a, "b": date_b},
+        ).fetchall()
+        out = []
+        for code, field, old, new in rows:
+            if fields and field not in fields:
+                continue
+            if (old or "") != (new or ""):
+                out.append((code, field, old or "", new or ""))
+        return out
+
+    def history(self, code: str, fields: Optional[List[str]] = None) -> List[Tuple[str, str, str]]:
+        rows = self.conn.execute(
+            "SELECT date, field, value FROM changes WHERE code = ? ORDER BY date, field", (code,)
+        ).fetchall()
+        return [r for r in rows if not fields or r[1] in fields]
+
+    def state_at(self, code: str, date: str) -> Dict[str, str]:
+        rows = self.conn.execute(
+            "SELECT field, value FROM changes WHERE code = ? AND date <= ? ORDER BY date", (code, date)
+        ).fetchall()
+        return {field: value or "" for field, value in rows}
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def list_delta(old: str, new: str) -> Tuple[str, str]:
+    """カンマ区切りの項目（industries/themes）の追加分・削除分"""
+    a = [t for t in old.split(",") if t]
+    b = [t for t in new.split(",") if t]
+    return ",".join(t for t in b if t not in a), ",".join(t for t in a if t not in b)
+
+
+def write_rows(path: str, fieldnames: List[str], rows: List[Dict[str, str]]) -> None:
+    if path:
+        with open_table_writer(path, fieldnames, table="history") as w:
+            w.writerows(rows)
+        print(f"[DONE] {len(rows)} rows written to {path}", file=sys.stderr)
+        return
+    w = csv.DictWriter(sys.stdout, fieldnames=fieldnames, extrasaction="ignore", lineterminator="\n")
+    w.writeheader()
+    w.writerows(rows)
+
+
+def parse_fields(value: str) -> Optional[List[str]]:
+    fields = [f.strip() for f in (value or "").split(",") if f.strip()]
+    return fields or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append-only history of result/summary snapshots with diff queries")
+    parser.add_argument("--db", default="history.db", help="history database path (default: history.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_ingest = sub.add_parser(
+        "ingest",
+        help="add snapshots (YYYYMMDD_result.csv or _summary.csv, any table format); "
+        "one --db holds only one of the two kinds",
+    )
+    p_ingest.add_argument("inputs", nargs="+", help="snapshot paths or globs; ingested in date order")
+    p_ingest.add_argument("--date", default="", help="snapshot date YYYYMMDD (single input without a dated name)")
+    p_ingest.add_argument(
+        "--partial", action="store_true", help="snapshot covers only some codes; do not mark missing codes removed"
+    )
+    p_ingest.add_argument("--skip-ingested", action="store_true", help="skip snapshots not newer than the latest date")
+
+    p_diff = sub.add_parser("diff", help="fields that differ between two dates")
+    p_diff.add_argument("date_a", help="YYYYMMDD")
+    p_diff.add_argument("date_b", help="YYYYMMDD")
+    p_diff.add_argument("--fields", default="", help="comma-separated fields to compare (default: all)")
+    p_diff.add_argument("--output", default="", help="write to this path (.csv/.parquet/.sqlite) instead of stdout")
+
+    p_show = sub.add_parser("show", help="change history of one code")
+    p_show.add_argument("code", help="stock code")
+    p_show.add_argument("--fields", default="", help="comma-separated fields (default: all)")
+    p_show.add_argument("--date", default="", help="print the full record as of this date instead of the history")
+
+    sub.add_parser("dates", help="list ingested snapshots")
+    args = parser.parse_args()
+
+    try:
+        store = HistoryStore(args.db)
+    except Exception as e:
+        print(f"[ERROR] cannot open {args.db}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        if args.command == "ingest":
+            paths: List[str] = []
+            for pat in args.inputs:
+                matched = sorted(glob.glob(pat)) if glob.has_magic(pat) else [pat]
+                paths.extend(p for p in matched if p not in paths)
+            if args.date and len(paths) != 1:
+                raise ValueError("--date can only be used with a single input")
+            dated = sorted((parse_date(args.date) if args.date else date_of_path(p), p) for p in paths)
+            # 途中で止まらないよう、取り込む前に種類の混在と日付の重複を確かめる
+            kinds = {p: table_kind(p) for p in paths}
+            expected = store.kind() or (kinds[dated[0][1]] if dated else "")
+            mixed = [p for p in paths if kinds[p] != expected]
+            if mixed:
+                raise ValueError(
+                    f"one history holds either result or summary snapshots ({expected} here); "
+                    f"not {', '.join(mixed)}. Use a separate --db for the other kind"
+                )
+            seen: Dict[str, str] = {}
+            for date, path in dated:
+                if date in seen:
+                    raise ValueError(f"{seen[date]} and {path} have the same date {date}")
+                seen[date] = path
+            for date, path in dated:
+                if args.skip_ingested and date <= store.last_date():
+                    print(f"[INFO] skip {path} (already ingested up to {store.last_date()})", file=sys.stderr)
+                    continue
+                t0 = time.time()
+                n, changed = store.ingest(path, date, partial=args.partial)
+                print(
+                    f"[DONE] {date}: {n} codes, {changed} changed fields from {path} ({time.time() - t0:.2f}s)",
+                    file=sys.stderr,
+                )
+        elif args.command == "diff":
+            a, b = parse_date(args.date_a), parse_date(args.date_b)
+            rows = []
+            for code, field, old, new in store.diff(a, b, parse_fields(args.fields)):
+                rec = {"code": code, "field": field, "old": old, "new": new, "added": "", "removed": ""}
+                if field in LIST_COLUMNS:
+                    rec["added"], rec["removed"] = list_delta(old, new)
+                rows.append(rec)
+            write_rows(args.output, ["code", "field", "old", "new", "added", "removed"], rows)
+            codes = len({r["code"] for r in rows})
+            print(f"[SUMMARY] {len(rows)} changed fields in {codes} codes between {min(a, b)} and {max(a, b)}", file=sys.stderr)
+        elif args.command == "show":
+            fields = parse_fields(args.fields)
+            if args.date:
+                state = store.state_at(args.code, parse_date(args.date))
+                rows = [{"field": f, "value": v} for f, v in state.items() if not fields or f in fields]
+                write_rows("", ["field", "value"], rows)
+            else:
+                rows = [{"date": d, "field": f, "value": v or ""} for d, f, v in store.history(args.code, fields)]
+                write_rows("", ["date", "field", "value"], rows)
+            if not rows:
+                print(f"[WARN] no history for {args.code}", file=sys.stderr)
+        else:
+            for date, source, n, changed in store.dates():
+                print(f"{date}\t{n} codes\t{changed} changes\t{source}")
+    except Exception as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,110 @@
+import asyncio
+import copy
 import csv
+import gzip
+import hashlib
+import heapq
+import http.client
+import importlib
+import inspect
+import json
 import os
+import queue
 import random
 import re
+import socket
+import sqlite3
 import sys
+import threading
 import time
-from typing import Dict, List, Optional
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from typing import Any, Collection, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urljoin, urlsplit
 
-from playwright.sync_api import TimeoutError as PWTimeoutError, sync_playwright
+from table_io import open_table_reader, open_table_writer
 
 
 TARGET_URL = "https://shikiho.toyokeizai.net/stocks/{code}"
 MARKET_REGEX = re.compile(r"(東証(?:プライム|スタンダード|グロース))")
 
 
+def pw_timeout_error():
+    """playwright の TimeoutError。--help や --merge などブラウザを使わない経路では import しない"""
+    from playwright.sync_api import TimeoutError as PWTimeoutError
+
+    return PWTimeoutError
+
+
 class NonRetryableError(Exception):
     pass
 
 
+class TransientHTTPError(Exception):
+    """429/5xx 応答。リトライ対象で、--adaptive ではレート低下のシグナルとなる"""
+
+
+# ページ操作の手順は sync/async の両エンジンで共通にするため、I/O を yield する生成器として1回だけ書き、
+# run_steps（sync API）/ run_steps_async（async API）で進める。Playwright の sync/async API はメソッド名が同じで
+# async 版は awaitable を返すだけなので、手順は引数なしの callable（ページ操作）を yield し、結果を受け取る。
+# 例外は yield した位置に送り返すので、手順の中の try/except/finally はそのまま使える。
+# time.sleep / asyncio.sleep のように両者で呼ぶ関数が異なる I/O は Both で渡す。
+
+
+class Both:
+    """sync/async で呼ぶ関数が異なる I/O（待機・レート制御・スレッドで実行する同期 I/O）"""
+
+    def __init__(self, sync_call, async_call):
+        self.sync_call = sync_call
+        self.async_call = async_call
+
+
+def sleep_op(seconds: float) -> Both:
+    return Both(lambda: time.sleep(seconds), lambda: asyncio.sleep(seconds))
+
+
+def run_steps(steps):
+    """手順（生成器）を sync API で最後まで進め、戻り値を返す"""
+    value: Any = None
+    error: Optional[Exception] = None
+    try:
+        while True:
+            try:
+                op = steps.throw(error) if error is not None else steps.send(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                value, error = (op.sync_call if isinstance(op, Both) else op)(), None
+            except Exception as e:
+                value, error = None, e
+    finally:
+        steps.close()
+
+
+async def run_steps_async(steps):
+    """run_steps の async 版。yield された操作の戻り値が awaitable なら待つ"""
+    value: Any = None
+    error: Optional[Exception] = None
+    try:
+        while True:
+            try:
+                op = steps.throw(error) if error is not None else steps.send(value)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                value = (op.async_call if isinstance(op, Both) else op)()
+                if inspect.isawaitable(value):
+                    value = await value
+                error = None
+            except Exception as e:
+                value, error = None, e
+    finally:
+        # キャンセル時も手順の finally（ゲートの解放など）を実行する
+        steps.close()
+
+
 def read_codes(csv_path: str) -> List[str]:
     codes: List[str] = []
     with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
@@ -38,155 +126,289 @@ def normalize_text(s: Optional[str]) -> str:
     return re.sub(r"\s+", " ", s).strip()
 
 
-def extract_fields(page, max_industries: int = 3) -> Dict[str, str]:
+H1_SELECTORS = [
+    "h1",
+    "header h1",
+    "main h1",
+    "[class*=company] h1",
+    "[class*=Company] h1",
+]
+
+# ラベル探索（dt/th/兄弟要素）の対象。キーはスナップショット内の参照名
+LABEL_GROUPS: Dict[str, List[str]] = {
+    "feature": ["特色"],
+    "business": ["連結事業", "単独事業", "連結(単独)事業", "連結・単独事業", "連結/単独事業"],
+    "comparison": ["比較会社"],
+    "industries": ["所属業界"],
+    "themes": ["市場テーマ", "テーマ"],
+}
+
+# 抽出に必要なDOM情報を1回の evaluate でまとめて取得する。
+# arg.parts が無ければ全部品、あれば指定の部品だけ（dl は arg.dts の dt、ラベル探索は arg.groups のキー）を集める
+SNAPSHOT_JS = r"""
+(arg) => {
+  const want = p => !arg.parts || arg.parts.includes(p);
+  const snap = {};
+  function clean(t){return (t||'').replace(/\s+/g,' ').trim()}
+  function pickItems(el){
+    return Array.from(el.querySelectorAll('a')).map(a=>clean(a.innerText)).filter(Boolean);
+  }
+  function visible(el){
+    const r = el.getBoundingClientRect();
+    return r.width > 0 && r.height > 0 && getComputedStyle(el).visibility !== 'hidden';
+  }
+
+  // 見出し: セレクタごとに最初の要素が可視ならそのテキスト
+  if (want('h1')) snap.h1 = arg.h1.map(sel => {
+    const el = document.querySelector(sel);
+    return (el && visible(el)) ? (el.innerText || '') : '';
+  });
+
+  // dt/dd 組: dd 内のタグ要素と、停止語（比較会社）を含む最初の子孫の位置
+  if (want('dl')) snap.dl = Array.from(document.querySelectorAll('dt')).map(dt => {
+    const entry = { dt: clean(dt.innerText), text: '', items: [], stop_top: null };
+    if (arg.dts && !arg.dts.includes(entry.dt)) return null;
+    const dd = dt.nextElementSibling;
+    if (!dd || dd.tagName !== 'DD') return entry;
+    entry.text = clean(dd.innerText);
+    const stopEl = Array.from(dd.querySelectorAll('*')).find(n => clean(n.innerText).includes(arg.stop));
+    entry.stop_top = stopEl ? stopEl.getBoundingClientRect().top : null;
+    for (const n of dd.querySelectorAll('a, .tag, .chip, li, span')){
+      const t = clean(n.innerText);
+      if (t) entry.items.push([t, n.getBoundingClientRect().top]);
+    }
+    return entry;
+  }).filter(Boolean);
+
+  // th/td 組
+  if (want('th')) snap.th = Array.from(document.querySelectorAll('th')).map(h => {
+    let td = h.nextElementSibling;
+    if (!(td && td.tagName === 'TD') && h.parentElement){
+      td = h.parentElement.querySelector('td');
+    }
+    return { th: clean(h.innerText), text: td ? clean(td.innerText) : '', items: td ? pickItems(td) : [] };
+  });
+
+  // ラベル探索（dt/dd, th/td, 兄弟要素）。候補要素のテキストは1回だけ計算する
+  const groups = Object.entries(arg.groups);
+  const candidates = groups.length ? Array.from(document.querySelectorAll('dt,th,div,span,p,li,strong,b')) : [];
+  const compact = candidates.map(e => (e && e.innerText) ? clean(e.innerText).replace(/\s+/g,'') : null);
+  const labels = {};
+  for (const [key, group] of groups){
+    labels[key] = { text: '', items: [] };
+    for (const label of group){
+      const L = label.replace(/\s+/g,'');
+      const idx = compact.findIndex(t => t !== null && (t.startsWith(L) || t === L));
+      if (idx < 0) continue;
+      const target = candidates[idx];
+      let text = '';
+      let items = [];
+      if (target.tagName === 'DT'){
+        const dd = target.nextElementSibling;
+        if (dd && dd.tagName === 'DD'){
+          text = clean(dd.innerText);
+          items = pickItems(dd);
+        }
+      } else if (target.tagName === 'TH'){
+        let td = target.nextElementSibling;
+        if (!(td && td.tagName === 'TD') && target.parentElement){
+          td = target.parentElement.querySelector('td');
+        }
+        if (td){
+          text = clean(td.innerText);
+          items = pickItems(td);
+        }
+      } else {
+        const sib = target.nextElementSibling;
+        if (sib){
+          text = clean(sib.innerText);
+          items = pickItems(sib);
+        }
+      }
+      // 補助: 近傍コンテナからタグ・リンクを収集
+      if (!text || !text.trim()){
+        const container = target.closest('section,article,div,dl,table,ul,ol') || target.parentElement;
+        if (container){
+          const more = Array.from(container.querySelectorAll('a, .tag, li, span'))
+            .map(n => clean(n.innerText))
+            .filter(Boolean);
+          if (more.length){
+            items = more;
+            text = more.join(' ');
+          }
+        }
+      }
+      labels[key] = { text, items };
+      break;
+    }
+  }
+  if (groups.length) snap.labels = labels;
+
+  if (want('body')) snap.body = document.body ? document.body.innerText : '';
+  return snap;
+}
+"""
+
+
+def snapshot_args(parts: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """SNAPSHOT_JS の引数。parts（"h1" / "body" / "th" / "dl:<dt>" / "label:<LABEL_GROUPS のキー>"）でその部品だけに絞る"""
+    arg: Dict[str, Any] = {"h1": H1_SELECTORS, "groups": LABEL_GROUPS, "stop": "比較会社"}
+    if parts is None:
+        return arg
+    parts = list(parts)
+    dts = [p[3:] for p in parts if p.startswith("dl:")]
+    arg["parts"] = [p for p in parts if ":" not in p] + (["dl"] if dts else [])
+    arg["dts"] = dts
+    arg["groups"] = {p[6:]: LABEL_GROUPS[p[6:]] for p in parts if p.startswith("label:")}
+    return arg
+
+
+# 項目ごとに最初の evaluate で集める部品（"comparison" は業界・テーマから除く比較会社名の中間項目）。
+# ラベル探索や本文の「市場テーマ」行などフォールバックでだけ読む部品は、必要になった銘柄だけ追加で集める
+FIELD_PARTS: Dict[str, List[str]] = {
+    "code": [],
+    "company_name": ["h1"],
+    "market": ["body"],
+    "feature": ["label:feature"],
+    "business_composition": ["label:business"],
+    "comparison": ["dl:比較会社"],
+    "industries": ["dl:所属業界"],
+    "themes": ["dl:市場テーマ"],
+}
+# 組み立てに使う他の項目。業界は比較会社名とテーマ語を除外して決める
+FIELD_REQUIRES: Dict[str, List[str]] = {
+    "industries": ["comparison", "themes"],
+    "themes": ["comparison"],
+}
+# フォールバックで読むラベル探索。他のラベル探索と同じ evaluate なら候補要素のテキスト計算を共有できるので最初から含める
+FIELD_FALLBACK_LABELS: Dict[str, List[str]] = {
+    "comparison": ["label:comparison"],
+    "industries": ["label:industries"],
+    "themes": ["label:themes"],
+}
+
+
+class ExtractPlan:
+    """出力する項目から決める抽出計画。fields は依存を含めて組み立てる項目、parts は最初に集める部品"""
+
+    def __init__(self, fields: Iterable[str]):
+        resolved: Set[str] = set()
+        todo = [f for f in fields if f in FIELD_PARTS]
+        while todo:
+            f = todo.pop()
+            if f not in resolved:
+                resolved.add(f)
+                todo.extend(FIELD_REQUIRES.get(f, []))
+        self.fields = resolved
+        parts = {p for f in resolved for p in FIELD_PARTS[f]}
+        if any(p.startswith("label:") for p in parts):
+            parts.update(p for f in resolved for p in FIELD_FALLBACK_LABELS.get(f, []))
+        self.parts = sorted(parts)
+
+
+def extract_plan(args) -> Optional[ExtractPlan]:
+    """--fields と --post が使う項目から抽出計画を作る。--snapshot-dir では再抽出に備えて全部品を集める（None）"""
+    if args.snapshot_dir:
+        return None
+    fields = [f.strip() for f in args.fields.split(",") if f.strip() in FIELD_PARTS] or list(CONTENT_FIELDS)
+    for spec in args.post:
+        fields.extend(getattr(POST_STAGES.get(spec), "requires", CONTENT_FIELDS))
+    return ExtractPlan(fields)
+
+
+def merge_snapshot(snap: Dict[str, Any], more: Dict[str, Any]) -> None:
+    """部品を絞ったスナップショットに、追加で集めた部品を足す"""
+    for key, value in more.items():
+        if key == "dl":
+            snap.setdefault("dl", []).extend(value)
+        elif key == "labels":
+            snap.setdefault("labels", {}).update(value)
+        elif key == "parts":
+            snap["parts"] = sorted(set(snap.get("parts") or []) | set(value))
+        else:
+            snap[key] = value
+
+
+def fields_from_snapshot(
+    snap: Optional[Dict[str, Any]],
+    max_industries: int = 3,
+    fields: Optional[Collection[str]] = None,
+    missing: Optional[Set[str]] = None,
+    use_json: bool = True,
+) -> Dict[str, str]:
+    """SNAPSHOT_JS の結果から各項目を組み立てる（ブラウザ操作なし）
+
+    fields を渡すとその項目（ExtractPlan.fields）だけを組み立てる。部品を絞ったスナップショット（"parts" あり）で
+    読もうとした部品が無ければ missing に足す（呼び出し側で集めて組み立て直す）。
+    use_json=False なら snap の "json"（保存済みの API 応答・埋め込み JSON）は使わない（--capture-json なし）。
+    """
+    snap = snap or {}
+    collected = snap.get("parts")
+    missing = missing if missing is not None else set()
+
+    def want(name: str) -> bool:
+        return fields is None or name in fields
+
+    def has(part: str) -> bool:
+        if collected is None or part in collected:
+            return True
+        missing.add(part)
+        return False
+
     # 企業名: 見出しから推定
     company_name = ""
-    for sel in [
-        "h1",
-        "header h1",
-        "main h1",
-        "[class*=company] h1",
-        "[class*=Company] h1",
-    ]:
-        try:
-            if page.locator(sel).first.is_visible():
-                company_name = normalize_text(page.locator(sel).first.inner_text())
-                if company_name:
-                    break
-        except Exception:
-            pass
+    if want("company_name") and has("h1"):
+        for t in snap.get("h1") or []:
+            company_name = normalize_text(t)
+            if company_name:
+                break
 
     # 市場名: ページ全体テキストから抽出
-    try:
-        whole_text: str = page.evaluate("() => document.body ? document.body.innerText : ''")
-    except Exception:
-        whole_text = ""
-    market_match = MARKET_REGEX.search(whole_text)
-    market = market_match.group(1) if market_match else ""
+    def body_text() -> str:
+        return (snap.get("body") or "") if has("body") else ""
+
+    market = ""
+    if want("market"):
+        market_match = MARKET_REGEX.search(body_text())
+        market = market_match.group(1) if market_match else ""
 
     # ラベルに基づく値抽出（dt/dd, th/td, 兄弟要素などに対応）
-    def find_by_labels(labels: List[str]) -> Dict[str, Optional[str]]:
-        js_func = r"""
-        (labels) => {
-          function clean(t){return (t||'').replace(/\s+/g,' ').trim()}
-          function pickItems(el){
-            const items = Array.from(el.querySelectorAll('a')).map(a=>clean(a.innerText)).filter(Boolean);
-            return items;
-          }
-          const candidates = Array.from(document.querySelectorAll('dt,th,div,span,p,li,strong,b'));
-          for (const label of labels){
-            const target = candidates.find(e => {
-              if(!e || !e.innerText) return false;
-              const t = clean(e.innerText).replace(/\s+/g,'');
-              const L = label.replace(/\s+/g,'');
-              return t.startsWith(L) || t === L;
-            });
-            if(!target) continue;
-            let text = '';
-            let items = [];
-            if (target.tagName === 'DT'){
-              const dd = target.nextElementSibling;
-              if (dd && dd.tagName === 'DD'){
-                text = clean(dd.innerText);
-                items = pickItems(dd);
-              }
-            } else if (target.tagName === 'TH'){
-              let td = target.nextElementSibling;
-              if (!(td && td.tagName === 'TD') && target.parentElement){
-                td = target.parentElement.querySelector('td');
-              }
-              if (td){
-                text = clean(td.innerText);
-                items = pickItems(td);
-              }
-            } else {
-              const sib = target.nextElementSibling;
-              if (sib){
-                text = clean(sib.innerText);
-                items = pickItems(sib);
-              }
-            }
-            // 補助: 近傍コンテナからタグ・リンクを収集
-            if ((!text || !text.trim()) && target){
-              const container = target.closest('section,article,div,dl,table,ul,ol') || target.parentElement;
-              if (container){
-                const more = Array.from(container.querySelectorAll('a, .tag, li, span'))
-                  .map(n => clean(n.innerText))
-                  .filter(Boolean);
-                if (more.length){
-                  items = more;
-                  text = more.join(' ');
-                }
-              }
-            }
-            return { text, items };
-          }
-          return { text: '', items: [] };
-        }
-        """
-        try:
-            res = page.evaluate(js_func, labels)
-            return {"text": res.get("text") or "", "items": res.get("items") or []}
-        except Exception:
+    def find_by_labels(key: str) -> Dict[str, Any]:
+        if not has(f"label:{key}"):
             return {"text": "", "items": []}
+        res = (snap.get("labels") or {}).get(key) or {}
+        return {"text": res.get("text") or "", "items": res.get("items") or []}
 
-    def dt_items(label: str, stop_text: Optional[str] = None) -> List[str]:
-        js = r"""
-        (label, stopText) => {
-          function clean(t){return (t||'').replace(/\s+/g,' ').trim()}
-          const dts = Array.from(document.querySelectorAll('dt'));
-          const dt = dts.find(e => clean(e.innerText) === label);
-          if(!dt) return [];
-          const dd = dt.nextElementSibling;
-          if(!dd || dd.tagName !== 'DD') return [];
-          let items = [];
-          const stopEl = stopText ? Array.from(dd.querySelectorAll('*')).find(n => clean(n.innerText).includes(stopText)) : null;
-          const stopTop = stopEl ? stopEl.getBoundingClientRect().top : null;
-          const anchors = Array.from(dd.querySelectorAll('a, .tag, .chip, li, span'));
-          for (const n of anchors){
-            if (stopTop !== null){
-              const top = n.getBoundingClientRect().top;
-              if (top >= stopTop) continue;
-            }
-            const t = clean(n.innerText);
-            if (t) items.push(t);
-          }
-          return items;
-        }
-        """
-        try:
-            return page.evaluate(js, label, stop_text) or []
-        except Exception:
+    def dl_entry(label: str) -> Optional[Dict[str, Any]]:
+        if not has(f"dl:{label}"):
+            return None
+        for e in snap.get("dl") or []:
+            if e.get("dt") == label:
+                return e
+        return None
+
+    def dt_items(label: str, stop: bool = False) -> List[str]:
+        e = dl_entry(label)
+        if not e:
             return []
+        stop_top = e.get("stop_top") if stop else None
+        return [t for t, top in (e.get("items") or []) if stop_top is None or top < stop_top]
 
     def dt_extract(label: str) -> Dict[str, str]:
-        js = r"""
-        (label) => {
-          function clean(t){return (t||'').replace(/\s+/g,' ').trim()}
-          const dts = Array.from(document.querySelectorAll('dt'));
-          const dt = dts.find(e => clean(e.innerText) === label);
-          if(!dt) return { text: '' };
-          const dd = dt.nextElementSibling;
-          if(!dd || dd.tagName !== 'DD') return { text: '' };
-          return { text: clean(dd.innerText) };
-        }
-        """
-        try:
-            return page.evaluate(js, label) or {"text": ""}
-        except Exception:
-            return {"text": ""}
+        e = dl_entry(label)
+        return {"text": (e.get("text") or "") if e else ""}
 
-    feature = find_by_labels(["特色"]).get("text", "")
-    business = find_by_labels(["連結事業", "単独事業", "連結(単独)事業", "連結・単独事業", "連結/単独事業"]).get("text", "")
+    feature = find_by_labels("feature").get("text", "") if want("feature") else ""
+    business = find_by_labels("business").get("text", "") if want("business_composition") else ""
     # 余計な尾部テキスト（例: セグメント収益）を削除
     if business:
         business = re.split(r"\s*セグメント収益", business)[0]
 
-    industries_list = dt_items("所属業界", stop_text="比較会社")
+    industries_list = dt_items("所属業界", stop=True) if want("industries") else []
     # 比較会社リストは除外対象
-    comp_names = set(dt_items("比較会社"))
-    if not comp_names:
-        comp_res = find_by_labels(["比較会社"])
+    comp_names = set(dt_items("比較会社")) if want("comparison") else set()
+    if not comp_names and want("comparison"):
+        comp_res = find_by_labels("comparison")
         comp_names = set([x for x in (comp_res.get("items", []) or []) if isinstance(x, str)])
         # テキストからも補完
         comp_text = normalize_text(comp_res.get("text", ""))
@@ -225,10 +447,10 @@ def extract_fields(page, max_industries: int = 3) -> Dict[str, str]:
                 out.append(t)
         return out
     industries_items = filt(industries_list)
-    if not industries_items:
-        industries_res = find_by_labels(["所属業界"])
+    if want("industries") and not industries_items:
+        industries_res = find_by_labels("industries")
         industries_items = filt(industries_res.get("items", []) or [])  # type: ignore
-    if not industries_items:
+    if want("industries") and not industries_items:
         # dd素テキストから分割抽出のフォールバック
         ind_text = normalize_text(dt_extract("所属業界").get("text", ""))
         if ind_text:
@@ -261,7 +483,7 @@ def extract_fields(page, max_industries: int = 3) -> Dict[str, str]:
         industries_items = industries_items[:max_industries]
     industries = ""  # finalize after themes filtering
 
-    themes_list = dt_items("市場テーマ", stop_text="比較会社")
+    themes_list = dt_items("市場テーマ", stop=True) if want("themes") else []
     # テーマは数字混入を除外し、比較会社系を排除
     def filt_theme(xs: List[str]) -> List[str]:
         seen = set(); out: List[str] = []
@@ -278,29 +500,25 @@ def extract_fields(page, max_industries: int = 3) -> Dict[str, str]:
     # 比較会社名や汎用語『他』は除外
     filtered_theme_items = [t for t in filtered_theme_items if t not in comp_names and t != "他"]
     themes = ",".join(filtered_theme_items)
-    if not themes:
+    if want("themes") and not themes:
         # ddの素のテキストから分割抽出（最も厳密）
         dd_text = normalize_text(dt_extract("市場テーマ").get("text", ""))
         if dd_text:
             parts = [t for t in re.split(r"[、,\s]+", dd_text) if t and not re.search(r"\d", t) and "比較会社" not in t]
             parts = [t for t in parts if t not in comp_names and t != "他"]
             themes = ",".join(dict.fromkeys(parts))
-    if not themes:
+    if want("themes") and not themes:
         # 最後の手段: ラベル探索のテキストを使用し、同様に分割・フィルタ
-        themes_res = find_by_labels(["市場テーマ", "テーマ"])  # 念のため「テーマ」も含める
+        themes_res = find_by_labels("themes")  # 念のため「テーマ」も含める
         raw = normalize_text(themes_res.get("text", ""))
         if raw:
             raw = re.split(r"\s*比較会社", raw)[0]
             parts = [t for t in re.split(r"[、,\s]+", raw) if t and not re.search(r"\d", t)]
             parts = [t for t in parts if t not in comp_names and t != "他"]
             themes = ",".join(dict.fromkeys(parts))
-    if not themes:
+    if want("themes") and not themes:
         # 本文テキストからの正規表現抽出（市場テーマ行限定）
-        try:
-            body_text: str = page.evaluate("() => document.body ? document.body.innerText : ''") or ""
-        except Exception:
-            body_text = ""
-        m = re.search(r"市場テーマ\s*[:：]?\s*([^\n]+)", body_text)
+        m = re.search(r"市場テーマ\s*[:：]?\s*([^\n]+)", body_text())
         if m:
             raw = m.group(1)
             raw = re.split(r"\s*比較会社", raw)[0]
@@ -320,7 +538,7 @@ def extract_fields(page, max_industries: int = 3) -> Dict[str, str]:
 
     # 本文テキストからの安易な補完は誤抽出につながるため行わない
 
-    return {
+    out = {
         "company_name": normalize_text(company_name),
         "market": normalize_text(market),
         "feature": normalize_text(feature),
@@ -328,133 +546,2982 @@ def extract_fields(page, max_industries: int = 3) -> Dict[str, str]:
         "industries": normalize_text(industries),
         "themes": normalize_text(themes),
     }
+    if fields is not None:
+        out = {k: v for k, v in out.items() if k in fields}
+    # --capture-json で得た API 応答があれば、取れた項目はそちらを優先（DOMはフォールバック）
+    if use_json and snap.get("json"):
+        for k, v in fields_from_payloads(snap["json"], max_industries=max_industries).items():
+            if v and k in out:
+                out[k] = v
+    return out
+
+
+# SPA が読み込む JSON 応答から項目を拾う際のキー候補（小文字化・区切り記号除去後に比較）。
+# API 仕様は非公開のため、--snapshot-dir で保存した "json" を確認して必要に応じ追加する
+JSON_FIELD_KEYS: Dict[str, List[str]] = {
+    "company_name": ["companyname", "corpname", "stockname", "issuename", "meigaramei"],
+    "market": ["market", "marketname", "listedmarket", "shijo", "shijomei"],
+    "feature": ["feature", "features", "tokushoku", "characteristic"],
+    "business_composition": ["businesscomposition", "consolidatedbusiness", "renketsujigyo", "business"],
+    "industries": ["industries", "industry", "industrynames", "gyokai", "shozokugyokai"],
+    "themes": ["themes", "theme", "markettheme", "marketthemes", "shijotheme"],
+}
+LIST_FIELDS = ("industries", "themes")
+
+
+def _json_key(k: str) -> str:
+    return re.sub(r"[_\-\s]", "", str(k)).lower()
+
+
+def _json_list(v: Any) -> Optional[List[str]]:
+    if isinstance(v, str):
+        return [t for t in (normalize_text(x) for x in re.split(r"[、,]", v)) if t]
+    if isinstance(v, list):
+        out: List[str] = []
+        for x in v:
+            if isinstance(x, dict):
+                x = next((x[k] for k in ("name", "label", "title", "text") if isinstance(x.get(k), str)), None)
+            if isinstance(x, str) and normalize_text(x):
+                out.append(normalize_text(x))
+        return out
+    return None
+
+
+def fields_from_payloads(payloads: List[Dict[str, Any]], max_industries: int = 3) -> Dict[str, str]:
+    """捕捉した JSON 応答を幅優先で走査し、JSON_FIELD_KEYS に一致したキーの値を返す（見つかった項目のみ）"""
+    lookup = {alias: field for field, aliases in JSON_FIELD_KEYS.items() for alias in aliases}
+    found: Dict[str, Any] = {}
+    nodes: List[Any] = [p.get("body") for p in payloads]
+    while nodes and len(found) < len(JSON_FIELD_KEYS):
+        node = nodes.pop(0)
+        if isinstance(node, list):
+            nodes.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        for k, v in node.items():
+            field = lookup.get(_json_key(k))
+            if field and field not in found:
+                if field in LIST_FIELDS:
+                    items = _json_list(v)
+                    if items is not None:
+                        found[field] = items
+                        continue
+                elif isinstance(v, str):
+                    found[field] = normalize_text(v)
+                    continue
+            if isinstance(v, (dict, list)):
+                nodes.append(v)
+
+    out: Dict[str, str] = {}
+    for field, v in found.items():
+        if field not in LIST_FIELDS:
+            out[field] = v
+    if "market" in out:
+        m = MARKET_REGEX.search(out["market"])
+        out["market"] = m.group(1) if m else out["market"]
+    if "business_composition" in out:
+        out["business_composition"] = re.split(r"\s*セグメント収益", out["business_composition"])[0]
+    themes = list(dict.fromkeys(t for t in found.get("themes", []) if t != "他"))
+    industries = list(dict.fromkeys(t for t in found.get("industries", []) if t != "他" and not re.search(r"\d", t)))
+    # DOM経路と同様: テーマ語は業界から除外（全消失する場合は元を優先）し、上限件数で切る
+    if themes and industries:
+        industries = [x for x in industries if x not in themes] or industries
+    if max_industries is not None and max_industries > 0:
+        industries = industries[:max_industries]
+    if "themes" in found:
+        out["themes"] = ",".join(themes)
+    if "industries" in found:
+        out["industries"] = ",".join(industries)
+    return out
+
+
+def payload_fields_complete(payloads: List[Dict[str, Any]], fields: Optional[Collection[str]] = None) -> bool:
+    """fields（既定: 全項目）が JSON 応答だけで揃ったか"""
+    found = fields_from_payloads(payloads)
+    return all(k in found for k in JSON_FIELD_KEYS if fields is None or k in fields)
+
+
+class JsonCapture:
+    """page.on("response") で SPA 自身が読み込む JSON API 応答を集める（--capture-json）"""
+
+    def __init__(self, allow_hosts: List[str]):
+        self.allow_hosts = allow_hosts
+        self.pending: List[Any] = []
+        self.payloads: List[Dict[str, Any]] = []
+
+    def on_response(self, resp) -> None:
+        try:
+            if resp.request.resource_type not in ("xhr", "fetch") or resp.status != 200:
+                return
+            if "json" not in (resp.headers.get("content-type") or ""):
+                return
+            if not host_allowed(resp.url, self.allow_hosts):
+                return
+        except Exception:
+            return
+        self.pending.append(resp)
+
+    def drain_steps(self):
+        """届いた応答の本文を読む手順"""
+        while self.pending:
+            resp = self.pending.pop(0)
+            try:
+                self.payloads.append({"url": resp.url, "body": (yield resp.json)})
+            except Exception:
+                pass
+
+
+def snapshot_steps(page, parts: Optional[Iterable[str]] = None):
+    """SNAPSHOT_JS を実行する。parts を渡すとその部品だけを集め、集めた部品名を "parts" に入れる"""
+    try:
+        snap = (yield lambda: page.evaluate(SNAPSHOT_JS, snapshot_args(parts))) or {}
+    except Exception:
+        snap = {}
+    if parts is not None:
+        snap["parts"] = sorted(parts)
+    return snap
+
+
+def take_snapshot(page, parts: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    return run_steps(snapshot_steps(page, parts))
+
+
+async def take_snapshot_async(page, parts: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    return await run_steps_async(snapshot_steps(page, parts))
+
+
+def extract_fields(page, max_industries: int = 3) -> Dict[str, str]:
+    return fields_from_snapshot(take_snapshot(page), max_industries=max_industries)
+
+
+async def extract_fields_async(page, max_industries: int = 3) -> Dict[str, str]:
+    """extract_fields の playwright.async_api 版"""
+    return fields_from_snapshot(await take_snapshot_async(page), max_industries=max_industries)
+
+
+def extract_planned_steps(
+    page, snap: Dict[str, Any], plan: Optional[ExtractPlan], max_industries: int, timings: Dict[str, float]
+):
+    """plan の項目を snap から組み立てる。フォールバックで読む部品が足りなければ、その部品だけ集めて組み立て直す。
+
+    timings の "extract" は組み立ての所要秒、追加の evaluate は "snapshot" に加算する
+    """
+    fields = plan.fields if plan is not None else None
+    extra = 0.0
+    t0 = time.monotonic()
+    while True:
+        missing: Set[str] = set()
+        out = fields_from_snapshot(snap, max_industries=max_industries, fields=fields, missing=missing)
+        if not missing:
+            break
+        t1 = time.monotonic()
+        merge_snapshot(snap, (yield from snapshot_steps(page, missing)))
+        extra += time.monotonic() - t1
+    timings["extract"] = time.monotonic() - t0 - extra
+    if extra:
+        timings["snapshot"] = timings.get("snapshot", 0.0) + extra
+    return out
+
 
+def extract_planned(
+    page, snap: Dict[str, Any], plan: Optional[ExtractPlan], max_industries: int, timings: Dict[str, float]
+) -> Dict[str, str]:
+    return run_steps(extract_planned_steps(page, snap, plan, max_industries, timings))
 
-def scrape_one(page, code: str, max_industries: int = 3) -> Dict[str, str]:
-    url = TARGET_URL.format(code=code)
-    resp = page.goto(url, wait_until="networkidle")
+
+MODAL_SELECTORS = ["#tpModal .pi_close", "button:has-text('同意')", "button:has-text('OK')", "[aria-label='close']"]
+
+
+def dom_snapshot_steps(page, timings: Optional[Dict[str, float]] = None, parts: Optional[List[str]] = None):
+    """モーダルを閉じてからスナップショットを取る。timings には "modal" / "snapshot" の所要秒を記録する
+
+    parts を渡すとその部品だけを集める（空なら evaluate もモーダル処理もしない）
+    """
+    timings = timings if timings is not None else {}
+    if parts is not None and not parts:
+        return {"parts": []}
+    t0 = time.monotonic()
+    # 既知のモーダル等があれば閉じる（失敗しても続行）
+    for sel in MODAL_SELECTORS:
+        try:
+            if (yield page.locator(sel).first.is_visible):
+                yield page.locator(sel).first.click
+                break
+        except Exception:
+            pass
+    t1 = time.monotonic()
+    timings["modal"] = t1 - t0
+    snap = yield from snapshot_steps(page, parts)
+    timings["snapshot"] = time.monotonic() - t1
+    return snap
+
+
+def dom_snapshot(
+    page, timings: Optional[Dict[str, float]] = None, parts: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    return run_steps(dom_snapshot_steps(page, timings, parts))
+
+
+def check_status(resp, code: str) -> None:
     try:
         status = resp.status if resp else None
     except Exception:
         status = None
+    check_http_status(status, code)
+
+
+def check_http_status(status: Optional[int], code: str) -> None:
     # 404/410 は恒久的エラーとみなしリトライしない
     if status in (404, 410):
         raise NonRetryableError(f"HTTP {status} for code {code}")
+    if status is not None and (status == 429 or status >= 500):
+        raise TransientHTTPError(f"HTTP {status} for code {code}")
 
-    # 既知のモーダル等があれば閉じる（失敗しても続行）
-    for sel in ["#tpModal .pi_close", "button:has-text('同意')", "button:has-text('OK')", "[aria-label='close']"]:
+
+# --fast-load: 取得不要なリソース種別と、許可ホスト以外（広告・計測等）への通信を遮断する
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+READY_SELECTOR = "dt:has-text('特色'), dt:has-text('所属業界')"
+
+
+class LoadTotals:
+    """--load-stats の実行全体（--serve では要求ごと）の合計。FetchOptions が持ち、ワーカー間で共有する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.requests = 0
+        self.blocked = 0
+        self.bytes = 0
+
+    def add(self, stats: "LoadStats") -> None:
+        with self._lock:
+            self.pages += 1
+            self.requests += stats.requests
+            self.blocked += stats.blocked
+            self.bytes += stats.bytes
+
+    def summary(self) -> str:
+        n = max(1, self.pages)
+        return (
+            f"[LOAD] pages={self.pages} avg requests={self.requests / n:.1f} "
+            f"avg blocked={self.blocked / n:.1f} avg bytes={self.bytes / n / 1024:.1f}KB"
+        )
+
+
+class LoadStats:
+    """ページ単位のリクエスト数・遮断数・転送バイト数（--load-stats / --fast-load）"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.blocked = 0
+        self.bytes = 0
+        self.started = time.time()
+
+    def on_request(self, request) -> None:
+        self.requests += 1
+
+    def on_loading_finished(self, event) -> None:
         try:
-            if page.locator(sel).first.is_visible():
-                page.locator(sel).first.click()
-                break
+            self.bytes += int(event.get("encodedDataLength") or 0)
         except Exception:
             pass
 
-    fields = extract_fields(page, max_industries=max_industries)
-    fields.update({"code": code})
-    return fields
+    def finish(self, code: str, totals: Optional[LoadTotals] = None) -> None:
+        elapsed = time.time() - self.started
+        print(
+            f"[LOAD] {code} requests={self.requests} blocked={self.blocked} "
+            f"bytes={self.bytes / 1024:.1f}KB time={elapsed:.2f}s",
+            file=sys.stderr,
+        )
+        if totals is not None:
+            totals.add(self)
 
 
-def main():
-    import argparse
+def host_allowed(url: str, allow_hosts: List[str]) -> bool:
+    host = (urlsplit(url).hostname or "").lower()
+    if not host:
+        return True
+    return any(host == h or host.endswith("." + h) for h in allow_hosts)
 
-    parser = argparse.ArgumentParser(description="Shikiho Online scraper")
-    parser.add_argument("--input", default="codelist.csv", help="input CSV path (with header 'code')")
-    parser.add_argument("--output", default="result.csv", help="output CSV path")
-    parser.add_argument("--sleep", type=float, default=1.0, help="sleep seconds between requests")
-    parser.add_argument("--limit", type=int, default=0, help="limit number of codes (0=all)")
-    parser.add_argument(
-        "--max-industries", type=int, default=3, help="maximum number of industries to keep (0=unlimited)"
-    )
-    parser.add_argument(
-        "--fields",
-        default="code,company_name,market,feature,business_composition,industries,themes",
-        help="comma-separated output fields (default: all)",
-    )
-    parser.add_argument(
-        "--eta-interval",
-        type=int,
-        default=0,
-        help="print progress and ETA every N items (0=disabled)",
-    )
-    # Timeouts and UA
-    parser.add_argument("--timeout", type=int, default=20000, help="default action timeout in milliseconds")
-    parser.add_argument("--nav-timeout", type=int, default=20000, help="navigation timeout in milliseconds")
-    parser.add_argument(
-        "--user-agent",
-        default=(
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/120.0.0.0 Safari/537.36"
-        ),
-        help="custom User-Agent string",
-    )
-    # Retry/jitter options (defaults keep current behavior: disabled)
-    parser.add_argument("--retries", type=int, default=0, help="number of retries on transient failures")
-    parser.add_argument(
-        "--retry-base", type=float, default=1.0, help="base seconds for exponential backoff"
-    )
-    parser.add_argument(
-        "--retry-factor", type=float, default=1.6, help="multiplicative factor for backoff"
-    )
-    parser.add_argument(
-        "--retry-max", type=float, default=15.0, help="maximum backoff per attempt (seconds)"
-    )
-    parser.add_argument(
-        "--jitter-frac", type=float, default=0.0, help="fractional jitter for --sleep (e.g., 0.3 => ±30%)"
-    )
-    # Failure tracking and resume/append
-    parser.add_argument("--failures", default="", help="path to write failed codes CSV (code,reason). empty=disable")
-    parser.add_argument(
-        "--failures-auto",
-        action="store_true",
-        help="auto-append timestamp suffix to failures CSV; if --failures is empty, create failures_YYYYMMDD_HHMM.csv",
-    )
-    parser.add_argument("--resume", action="store_true", help="skip codes already present in --output")
-    parser.add_argument("--append", action="store_true", help="append to --output if it exists (no header)")
-    parser.add_argument("--verbose", action="store_true", help="enable more verbose logs")
-    parser.add_argument(
-        "--from-failures",
-        default="",
-        help="read input codes from a failures CSV (uses 'code' column) instead of --input",
-    )
-    # Browser mode
-    parser.add_argument("--headed", dest="headless", action="store_false", help="run with browser UI (non-headless)")
-    parser.add_argument("--headless", dest="headless", action="store_true", help="run headless (default)")
-    parser.set_defaults(headless=True)
-    args = parser.parse_args()
 
+def should_block(request, allow_hosts: List[str]) -> bool:
+    if request.resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    return not host_allowed(request.url, allow_hosts)
+
+
+def parse_allow_hosts(value: str) -> List[str]:
+    return [h.strip().lower() for h in value.split(",") if h.strip()]
+
+
+def route_steps(route, stats: "LoadStats", allow_hosts: List[str]):
+    if should_block(route.request, allow_hosts):
+        stats.blocked += 1
+        yield route.abort
+    else:
+        yield route.continue_
+
+
+def prepare_page_steps(context, page, args, run):
+    """--fast-load の遮断ルールと --load-stats の計測を設定する。run は遮断ハンドラで手順を進める関数"""
+    if not (args.fast_load or args.load_stats):
+        return None
+    stats = LoadStats()
+    if args.fast_load:
+        allow_hosts = parse_allow_hosts(args.allow_hosts)
+        # async API では run_steps_async が返すコルーチンを Playwright が待つ
+        yield lambda: context.route("**/*", lambda route: run(route_steps(route, stats, allow_hosts)))
+    page.on("request", stats.on_request)
     try:
-        if args.from_failures:
-            # Read codes from failures CSV (expects a 'code' header; ignores 'reason')
-            codes: List[str] = []
-            with open(args.from_failures, "r", encoding="utf-8-sig", newline="") as f:
-                r = csv.DictReader(f)
-                if not r.fieldnames or "code" not in r.fieldnames:
-                    raise ValueError("failures CSV must have a 'code' header")
-                seen = set()
-                for row in r:
-                    c = (row.get("code") or "").strip()
-                    if not c or c in seen:
-                        continue
-                    seen.add(c)
-                    codes.append(c)
-            if args.verbose:
-                print(f"[INFO] loaded {len(codes)} codes from failures: {args.from_failures}", file=sys.stderr)
-        else:
-            codes = read_codes(args.input)
+        cdp = yield lambda: context.new_cdp_session(page)
+        yield lambda: cdp.send("Network.enable")
+        cdp.on("Network.loadingFinished", stats.on_loading_finished)
     except Exception as e:
-        src = args.from_failures or args.input
-        print(f"[ERROR] failed to read {src}: {e}", file=sys.stderr)
-        sys.exit(1)
+        print(f"[WARN] byte counting unavailable: {e}", file=sys.stderr)
+    return stats
 
-    if args.limit > 0:
-        codes = codes[: args.limit]
 
-    default_fields = [
-        "code",
-        "company_name",
-        "market",
+def prepare_page(context, page, args) -> Optional[LoadStats]:
+    return run_steps(prepare_page_steps(context, page, args, run_steps))
+
+
+async def prepare_page_async(context, page, args) -> Optional[LoadStats]:
+    return await run_steps_async(prepare_page_steps(context, page, args, run_steps_async))
+
+
+def wait_ready_steps(page, fast_load: bool, ready_timeout: int):
+    if fast_load:
+        # 特色/所属業界の dt が現れた時点で抽出に進む（見つからなければ従来通り networkidle を待つ）
+        try:
+            yield lambda: page.wait_for_selector(READY_SELECTOR, state="attached", timeout=ready_timeout)
+            return
+        except pw_timeout_error():
+            pass
+    yield lambda: page.wait_for_load_state("networkidle")
+
+
+def scrape_one_steps(
+    page,
+    code: str,
+    max_industries: int = 3,
+    fast_load: bool = False,
+    ready_timeout: int = 15000,
+    keep_snapshot: bool = False,
+    capture_hosts: Optional[List[str]] = None,
+    json_timeout: int = 3000,
+    timings: Optional[Dict[str, float]] = None,
+    url_template: str = TARGET_URL,
+    plan: Optional[ExtractPlan] = None,
+    nav_gate: Optional["NavGate"] = None,
+):
+    """1銘柄を取得する手順（scrape_one / scrape_one_async）。
+
+    timings を渡すとフェーズごとの所要秒を記録する: "goto"（遷移〜読み込み完了）、
+    "json_wait"（--capture-json の応答待ち）、"modal"、"snapshot"（page.evaluate）、"extract"（Python側の組み立て）。
+    plan を渡すとその項目に必要な部品だけを集める（None は全部品）。
+    nav_gate（async のみ）を渡すと読み込み完了までをゲート内で行い、抽出は他のタブの遷移と重ねる
+    """
+    url = url_template.format(code=code)
+    timings = timings if timings is not None else {}
+    wanted = plan.fields if plan is not None else None
+    parts = plan.parts if plan is not None else None
+    gate_held = False
+    if nav_gate is not None:
+        timings["sleep"] = timings.get("sleep", 0.0) + (yield nav_gate.acquire)
+        gate_held = True
+
+    def loaded() -> None:
+        nonlocal gate_held
+        if gate_held:
+            gate_held = False
+            nav_gate.release()
+
+    t0 = time.monotonic()
+    capture = JsonCapture(capture_hosts) if capture_hosts is not None else None
+    try:
+        if capture is None:
+            resp = yield lambda: page.goto(url, wait_until="domcontentloaded" if fast_load else "networkidle")
+            check_status(resp, code)
+            if fast_load:
+                yield from wait_ready_steps(page, fast_load, ready_timeout)
+            timings["goto"] = time.monotonic() - t0
+            loaded()
+            snap = yield from dom_snapshot_steps(page, timings, parts)
+        else:
+            page.on("response", capture.on_response)
+            try:
+                # API 応答が揃った時点で確定（レンダリング完了は待たない）。揃わなければ DOM 抽出にフォールバック
+                resp = yield lambda: page.goto(url, wait_until="commit")
+                check_status(resp, code)
+                timings["goto"] = time.monotonic() - t0
+                deadline = time.monotonic() + json_timeout / 1000.0
+                while True:
+                    yield from capture.drain_steps()
+                    if payload_fields_complete(capture.payloads, wanted) or time.monotonic() >= deadline:
+                        break
+                    yield lambda: page.wait_for_timeout(100)
+                if payload_fields_complete(capture.payloads, wanted):
+                    timings["json_wait"] = time.monotonic() - t0 - timings["goto"]
+                    loaded()
+                    snap = {}
+                else:
+                    yield from wait_ready_steps(page, fast_load, ready_timeout)
+                    timings["json_wait"] = time.monotonic() - t0 - timings["goto"]
+                    loaded()
+                    yield from capture.drain_steps()
+                    snap = yield from dom_snapshot_steps(page, timings, parts)
+            finally:
+                page.remove_listener("response", capture.on_response)
+            snap["json"] = capture.payloads
+    finally:
+        # 失敗した場合も次の遷移を止めない
+        loaded()
+
+    fields = yield from extract_planned_steps(page, snap, plan, max_industries, timings)
+    fields.update({"code": code})
+    if keep_snapshot:
+        fields[SNAPSHOT_KEY] = snap
+    return fields
+
+
+def scrape_one(page, code: str, **kwargs) -> Dict[str, Any]:
+    """1銘柄を取得する（sync API）。引数は scrape_one_steps と同じ"""
+    return run_steps(scrape_one_steps(page, code, **kwargs))
+
+
+async def scrape_one_async(page, code: str, **kwargs) -> Dict[str, Any]:
+    return await run_steps_async(scrape_one_steps(page, code, **kwargs))
+
+
+# --http-first: ブラウザを使わない取得。通常の HTTP 応答（サーバー側で描画された HTML と埋め込み JSON）から
+# SNAPSHOT_JS と同じ形のスナップショットを作り、fields_from_snapshot で組み立てる
+HTTP_MAX_REDIRECTS = 3
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+RAW_TEXT_TAGS = {"script", "style", "noscript", "template"}
+BLOCK_TAGS = {
+    "address", "article", "aside", "br", "dd", "div", "dl", "dt", "footer", "h1", "h2", "h3", "h4", "h5", "h6",
+    "header", "li", "main", "nav", "ol", "p", "section", "table", "td", "th", "tr", "ul",
+}
+# 開いたままの要素を暗黙に閉じる組（dt/dd, li, p は終了タグの省略が許される）
+IMPLIED_END = {"dt": {"dt", "dd"}, "dd": {"dt", "dd"}, "li": {"li"}, "p": {"p"}, "tr": {"tr"}, "td": {"td", "th"}, "th": {"td", "th"}}
+# ブロック要素の開始タグも開いている p を閉じる（ブラウザの DOM と同じく dl 等を p の外に置く）
+IMPLIED_END.update(
+    (tag, {"p"})
+    for tag in (
+        "address", "article", "aside", "blockquote", "div", "dl", "fieldset", "footer", "form",
+        "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "main", "nav", "ol", "pre", "section", "table", "ul",
+    )
+)
+
+
+class HtmlNode:
+    __slots__ = ("tag", "classes", "children", "parent", "order")
+
+    def __init__(self, tag: str, classes: List[str], parent: Optional["HtmlNode"], order: int):
+        self.tag = tag
+        self.classes = classes
+        self.children: List[Any] = []
+        self.parent = parent
+        self.order = order
+
+    def elements(self) -> List["HtmlNode"]:
+        return [c for c in self.children if isinstance(c, HtmlNode)]
+
+    def next_element(self) -> Optional["HtmlNode"]:
+        if self.parent is None:
+            return None
+        siblings = self.parent.elements()
+        k = siblings.index(self)
+        return siblings[k + 1] if k + 1 < len(siblings) else None
+
+    def descendants(self):
+        for c in self.children:
+            if isinstance(c, HtmlNode):
+                yield c
+                yield from c.descendants()
+
+
+class HtmlTree(HTMLParser):
+    """html.parser で組む最小限の要素木。script/style の中身は本文に含めず、JSON の script だけ別に保持する"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = HtmlNode("#root", [], None, 0)
+        self.stack = [self.root]
+        self.count = 0
+        self.raw: Optional[Tuple[str, bool]] = None
+        self.raw_text: List[str] = []
+        self.json_scripts: List[str] = []
+        self._text: Dict[int, str] = {}
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if self.raw is not None:
+            return
+        a = dict(attrs)
+        if tag in RAW_TEXT_TAGS:
+            is_json = tag == "script" and ("json" in (a.get("type") or "") or a.get("id") == "__NEXT_DATA__")
+            self.raw = (tag, is_json)
+            self.raw_text = []
+            return
+        closes = IMPLIED_END.get(tag)
+        if closes:
+            for k in range(len(self.stack) - 1, 0, -1):
+                t = self.stack[k].tag
+                if t in closes:
+                    del self.stack[k:]
+                    break
+                if t in ("dl", "ul", "ol", "table", "div", "section"):
+                    break
+        self.count += 1
+        node = HtmlNode(tag, (a.get("class") or "").split(), self.stack[-1], self.count)
+        self.stack[-1].children.append(node)
+        if tag not in VOID_TAGS:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self.raw is None and self.stack[-1].tag == tag:
+            self.stack.pop()
+
+    def handle_endtag(self, tag: str) -> None:
+        if self.raw is not None:
+            if tag == self.raw[0]:
+                if self.raw[1]:
+                    self.json_scripts.append("".join(self.raw_text))
+                self.raw = None
+            return
+        for k in range(len(self.stack) - 1, 0, -1):
+            if self.stack[k].tag == tag:
+                del self.stack[k:]
+                return
+
+    def handle_data(self, data: str) -> None:
+        if self.raw is not None:
+            self.raw_text.append(data)
+        else:
+            self.stack[-1].children.append(data)
+
+    def text(self, node: HtmlNode) -> str:
+        """innerText の近似（ブロック要素の前後で改行）。要素ごとに1回だけ計算する"""
+        cached = self._text.get(node.order)
+        if cached is not None:
+            return cached
+        out: List[str] = []
+        for c in node.children:
+            if isinstance(c, str):
+                out.append(c)
+            elif c.tag in BLOCK_TAGS:
+                out.append("\n" + self.text(c) + "\n")
+            else:
+                out.append(self.text(c))
+        s = "".join(out)
+        self._text[node.order] = s
+        return s
+
+
+def _is_item(node: HtmlNode, tags: Tuple[str, ...], classes: Tuple[str, ...]) -> bool:
+    return node.tag in tags or any(c in node.classes for c in classes)
+
+
+def snapshot_from_html(html_text: str) -> Dict[str, Any]:
+    """HTML から SNAPSHOT_JS と同じ形のスナップショットを作る（可視判定と座標は文書順で近似）"""
+    tree = HtmlTree()
+    tree.feed(html_text)
+    tree.close()
+    nodes = list(tree.root.descendants())
+
+    def clean(t: str) -> str:
+        return re.sub(r"\s+", " ", t or "").strip()
+
+    def pick_items(el: HtmlNode) -> List[str]:
+        return [t for t in (clean(tree.text(n)) for n in el.descendants() if n.tag == "a") if t]
+
+    h1 = [next((tree.text(n) for n in nodes if n.tag == "h1"), "")]
+
+    dl = []
+    for dt in (n for n in nodes if n.tag == "dt"):
+        entry: Dict[str, Any] = {"dt": clean(tree.text(dt)), "text": "", "items": [], "stop_top": None}
+        dd = dt.next_element()
+        if dd is not None and dd.tag == "dd":
+            entry["text"] = clean(tree.text(dd))
+            stop = next((n for n in dd.descendants() if "比較会社" in clean(tree.text(n))), None)
+            entry["stop_top"] = stop.order if stop is not None else None
+            for n in dd.descendants():
+                t = clean(tree.text(n))
+                if t and _is_item(n, ("a", "li", "span"), ("tag", "chip")):
+                    entry["items"].append([t, n.order])
+        dl.append(entry)
+
+    candidates = [n for n in nodes if n.tag in ("dt", "th", "div", "span", "p", "li", "strong", "b")]
+    compact_cache: Dict[int, str] = {}
+
+    def compact(n: HtmlNode) -> str:
+        if n.order not in compact_cache:
+            compact_cache[n.order] = re.sub(r"\s+", "", tree.text(n))
+        return compact_cache[n.order]
+
+    labels: Dict[str, Dict[str, Any]] = {}
+    for key, group in LABEL_GROUPS.items():
+        labels[key] = {"text": "", "items": []}
+        for label in group:
+            compact_label = re.sub(r"\s+", "", label)
+            target = next((n for n in candidates if compact(n).startswith(compact_label)), None)
+            if target is None:
+                continue
+            text, items = "", []
+            if target.tag == "dt":
+                dd = target.next_element()
+                if dd is not None and dd.tag == "dd":
+                    text, items = clean(tree.text(dd)), pick_items(dd)
+            elif target.tag == "th":
+                td = target.next_element()
+                if not (td is not None and td.tag == "td") and target.parent is not None:
+                    td = next((n for n in target.parent.descendants() if n.tag == "td"), None)
+                if td is not None:
+                    text, items = clean(tree.text(td)), pick_items(td)
+            else:
+                sib = target.next_element()
+                if sib is not None:
+                    text, items = clean(tree.text(sib)), pick_items(sib)
+            if not text:
+                container = target
+                while container is not None and container.tag not in ("section", "article", "div", "dl", "table", "ul", "ol"):
+                    container = container.parent
+                container = container or target.parent
+                if container is not None:
+                    more = [
+                        t
+                        for t in (clean(tree.text(n)) for n in container.descendants() if _is_item(n, ("a", "li", "span"), ("tag",)))
+                        if t
+                    ]
+                    if more:
+                        items, text = more, " ".join(more)
+            labels[key] = {"text": text, "items": items}
+            break
+
+    body = next((n for n in nodes if n.tag == "body"), tree.root)
+    snap: Dict[str, Any] = {"h1": h1, "body": tree.text(body), "dl": dl, "th": [], "labels": labels}
+    payloads = []
+    for raw in tree.json_scripts:
+        try:
+            payloads.append({"url": "inline", "body": json.loads(raw)})
+        except ValueError:
+            pass
+    if payloads:
+        snap["json"] = payloads
+    return snap
+
+
+class HttpFetcher:
+    """--http-first: ワーカーごとの keep-alive 接続。gzip/deflate 圧縮に対応し、切断されていれば1回だけ張り直す"""
+
+    def __init__(self, args):
+        self.user_agent = args.user_agent
+        self.timeout = args.nav_timeout / 1000.0
+        self.conn: Optional[http.client.HTTPConnection] = None
+        self.origin: Optional[Tuple[str, str]] = None
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        if self.conn is None or self.origin != (scheme, netloc):
+            self.close()
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            self.conn = cls(netloc, timeout=self.timeout)
+            self.origin = (scheme, netloc)
+        return self.conn
+
+    def _request(self, url: str) -> Tuple[int, Dict[str, str], bytes]:
+        parts = urlsplit(url)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        headers = {
+            "User-Agent": self.user_agent,
+            "Accept": "text/html,application/xhtml+xml,application/json;q=0.9,*/*;q=0.8",
+            "Accept-Encoding": "gzip, deflate",
+            "Accept-Language": "ja,en;q=0.8",
+        }
+        for retry in (False, True):
+            conn = self._connection(parts.scheme, parts.netloc)
+            try:
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (ConnectionError, http.client.HTTPException):
+                # keep-alive 中にサーバー側で閉じられた接続は張り直して1回だけ再送する
+                self.close()
+                if retry:
+                    raise
+                continue
+            resp_headers = {k.lower(): v for k, v in resp.getheaders()}
+            if resp_headers.get("connection", "").lower() == "close":
+                self.close()
+            return resp.status, resp_headers, body
+        raise ConnectionError(f"cannot reach {parts.netloc}")
+
+    def get(self, url: str) -> Tuple[int, str]:
+        """GET して (status, 本文) を返す。リダイレクトは HTTP_MAX_REDIRECTS 回まで追う"""
+        for _ in range(HTTP_MAX_REDIRECTS + 1):
+            status, headers, body = self._request(url)
+            if status in (301, 302, 303, 307, 308) and headers.get("location"):
+                url = urljoin(url, headers["location"])
+                continue
+            encoding = headers.get("content-encoding", "").lower()
+            if encoding == "gzip":
+                body = gzip.decompress(body)
+            elif encoding == "deflate":
+                try:
+                    body = zlib.decompress(body)
+                except zlib.error:
+                    body = zlib.decompress(body, -zlib.MAX_WBITS)
+            m = re.search(r"charset=([\w-]+)", headers.get("content-type", ""), re.I)
+            try:
+                return status, body.decode(m.group(1) if m else "utf-8", errors="replace")
+            except LookupError:
+                return status, body.decode("utf-8", errors="replace")
+        raise TransientHTTPError(f"too many redirects for {url}")
+
+    def close(self) -> None:
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+        self.conn = None
+        self.origin = None
+
+
+def http_required(args) -> List[str]:
+    """--http-first で HTTP の結果を採用する条件（空であってはならない項目）。既定は出力する項目"""
+    spec = args.http_require or args.fields
+    return [f.strip() for f in spec.split(",") if f.strip() in CONTENT_FIELDS] or list(CONTENT_FIELDS)
+
+
+class FetchOptions:
+    """銘柄・試行ごとに変わらない抽出の設定。main()（--serve では要求ごと）で1回だけ作り、レート制御と同じく引数で渡す
+
+    plan は抽出計画（None は全部品）、capture_hosts は --capture-json の許可ホスト（無効なら None）、
+    http_required は --http-first で HTTP の結果を採用する条件。load_totals は --load-stats の集計先
+    （実行ごとに新しく作る）。
+    """
+
+    def __init__(self, args):
+        self.plan = extract_plan(args)
+        self.capture_hosts = parse_allow_hosts(args.allow_hosts) if args.capture_json else None
+        self.http_required = http_required(args)
+        self.max_industries = args.max_industries if args.max_industries > 0 else 999999
+        self.load_totals = LoadTotals()
+
+
+def fetch_http(
+    fetcher: HttpFetcher, code: str, args, opts: FetchOptions, timings: Dict[str, float]
+) -> Tuple[Dict[str, Any], List[str]]:
+    """ブラウザを使わずに1銘柄を取得し (record, 空だった必須項目) を返す。404/410・429/5xx は scrape_one と同じ例外"""
+    t0 = time.monotonic()
+    try:
+        status, html_text = fetcher.get(args.target_url.format(code=code))
+        check_http_status(status, code)
+        snap = snapshot_from_html(html_text) if status == 200 else {}
+    finally:
+        timings["http"] = time.monotonic() - t0
+    plan = opts.plan
+    record: Dict[str, Any] = fields_from_snapshot(
+        snap,
+        max_industries=opts.max_industries,
+        fields=plan.fields if plan else None,
+        use_json=opts.capture_hosts is not None,
+    )
+    record["code"] = code
+    if args.snapshot_dir:
+        record[SNAPSHOT_KEY] = snap
+    return record, [f for f in opts.http_required if not record.get(f)]
+
+
+def http_attempt(
+    fetcher: HttpFetcher, code: str, args, opts: FetchOptions, timings: Dict[str, float]
+) -> Optional[Dict[str, Any]]:
+    """--http-first の1試行。必須項目が揃えば record、揃わない・通信できなければ None（ブラウザで取得し直す）"""
+    try:
+        record, missing = fetch_http(fetcher, code, args, opts, timings)
+    except (NonRetryableError, TransientHTTPError):
+        raise
+    except Exception as e:
+        if args.verbose:
+            print(f"[INFO] {code}: HTTP fetch failed ({e}); using the browser", file=sys.stderr)
+        return None
+    if missing:
+        if args.verbose:
+            print(f"[INFO] {code}: HTTP response lacks {', '.join(missing)}; using the browser", file=sys.stderr)
+        return None
+    record[PATH_KEY] = "http"
+    return record
+
+
+class TokenBucket:
+    """全ワーカー共通のリクエストレート上限（トークンバケット）。rate<=0 で無制限"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """トークンを1つ取得できれば 0、できなければ必要な待機秒を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def observe(self, latency: Optional[float], error: bool = False) -> None:
+        """取得結果のフィードバック（固定レートでは何もしない）"""
+
+
+class AdaptiveRate(TokenBucket):
+    """AIMD によるレート制御（--adaptive）
+
+    遷移レイテンシとエラー率が健全な間は rate を step ずつ加算し、タイムアウト・429/5xx・
+    レイテンシ急増（EWMA の spike 倍超）で backoff 倍に下げる。常に [min_rate, max_rate] に収める。
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        step: float = 0.02,
+        backoff: float = 0.5,
+        spike: float = 2.0,
+    ):
+        super().__init__(min(max_rate, max(min_rate, rate)))
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.step = step
+        self.backoff = backoff
+        self.spike = spike
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.samples = 0
+        self._last_decrease = 0.0
+        self._last_log = time.monotonic()
+
+    def _set_rate(self, new_rate: float, reason: str, force_log: bool) -> None:
+        old = self.rate
+        self.rate = min(self.max_rate, max(self.min_rate, new_rate))
+        now = time.monotonic()
+        if self.rate != old and (force_log or now - self._last_log >= 10.0):
+            print(f"[RATE] {old:.3f} -> {self.rate:.3f} req/s ({reason})", file=sys.stderr)
+            self._last_log = now
+
+    def observe(self, latency: Optional[float], error: bool = False) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.error_ewma = 0.8 * self.error_ewma + 0.2 * (1.0 if error else 0.0)
+            spiked = False
+            if latency is not None:
+                self.samples += 1
+                if self.latency_ewma is None:
+                    self.latency_ewma = latency
+                else:
+                    spiked = self.samples > 5 and latency > self.latency_ewma * self.spike
+                    self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency
+            if error or spiked:
+                # 連続した失敗で下げすぎないよう、減速は現在の間隔の2倍（最低2秒）に1回まで
+                cooldown = max(2.0, 2.0 / self.rate) if self.rate > 0 else 2.0
+                if now - self._last_decrease >= cooldown:
+                    self._last_decrease = now
+                    reason = "error" if error else f"latency {latency:.2f}s > {self.spike:.1f}x avg"
+                    self._set_rate(self.rate * self.backoff, reason, force_log=True)
+            elif self.error_ewma < 0.1:
+                self._set_rate(self.rate + self.step, "healthy", force_log=False)
+
+
+def make_limiter(args, n_workers: int) -> Optional[TokenBucket]:
+    """--adaptive なら AIMD、並列時・--max-rate 指定時は固定レートのトークンバケット、それ以外は None（--sleep で待機）"""
+    rate = args.max_rate if args.max_rate > 0 else (1.0 / args.sleep if args.sleep > 0 else 0.0)
+    if args.adaptive:
+        start = rate if rate > 0 else args.rate_min
+        return AdaptiveRate(start, args.rate_min, args.rate_max, step=args.rate_step, backoff=args.rate_backoff)
+    if n_workers > 1 or args.max_rate > 0:
+        return TokenBucket(rate)
+    return None
+
+
+# scrape_one が保存用スナップショットを record に添えるときのキー（CSVには出力しない）
+SNAPSHOT_KEY = "_snapshot"
+# --http-first で、どちらの経路（"http" / "browser"）で取得したかを record に添えるキー（CSVには出力しない）
+PATH_KEY = "_path"
+
+
+class SnapshotStore:
+    """レンダリング後スナップショットの保存先（内容アドレス方式・gzip圧縮）
+
+    本体は objects/<sha256先頭2桁>/<sha256>.json.gz、日付ごとの code→sha 対応は refs/<YYYYMMDD>.jsonl に追記する。
+    同一内容のページは日付をまたいで1ファイルを共有する。
+    """
+
+    def __init__(self, root: str, date: str):
+        self.root = root
+        self.date = date
+        self._lock = threading.Lock()
+
+    @property
+    def refs_path(self) -> str:
+        return os.path.join(self.root, "refs", f"{self.date}.jsonl")
+
+    def object_path(self, sha: str) -> str:
+        return os.path.join(self.root, "objects", sha[:2], f"{sha}.json.gz")
+
+    def put(self, code: str, snap: Dict[str, Any]) -> str:
+        data = json.dumps(snap, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        sha = hashlib.sha256(data).hexdigest()
+        path = self.object_path(sha)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp, "wb", compresslevel=6) as f:
+                f.write(data)
+            os.replace(tmp, path)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.refs_path), exist_ok=True)
+            with open(self.refs_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"code": code, "sha": sha, "ts": int(time.time())}) + "\n")
+        return sha
+
+    def refs(self) -> List[Tuple[str, str]]:
+        """(code, sha) を初回取得順で返す。同一コードが複数回あれば最後の sha を採用"""
+        latest: Dict[str, str] = {}
+        with open(self.refs_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                ref = json.loads(line)
+                latest[ref["code"]] = ref["sha"]
+        return list(latest.items())
+
+    @staticmethod
+    def load(path: str) -> Dict[str, Any]:
+        with gzip.open(path, "rb") as f:
+            return json.loads(f.read().decode("utf-8"))
+
+
+CONTENT_FIELDS = ["company_name", "market", "feature", "business_composition", "industries", "themes"]
+
+
+def read_result_rows(csv_path: str) -> Dict[str, Dict[str, str]]:
+    rows: Dict[str, Dict[str, str]] = {}
+    with open_table_reader(csv_path) as r:
+        for row in r:
+            code = (row.get("code") or "").strip()
+            if code:
+                rows[code] = row
+    return rows
+
+
+def date_of_result(csv_path: str) -> float:
+    """YYYYMMDD_result.csv の日付（取れなければ更新時刻）をエポック秒で返す"""
+    m = re.match(r"(\d{8})_", os.path.basename(csv_path))
+    if m:
+        try:
+            return time.mktime(time.strptime(m.group(1), "%Y%m%d"))
+        except ValueError:
+            pass
+    return os.path.getmtime(csv_path)
+
+
+class RefreshState:
+    """--incremental 用の銘柄ごとの内容フィンガープリントと最終取得時刻（JSONファイル）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        self.changed: List[str] = []
+
+    @staticmethod
+    def fingerprint(record: Dict[str, Any]) -> str:
+        data = json.dumps([normalize_text(record.get(k) or "") for k in CONTENT_FIELDS], ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+    def seed(self, code: str, row: Dict[str, str], fetched: float) -> None:
+        # 状態ファイルに無い銘柄は前回CSVの日付で取得済みとみなす
+        if code not in self.entries:
+            self.entries[code] = {"fp": self.fingerprint(row), "fetched": fetched}
+
+    def is_fresh(self, code: str, row: Dict[str, str], now: float, max_age_days: float) -> bool:
+        e = self.entries.get(code)
+        if not e or max_age_days <= 0:
+            return False
+        # 引き継ぐ行が最後に取得した内容と異なる（古いCSVを指定した等）場合は取り直す
+        if e.get("fp") != self.fingerprint(row):
+            return False
+        # 銘柄ごとに有効期限を 50〜100% に分散し、期限切れが同じ日に集中しないようにする
+        spread = 0.5 + 0.5 * (int(hashlib.md5(code.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF)
+        return now - float(e.get("fetched") or 0) < max_age_days * 86400 * spread
+
+    def update(self, code: str, record: Dict[str, Any]) -> None:
+        fp = self.fingerprint(record)
+        prev = self.entries.get(code)
+        if prev and prev.get("fp") != fp:
+            self.changed.append(code)
+        self.entries[code] = {"fp": fp, "fetched": time.time()}
+
+    def save(self) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+# --negative-cache に記録する失敗（check_http_status の 404/410）と、特色・所属業界の無いページ
+NEGATIVE_STATUS_RE = re.compile(r"^HTTP (404|410) ")
+NO_CONTENT = "no content"
+NEGATIVE_CHECK_FIELDS = ["feature", "industries"]
+
+
+class NegativeCache:
+    """404/410 や特色・所属業界の無いページを返した銘柄と記録時刻・有効日数（JSONファイル）
+
+    有効期限内の銘柄は取得をスキップする。期限切れ・--recheck-negative で取り直して内容があれば削除する。
+    check_fields は出力に含まれる（抽出した）NEGATIVE_CHECK_FIELDS。空なら内容の有無は判定しない。
+    """
+
+    def __init__(self, path: str, ttl_days: float, check_fields: Iterable[str]):
+        self.path = path
+        self.ttl_days = ttl_days
+        self.check_fields = list(check_fields)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        self.added: List[str] = []
+        self.cleared: List[str] = []
+
+    def lookup(self, code: str, now: float) -> Optional[Dict[str, Any]]:
+        """有効期限内のエントリ（無ければ None）"""
+        e = self.entries.get(code)
+        if e and now - float(e.get("at") or 0) < float(e.get("ttl") or 0) * 86400:
+            return e
+        return None
+
+    def on_success(self, code: str, record: Dict[str, Any]) -> None:
+        if self.check_fields and not any(normalize_text(record.get(f) or "") for f in self.check_fields):
+            self._add(code, NO_CONTENT)
+        elif self.entries.pop(code, None) is not None:
+            self.cleared.append(code)
+
+    def on_failure(self, code: str, reason: str) -> None:
+        # タイムアウト等の一時的な失敗では既存のエントリを変えない
+        m = NEGATIVE_STATUS_RE.match(reason)
+        if m:
+            self._add(code, f"HTTP {m.group(1)}")
+
+    def _add(self, code: str, reason: str) -> None:
+        self.entries[code] = {"reason": reason, "at": time.time(), "ttl": self.ttl_days}
+        self.added.append(code)
+
+    def save(self) -> None:
+        # 期限切れのまま取り直されなかったエントリ（codelist から外れた銘柄等）は捨てる
+        now = time.time()
+        keep = {c: e for c, e in self.entries.items() if self.lookup(c, now) is not None}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(keep, f, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class StateDB:
+    """実行状態の SQLite データベース（WALモード）
+
+    銘柄ごとに状態（pending/running/done/failed）・試行回数・最終エラー・所要時間・結果行を記録する。
+    取得前に claim することで、同じファイルを共有する複数プロセス間でも二重取得しない。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS codes (
+        code TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT NOT NULL DEFAULT '',
+        owner TEXT NOT NULL DEFAULT '',
+        started_at REAL,
+        finished_at REAL,
+        elapsed REAL,
+        result TEXT
+    );
+    CREATE INDEX IF NOT EXISTS codes_status ON codes (status, seq);
+    """
+
+    def __init__(self, path: str, lease_sec: float = 600.0):
+        self.path = path
+        self.lease_sec = lease_sec
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def seed(self, codes: List[str]) -> None:
+        with self._lock:
+            (base,) = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM codes").fetchone()
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO codes (code, seq) VALUES (?, ?)",
+                [(c, base + i) for i, c in enumerate(codes, 1)],
+            )
+            self.conn.execute("COMMIT")
+
+    def codes_with_status(self, status: str) -> set:
+        with self._lock:
+            return {r[0] for r in self.conn.execute("SELECT code FROM codes WHERE status = ?", (status,))}
+
+    def claim(self, code: str) -> bool:
+        """未取得・失敗・期限切れ（--claim-timeout 超過の running）なら running にして True"""
+        now = time.time()
+        with self._lock:
+            cur = self.conn.execute(
+                "UPDATE codes SET status = 'running', owner = ?, started_at = ?, attempts = attempts + 1 "
+                "WHERE code = ? AND (status IN ('pending', 'failed') OR (status = 'running' AND started_at < ?))",
+                (self.owner, now, code, now - self.lease_sec),
+            )
+            return cur.rowcount == 1
+
+    def finish(self, code: str, status: str, error: str = "", row: Optional[Dict[str, Any]] = None) -> None:
+        now = time.time()
+        result = json.dumps(row, ensure_ascii=False) if row is not None else None
+        with self._lock:
+            self.conn.execute(
+                "UPDATE codes SET status = ?, last_error = ?, finished_at = ?, "
+                "elapsed = ? - COALESCE(started_at, ?), result = COALESCE(?, result) WHERE code = ?",
+                (status, error, now, now, now, result, code),
+            )
+
+    def carry(self, code: str, row: Dict[str, Any]) -> None:
+        """--incremental で引き継いだ行を done として記録する（取得時刻・所要時間は前回のまま）"""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE codes SET status = 'done', last_error = '', result = ? WHERE code = ?",
+                (json.dumps(row, ensure_ascii=False), code),
+            )
+
+    def history(self) -> List[Tuple[str, str, Optional[float], Optional[float]]]:
+        """(code, status, finished_at, elapsed)。--priority の並べ替えに使う"""
+        with self._lock:
+            return self.conn.execute("SELECT code, status, finished_at, elapsed FROM codes").fetchall()
+
+    def export(self, writer) -> int:
+        """done の結果行を投入順（seq）に書き出す"""
+        n = 0
+        with self._lock:
+            rows = self.conn.execute("SELECT result FROM codes WHERE status = 'done' ORDER BY seq").fetchall()
+        for (result,) in rows:
+            writer.writerow(json.loads(result))
+            n += 1
+        return n
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+# 1銘柄あたりの処理フェーズ（表示順）。"sleep"/"rate_wait" は取得前の待機、"failed" は例外で終わった試行、
+# "write" は CSV 書き込み
+PHASES = ["sleep", "rate_wait", "http", "goto", "json_wait", "modal", "snapshot", "extract", "failed", "retry_wait", "write"]
+
+
+def add_phase(phases: Optional[Dict[str, float]], name: str, sec: float) -> None:
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + sec
+
+
+def percentile(sorted_xs: List[float], q: float) -> float:
+    if not sorted_xs:
+        return 0.0
+    return sorted_xs[min(len(sorted_xs) - 1, int(q * (len(sorted_xs) - 1) + 0.5))]
+
+
+class PhaseMetrics:
+    """銘柄ごとのフェーズ所要秒を JSONL に書き出し、終了時に p50/p90/p99 を集計する（--metrics / --phase-stats）"""
+
+    def __init__(self, fp=None):
+        self.fp = fp
+        self.samples: Dict[str, List[float]] = {}
+
+    def record(self, code: str, phases: Dict[str, float], status: str, reason: str = "", path: str = "") -> None:
+        total = sum(v for k, v in phases.items() if k != "attempts")
+        for k, v in phases.items():
+            if k != "attempts":
+                self.samples.setdefault(k, []).append(v)
+        self.samples.setdefault("total", []).append(total)
+        if self.fp is None:
+            return
+        rec: Dict[str, Any] = {
+            "ts": round(time.time(), 3),
+            "code": code,
+            "status": status,
+            "attempts": int(phases.get("attempts", 0)),
+        }
+        for k in PHASES:
+            if k in phases:
+                rec[k] = round(phases[k], 4)
+        rec["total"] = round(total, 4)
+        if path:
+            rec["path"] = path
+        if reason:
+            rec["reason"] = reason
+        try:
+            self.fp.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"[WARN] failed to write metrics for {code}: {e}", file=sys.stderr)
+
+    def note(self, code: str, status: str) -> None:
+        """取得しなかった銘柄（引き継ぎ等）を JSONL にだけ記録する（集計には含めない）"""
+        if self.fp is None:
+            return
+        try:
+            self.fp.write(json.dumps({"ts": round(time.time(), 3), "code": code, "status": status}) + "\n")
+        except Exception as e:
+            print(f"[WARN] failed to write metrics for {code}: {e}", file=sys.stderr)
+
+    def report(self) -> List[str]:
+        """フェーズごとの件数・平均・パーセンタイルと、合計時間に占める割合のバーを返す"""
+        grand = sum(self.samples.get("total", [])) or 1.0
+        lines = [f"[TIMING] {'phase':<10} {'n':>6} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}  share"]
+        for k in PHASES + ["total"]:
+            xs = sorted(self.samples.get(k) or [])
+            if not xs:
+                continue
+            share = sum(xs) / grand
+            bar = "#" * int(round(share * 20)) if k != "total" else ""
+            lines.append(
+                f"[TIMING] {k:<10} {len(xs):>6} {sum(xs) / len(xs):>8.3f} {percentile(xs, 0.5):>8.3f} "
+                f"{percentile(xs, 0.9):>8.3f} {percentile(xs, 0.99):>8.3f} {xs[-1]:>8.3f}  {share * 100:5.1f}% {bar}"
+            )
+        return lines
+
+
+class BusinessStage:
+    """組み込みの後処理ステージ: summary.py と同じ business1..3 / business_sales1..3 / business_profit1..3 / overseas"""
+
+    name = "business"
+    requires = ["business_composition"]
+
+    def __init__(self):
+        from summary import EXTRA_COLS, parse_business_composition, summary_extras
+
+        self.columns = list(EXTRA_COLS)
+        self._parse = parse_business_composition
+        self._extras = summary_extras
+
+    def __call__(self, record: Dict[str, Any]) -> Dict[str, str]:
+        return self._extras(*self._parse((record.get("business_composition") or "").strip()))
+
+
+POST_STAGES = {"business": BusinessStage}
+
+
+def load_stage(spec: str):
+    """--post の値からステージを作る。組み込み名か module:callable（columns 属性を持ち、行 → 追加列の dict を返す）"""
+    if spec in POST_STAGES:
+        return POST_STAGES[spec]()
+    if ":" in spec:
+        module, attr = spec.split(":", 1)
+        obj = getattr(importlib.import_module(module), attr)
+        stage = obj() if isinstance(obj, type) else obj
+        if not callable(stage) or not hasattr(stage, "columns"):
+            raise ValueError(f"post stage {spec} must be callable and have a 'columns' list")
+        return stage
+    raise ValueError(f"unknown post stage {spec!r} (built-in: {', '.join(POST_STAGES)}, or module:callable)")
+
+
+def post_fieldnames(fieldnames: List[str], stages: List[Any]) -> List[str]:
+    """サマリー出力の列。ステージの列は themes の直後（summary.py と同じ位置）、無ければ末尾に足す"""
+    extra: List[str] = []
+    for stage in stages:
+        extra.extend(c for c in stage.columns if c not in fieldnames and c not in extra)
+    if "themes" not in fieldnames:
+        return list(fieldnames) + extra
+    k = fieldnames.index("themes") + 1
+    return list(fieldnames[:k]) + extra + list(fieldnames[k:])
+
+
+class PostWriter:
+    """--post: 結果行に各ステージの列を足し、結果と同じパスでサマリー出力に書き込む"""
+
+    def __init__(self, writer, stages: List[Any]):
+        self.writer = writer
+        self.stages = stages
+
+    def write(self, code: str, record: Dict[str, Any]) -> None:
+        row = dict(record)
+        for stage in self.stages:
+            try:
+                row.update(stage(record))
+            except Exception as e:
+                print(f"[WARN] post stage {getattr(stage, 'name', stage)} failed for {code}: {e}", file=sys.stderr)
+        self.writer.writerow(row)
+
+
+class ResultSink:
+    """結果CSV・失敗CSVへの書き込みと件数集計を一箇所にまとめる（単一ライター）"""
+
+    def __init__(
+        self,
+        writer,
+        fail_writer,
+        total: int,
+        eta_interval: int,
+        start_ts: float,
+        store: Optional[SnapshotStore] = None,
+        refresh: Optional[RefreshState] = None,
+        state: Optional[StateDB] = None,
+        metrics: Optional[PhaseMetrics] = None,
+        post: Optional[PostWriter] = None,
+        negative: Optional[NegativeCache] = None,
+    ):
+        self.writer = writer
+        self.fail_writer = fail_writer
+        self.post = post
+        self.total = total
+        self.eta_interval = eta_interval
+        self.start_ts = start_ts
+        self.store = store
+        self.refresh = refresh
+        self.state = state
+        self.metrics = metrics
+        self.negative = negative
+        self.failures: List[str] = []
+        self.success_count = 0
+        self.carried_count = 0
+        self.claimed_elsewhere = 0
+        # --incremental: 書き込み待ちの引き継ぎ行 (入力順, code, row) と、取得する銘柄の入力順
+        self.carried: deque = deque()
+        self.positions: Dict[str, int] = {}
+        # --http-first: 取得経路ごとの件数
+        self.paths: Dict[str, int] = {}
+
+    def claim(self, code: str) -> bool:
+        """--state-db 使用時、他プロセスが取得中/取得済みなら False（ワーカースレッドから呼ばれる）"""
+        if self.state is None:
+            return True
+        return self.state.claim(code)
+
+    def success(self, code: str, record: Dict[str, Any], phases: Optional[Dict[str, float]] = None) -> None:
+        t0 = time.monotonic()
+        self._flush_carried(code)
+        snap = record.pop(SNAPSHOT_KEY, None)
+        path = record.pop(PATH_KEY, "")
+        if path:
+            self.paths[path] = self.paths.get(path, 0) + 1
+        if self.store is not None and snap is not None:
+            try:
+                self.store.put(code, snap)
+            except Exception as e:
+                print(f"[WARN] failed to store snapshot for {code}: {e}", file=sys.stderr)
+        self.writer.writerow(record)
+        if self.post is not None:
+            self.post.write(code, record)
+        self.success_count += 1
+        if self.refresh is not None:
+            self.refresh.update(code, record)
+        if self.negative is not None:
+            self.negative.on_success(code, record)
+        if self.state is not None:
+            self.state.finish(code, "done", row=record)
+        if self.metrics is not None and phases is not None:
+            add_phase(phases, "write", time.monotonic() - t0)
+            self.metrics.record(code, phases, "done", path=path)
+
+    def carry(self, i: int, code: str, row: Dict[str, str]) -> None:
+        """前回結果の行をそのまま引き継ぐ（--incremental）
+
+        取得する銘柄と入力順に並ぶよう、入力順で後ろの銘柄を書き込むとき（または flush_carried）まで保留する。
+        """
+        self.carried.append((i, code, row))
+
+    def _flush_carried(self, code: str) -> None:
+        pos = self.positions.get(code)
+        while self.carried and pos is not None and self.carried[0][0] < pos:
+            self._write_carried(*self.carried.popleft()[1:])
+
+    def flush_carried(self) -> None:
+        while self.carried:
+            self._write_carried(*self.carried.popleft()[1:])
+
+    def _write_carried(self, code: str, row: Dict[str, str]) -> None:
+        self.writer.writerow(row)
+        if self.post is not None:
+            self.post.write(code, row)
+        self.carried_count += 1
+        if self.state is not None:
+            self.state.carry(code, row)
+        if self.metrics is not None:
+            self.metrics.note(code, "carried")
+
+    def skip_claimed(self, code: str) -> None:
+        self._flush_carried(code)
+        print(f"[INFO] Skip {code} (claimed by another process)", file=sys.stderr)
+        self.claimed_elsewhere += 1
+
+    def failure(self, code: str, reason: str, phases: Optional[Dict[str, float]] = None) -> None:
+        t0 = time.monotonic()
+        self._flush_carried(code)
+        self.failures.append(code)
+        if self.negative is not None:
+            self.negative.on_failure(code, reason)
+        if self.state is not None:
+            self.state.finish(code, "failed", error=reason)
+        if self.fail_writer:
+            try:
+                self.fail_writer.writerow({"code": code, "reason": reason})
+            except Exception:
+                pass
+        if self.metrics is not None and phases is not None:
+            add_phase(phases, "write", time.monotonic() - t0)
+            self.metrics.record(code, phases, "failed", reason)
+
+    def progress(self, i: int) -> None:
+        if not self.eta_interval or self.eta_interval <= 0:
+            return
+        if (i % self.eta_interval == 0) or (i == self.total):
+            elapsed_so_far = time.time() - self.start_ts
+            avg = elapsed_so_far / max(1, i)
+            remaining = max(0.0, (self.total - i) * avg)
+            eh = int(remaining // 3600)
+            em = int((remaining % 3600) // 60)
+            es = int(remaining % 60)
+            print(
+                f"[ETA] {i}/{self.total} avg={avg:.2f}s eta={eh:02d}:{em:02d}:{es:02d}",
+                file=sys.stderr,
+            )
+
+
+# --pipeline で取得側と書き込みスレッドの間に置くキューの上限（満杯なら取得側が待つ）
+WRITE_QUEUE_SIZE = 64
+
+
+class ThreadedSink:
+    """ResultSink の書き込み（結果・失敗CSV、状態DB、メトリクス）を専用スレッドで行う（--pipeline）
+
+    claim は結果が必要なので呼び出し側で直接実行する。close() でキューを流し切ってスレッドを終える。
+    """
+
+    def __init__(self, sink: ResultSink, maxsize: int = WRITE_QUEUE_SIZE):
+        self.sink = sink
+        self.total = sink.total
+        self.q: "queue.Queue[Optional[Tuple[str, tuple]]]" = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            task = self.q.get()
+            if task is None:
+                return
+            name, a = task
+            try:
+                getattr(self.sink, name)(*a)
+            except Exception as e:
+                print(f"[WARN] writer thread: {name} failed: {e}", file=sys.stderr)
+
+    def claim(self, code: str) -> bool:
+        return self.sink.claim(code)
+
+    def success(self, code: str, record: Dict[str, Any], phases: Optional[Dict[str, float]] = None) -> None:
+        self.q.put(("success", (code, record, phases)))
+
+    def failure(self, code: str, reason: str, phases: Optional[Dict[str, float]] = None) -> None:
+        self.q.put(("failure", (code, reason, phases)))
+
+    def skip_claimed(self, code: str) -> None:
+        self.q.put(("skip_claimed", (code,)))
+
+    def progress(self, i: int) -> None:
+        self.q.put(("progress", (i,)))
+
+    def close(self) -> None:
+        self.q.put(None)
+        self.thread.join()
+
+
+# scrape_with_retries がページ/ブラウザのクラッシュを検知したときの reason
+PAGE_CRASHED = "page crashed"
+# --defer-retries でリトライを遅延キューに回したときの reason
+RETRY_LATER = "retry later"
+
+RENDERER_RSS_RE = re.compile(r"^VmRSS:\s+(\d+)\s+kB", re.MULTILINE)
+
+
+def renderer_rss_mb(process_info: Dict[str, Any]) -> float:
+    """SystemInfo.getProcessInfo の renderer プロセスについて /proc の VmRSS を合計する（Linux のみ）"""
+    total_kb = 0
+    for proc in process_info.get("processInfo") or []:
+        if proc.get("type") != "renderer":
+            continue
+        try:
+            with open(f"/proc/{int(proc['id'])}/status", "r") as f:
+                m = RENDERER_RSS_RE.search(f.read())
+            if m:
+                total_kb += int(m.group(1))
+        except Exception:
+            pass
+    return total_kb / 1024.0
+
+
+JS_HEAP_JS = "() => (performance.memory ? performance.memory.usedJSHeapSize : 0)"
+
+
+def recycle_reason(args, count: int, heap_mb: float, rss_mb: float) -> str:
+    if args.recycle_every > 0 and count >= args.recycle_every:
+        return f"{count} codes"
+    if args.max_heap_mb > 0 and heap_mb > args.max_heap_mb:
+        return f"JS heap {heap_mb:.0f}MB"
+    if args.max_rss_mb > 0 and rss_mb > args.max_rss_mb:
+        return f"renderer RSS {rss_mb:.0f}MB"
+    return ""
+
+
+class PageSession:
+    """1ワーカー分のブラウザ/コンテキスト/ページ。
+
+    --recycle-every 件ごと、または JS ヒープ・レンダラRSS が上限を超えたらコンテキストを作り直し、
+    ページのクラッシュやブラウザ切断を検知したら再起動する。
+    """
+
+    def __init__(self, p, args):
+        self.p = p
+        self.args = args
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.stats: Optional[LoadStats] = None
+        self.crashed = False
+        self.count = 0
+        # --http-first ではブラウザは最初のフォールバックまで起動しない
+        self.http = HttpFetcher(args) if args.http_first else None
+        if self.http is None:
+            self._launch()
+
+    def ensure(self) -> None:
+        if self.browser is None:
+            self._launch()
+
+    def _mark_crashed(self, *_: Any) -> None:
+        self.crashed = True
+
+    def _launch(self) -> None:
+        self.browser = self.p.chromium.launch(headless=self.args.headless)
+        self.browser.on("disconnected", self._mark_crashed)
+        self._open_page()
+
+    def _open_page(self) -> None:
+        self.context = self.browser.new_context(user_agent=self.args.user_agent)
+        self.page = self.context.new_page()
+        # apply timeouts once per page
+        try:
+            self.page.set_default_timeout(self.args.timeout)
+            self.page.set_default_navigation_timeout(self.args.nav_timeout)
+        except Exception:
+            pass
+        self.page.on("crash", self._mark_crashed)
+        self.stats = prepare_page(self.context, self.page, self.args)
+        self.crashed = False
+        self.count = 0
+
+    def healthy(self) -> bool:
+        return self.browser is None or (not self.crashed and self.browser.is_connected())
+
+    def recover(self) -> None:
+        print("[WARN] page or browser crashed; relaunching", file=sys.stderr)
+        browser_alive = self.browser.is_connected()
+        self._close_quietly(close_browser=not browser_alive)
+        if browser_alive:
+            self._open_page()
+        else:
+            self._launch()
+
+    def after_code(self) -> None:
+        if self.page is None:
+            return
+        self.count += 1
+        heap_mb = rss_mb = 0.0
+        try:
+            if self.args.max_heap_mb > 0:
+                heap_mb = (self.page.evaluate(JS_HEAP_JS) or 0) / (1024 * 1024)
+            if self.args.max_rss_mb > 0:
+                cdp = self.browser.new_browser_cdp_session()
+                try:
+                    rss_mb = renderer_rss_mb(cdp.send("SystemInfo.getProcessInfo"))
+                finally:
+                    cdp.detach()
+        except Exception:
+            pass
+        reason = recycle_reason(self.args, self.count, heap_mb, rss_mb)
+        if reason:
+            if self.args.verbose:
+                print(f"[RECYCLE] new context ({reason})", file=sys.stderr)
+            self._close_quietly(close_browser=False)
+            self._open_page()
+
+    def _close_quietly(self, close_browser: bool) -> None:
+        try:
+            self.context.close()
+        except Exception:
+            pass
+        if close_browser:
+            try:
+                self.browser.close()
+            except Exception:
+                pass
+
+    def close(self) -> None:
+        self._close_quietly(close_browser=True)
+        if self.http is not None:
+            self.http.close()
+
+
+class AsyncBrowserHolder:
+    """async エンジンで全ワーカーが共有するブラウザ。切断されていれば次の get() で再起動する"""
+
+    def __init__(self, p, args):
+        self.p = p
+        self.args = args
+        self.browser = None
+        self._lock = asyncio.Lock()
+
+    async def get(self):
+        async with self._lock:
+            if self.browser is None or not self.browser.is_connected():
+                if self.browser is not None:
+                    print("[WARN] browser disconnected; relaunching", file=sys.stderr)
+                self.browser = await self.p.chromium.launch(headless=self.args.headless)
+            return self.browser
+
+    async def close(self) -> None:
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Exception:
+                pass
+
+
+class AsyncPageSession:
+    """PageSession の async 版（ワーカーごとに1コンテキスト）。
+
+    ブラウザは共有のため、レンダラRSSはブラウザ全体の合計をワーカー数で割った値で判定する。
+    """
+
+    def __init__(self, holder: AsyncBrowserHolder, args, n_workers: int = 1):
+        self.holder = holder
+        self.args = args
+        self.n_workers = max(1, n_workers)
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.stats: Optional[LoadStats] = None
+        self.crashed = False
+        self.count = 0
+        self.http = HttpFetcher(args) if args.http_first else None
+
+    def _mark_crashed(self, *_: Any) -> None:
+        self.crashed = True
+
+    async def open(self) -> None:
+        # --http-first ではブラウザのコンテキストは最初のフォールバックまで作らない
+        if self.http is None:
+            await self._open()
+
+    async def ensure(self) -> None:
+        if self.page is None:
+            await self._open()
+
+    async def _open(self) -> None:
+        self.browser = await self.holder.get()
+        self.context = await self.browser.new_context(user_agent=self.args.user_agent)
+        self.page = await self.context.new_page()
+        self.page.set_default_timeout(self.args.timeout)
+        self.page.set_default_navigation_timeout(self.args.nav_timeout)
+        self.page.on("crash", self._mark_crashed)
+        self.stats = await prepare_page_async(self.context, self.page, self.args)
+        self.crashed = False
+        self.count = 0
+
+    def healthy(self) -> bool:
+        return self.browser is None or (not self.crashed and self.browser.is_connected())
+
+    async def recover(self) -> None:
+        print("[WARN] page or browser crashed; reopening", file=sys.stderr)
+        await self._close_context()
+        await self._open()
+
+    async def after_code(self) -> None:
+        if self.page is None:
+            return
+        self.count += 1
+        heap_mb = rss_mb = 0.0
+        try:
+            if self.args.max_heap_mb > 0:
+                heap_mb = ((await self.page.evaluate(JS_HEAP_JS)) or 0) / (1024 * 1024)
+            if self.args.max_rss_mb > 0:
+                cdp = await self.browser.new_browser_cdp_session()
+                try:
+                    rss_mb = renderer_rss_mb(await cdp.send("SystemInfo.getProcessInfo")) / self.n_workers
+                finally:
+                    await cdp.detach()
+        except Exception:
+            pass
+        reason = recycle_reason(self.args, self.count, heap_mb, rss_mb)
+        if reason:
+            if self.args.verbose:
+                print(f"[RECYCLE] new context ({reason})", file=sys.stderr)
+            await self._close_context()
+            await self._open()
+
+    async def _close_context(self) -> None:
+        try:
+            await self.context.close()
+        except Exception:
+            pass
+
+    async def close(self) -> None:
+        await self._close_context()
+        if self.http is not None:
+            self.http.close()
+
+
+def backoff_delay(args, attempt: int) -> float:
+    # exponential backoff with full jitter
+    base = args.retry_base * (args.retry_factor ** attempt)
+    wait = min(args.retry_max, base)
+    return random.uniform(0.0, wait)
+
+
+def polite_delay(args) -> float:
+    # baseline sleep with optional jitter
+    if args.jitter_frac > 0:
+        jf = max(0.0, args.jitter_frac)
+        delta = args.sleep * random.uniform(-jf, jf)
+        return max(0.0, args.sleep + delta)
+    return max(0.0, args.sleep)
+
+
+def retry_decision(args, code: str, attempt: int, e: Exception) -> Tuple[Optional[float], str]:
+    """例外を分類する。リトライするなら (待機秒, "")、失敗確定なら (None, reason) を返す"""
+    if isinstance(e, NonRetryableError):
+        print(f"[WARN] non-retryable for {code}: {e}", file=sys.stderr)
+        return None, str(e)
+    if isinstance(e, pw_timeout_error()):
+        if attempt < args.retries:
+            jitter = backoff_delay(args, attempt)
+            msg = f"[RETRY] timeout for {code}, attempt {attempt+1}/{args.retries}, wait {jitter:.2f}s"
+            if args.verbose:
+                print(msg, file=sys.stderr)
+            return jitter, ""
+        print(f"[WARN] timeout for code {code}", file=sys.stderr)
+        return None, "timeout"
+    if attempt < args.retries:
+        jitter = backoff_delay(args, attempt)
+        if args.verbose:
+            print(
+                f"[RETRY] error for {code}: {e}, attempt {attempt+1}/{args.retries}, wait {jitter:.2f}s",
+                file=sys.stderr,
+            )
+        return jitter, ""
+    print(f"[WARN] error for code {code}: {e}", file=sys.stderr)
+    return None, str(e)
+
+
+def rate_wait_steps(limiter: Optional[TokenBucket], phases: Optional[Dict[str, float]]):
+    if limiter:
+        t0 = time.monotonic()
+        yield Both(limiter.acquire, limiter.acquire_async)
+        add_phase(phases, "rate_wait", time.monotonic() - t0)
+
+
+def retry_steps(
+    session,
+    code: str,
+    args,
+    opts: FetchOptions,
+    limiter: Optional[TokenBucket] = None,
+    phases: Optional[Dict[str, float]] = None,
+    attempt: int = 0,
+    defer: Optional[Dict[str, float]] = None,
+    nav_gate: Optional["NavGate"] = None,
+):
+    """リトライ込みで1銘柄を取得する手順（scrape_with_retries / scrape_with_retries_async）。
+    成功時は (record, "")、失敗時は (None, reason) を返す。
+
+    ページ/ブラウザが落ちた場合はリトライせず (None, PAGE_CRASHED) を返す（呼び出し側で再生成・再投入）。
+    phases を渡すと全試行分のフェーズ所要秒（レート待ち・バックオフ待ちを含む）と試行回数を加算する。
+    defer を渡すとバックオフを待たずに defer["wait"] に待機秒を入れて (None, RETRY_LATER) を返す
+    （attempt は遅延キューから戻ってきた銘柄のこれまでの試行回数）。
+    """
+    while True:
+        if not session.healthy():
+            return None, PAGE_CRASHED
+        yield from rate_wait_steps(limiter, phases)
+        timings: Dict[str, float] = {}
+        add_phase(phases, "attempts", 1)
+        t_attempt = time.monotonic()
+        try:
+            record = None
+            if session.http is not None:
+                # 取得間隔は遷移と同じく nav_gate で守る。http.client は同期 API なので async ではスレッドで待つ
+                if nav_gate is not None:
+                    timings["sleep"] = yield nav_gate.acquire
+                try:
+                    record = yield Both(
+                        lambda: http_attempt(session.http, code, args, opts, timings),
+                        lambda: asyncio.to_thread(http_attempt, session.http, code, args, opts, timings),
+                    )
+                finally:
+                    if nav_gate is not None:
+                        nav_gate.release()
+                if record is None:
+                    # ブラウザでの取得し直しも1リクエストとしてレート制御に従う
+                    yield from rate_wait_steps(limiter, phases)
+            if record is None:
+                yield session.ensure
+                if session.stats:
+                    session.stats.reset()
+                record = yield from scrape_one_steps(
+                    session.page,
+                    code,
+                    max_industries=opts.max_industries,
+                    fast_load=args.fast_load,
+                    ready_timeout=args.ready_timeout,
+                    keep_snapshot=bool(args.snapshot_dir),
+                    capture_hosts=opts.capture_hosts,
+                    json_timeout=args.json_timeout,
+                    timings=timings,
+                    url_template=args.target_url,
+                    plan=opts.plan,
+                    nav_gate=nav_gate,
+                )
+                if session.http is not None:
+                    record[PATH_KEY] = "browser"
+                if session.stats and args.load_stats:
+                    session.stats.finish(code, opts.load_totals)
+            if limiter:
+                limiter.observe(timings.get("goto", timings.get("http")))
+            return record, ""
+        except Exception as e:
+            # 失敗した試行は途中のフェーズではなく試行全体の所要秒を "failed" として数える
+            timings.clear()
+            add_phase(phases, "failed", time.monotonic() - t_attempt)
+            if not session.healthy():
+                print(f"[WARN] page crashed while fetching {code}: {e}", file=sys.stderr)
+                return None, PAGE_CRASHED
+            if limiter and isinstance(e, (pw_timeout_error(), TransientHTTPError)):
+                limiter.observe(None, error=True)
+            wait, reason = retry_decision(args, code, attempt, e)
+            if wait is None:
+                return None, reason
+            add_phase(phases, "retry_wait", wait)
+            if defer is not None:
+                # 待たずに遅延キューへ回し、その間は他の銘柄を処理する
+                defer["wait"] = wait
+                return None, RETRY_LATER
+        finally:
+            for k, v in timings.items():
+                add_phase(phases, k, v)
+        yield sleep_op(wait)
+        attempt += 1
+
+
+def scrape_with_retries(
+    session: "PageSession", code: str, args, opts: FetchOptions, **kwargs
+) -> Tuple[Optional[Dict[str, str]], str]:
+    """リトライ込みで1銘柄を取得する（sync API）。引数・戻り値は retry_steps と同じ"""
+    return run_steps(retry_steps(session, code, args, opts, **kwargs))
+
+
+async def scrape_with_retries_async(
+    session: "AsyncPageSession", code: str, args, opts: FetchOptions, **kwargs
+) -> Tuple[Optional[Dict[str, str]], str]:
+    """scrape_with_retries の async 版。バックオフ中も他の銘柄の処理は止まらない"""
+    return await run_steps_async(retry_steps(session, code, args, opts, **kwargs))
+
+
+# --priority: 中央値のこの倍以上かかった銘柄を「遅い」とみなして後回しにする
+SLOW_FACTOR = 3.0
+
+
+def read_metrics_history(path: str) -> Dict[str, Dict[str, Any]]:
+    """前回の --metrics JSONL から銘柄ごとの最後の記録を読む"""
+    out: Dict[str, Dict[str, Any]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get("code"):
+                out[rec["code"]] = rec
+    return out
+
+
+def prioritize(
+    items: List[Tuple[int, str]],
+    state: Optional["StateDB"],
+    refresh: Optional[RefreshState],
+    metrics_history: Dict[str, Dict[str, Any]],
+) -> Tuple[List[Tuple[int, str]], int]:
+    """最終取得が古い（未取得を含む）銘柄を先に、過去に遅かった・失敗した銘柄を最後に並べる。
+
+    履歴は --state-db・--refresh-state（--incremental）・前回の --metrics から集める。
+    同順位は入力順のまま。(並べ替えた items, 後回しにした件数) を返す。
+    """
+    fetched: Dict[str, float] = {}
+    cost: Dict[str, float] = {}
+    failed: set = set()
+    if refresh is not None:
+        for code, e in refresh.entries.items():
+            fetched[code] = float(e.get("fetched") or 0)
+    if state is not None:
+        for code, status, finished_at, elapsed in state.history():
+            if status == "done" and finished_at:
+                fetched[code] = max(fetched.get(code, 0.0), finished_at)
+            elif status == "failed":
+                failed.add(code)
+            if elapsed:
+                cost[code] = elapsed
+    for code, rec in metrics_history.items():
+        if rec.get("status") == "done":
+            fetched[code] = max(fetched.get(code, 0.0), float(rec.get("ts") or 0))
+            failed.discard(code)
+        elif rec.get("status") == "failed":
+            failed.add(code)
+        if rec.get("total"):
+            cost[code] = float(rec["total"])
+    costs = sorted(cost.values())
+    median = costs[len(costs) // 2] if costs else 0.0
+    slow = failed | {c for c, v in cost.items() if median > 0 and v >= SLOW_FACTOR * median}
+    ordered = sorted(items, key=lambda it: (it[1] in slow, fetched.get(it[1], 0.0)))
+    return ordered, sum(1 for _, code in items if code in slow)
+
+
+WorkItem = Tuple[int, str, int, Dict[str, float]]
+
+
+class WorkQueue:
+    """取得待ちの銘柄キュー（スレッドセーフ）。要素は (入力順の番号, code, 試行回数, phases)
+
+    --defer-retries で失敗した銘柄は not-before 時刻付きの遅延キューに移し、その間は他の銘柄を進める。
+    期限の来た遅延分は未着手の銘柄より先に取り出す。
+    """
+
+    def __init__(self, items: List[Tuple[int, str]]):
+        self.ready: deque = deque((i, code, 0, {}) for i, code in items)
+        self.deferred: List[Tuple[float, int, WorkItem]] = []
+        self.in_flight = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def poll(self) -> Tuple[Optional[WorkItem], Optional[float]]:
+        """(要素, 0) / (None, 待つ秒) / (None, None: 全て処理済み) を返す"""
+        now = time.monotonic()
+        with self._lock:
+            if self.deferred and self.deferred[0][0] <= now:
+                item = heapq.heappop(self.deferred)[2]
+            elif self.ready:
+                item = self.ready.popleft()
+            else:
+                wait = self.deferred[0][0] - now if self.deferred else None
+                if self.in_flight:
+                    # 処理中の銘柄が遅延キューに戻るかもしれないので短い間隔で見直す
+                    wait = min(wait, 0.05) if wait is not None else 0.05
+                return None, wait
+            self.in_flight += 1
+            return item, 0.0
+
+    def done(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def defer(self, item: WorkItem, wait: float) -> None:
+        i, code, attempt, phases = item
+        with self._lock:
+            self._seq += 1
+            heapq.heappush(self.deferred, (time.monotonic() + wait, self._seq, (i, code, attempt + 1, phases)))
+            self.in_flight -= 1
+
+    def requeue(self, item: WorkItem) -> None:
+        with self._lock:
+            self.ready.appendleft(item)
+            self.in_flight -= 1
+
+    def drain(self) -> List[WorkItem]:
+        with self._lock:
+            items = list(self.ready) + [d[2] for d in sorted(self.deferred)]
+            self.ready.clear()
+            self.deferred = []
+            return items
+
+
+def handle_result(
+    work_q: WorkQueue, item: WorkItem, record, reason: str, defer: Dict[str, float], requeued: set, args
+) -> bool:
+    """取得結果を振り分ける。遅延キュー・再投入に回した場合は False（結果は確定していない）"""
+    i, code = item[0], item[1]
+    if reason == RETRY_LATER:
+        if args.verbose:
+            print(f"[DEFER] {code}: retry in {defer['wait']:.1f}s", file=sys.stderr)
+        work_q.defer(item, defer["wait"])
+        return False
+    if reason == PAGE_CRASHED and code not in requeued:
+        requeued.add(code)
+        work_q.requeue(item)
+        return False
+    work_q.done()
+    return True
+
+
+def run_serial(items: List[Tuple[int, str]], args, sink: ResultSink, opts: FetchOptions) -> None:
+    from playwright.sync_api import sync_playwright
+
+    work_q = WorkQueue(items)
+    requeued: set = set()
+    with sync_playwright() as p:
+        session = PageSession(p, args)
+        limiter = make_limiter(args, 1)
+        fetched = False
+        while True:
+            item, wait = work_q.poll()
+            if item is None:
+                if wait is None:
+                    break
+                time.sleep(wait)
+                continue
+            i, code, attempt, phases = item
+            if attempt == 0 and code not in requeued and not sink.claim(code):
+                work_q.done()
+                sink.skip_claimed(code)
+                continue
+            # 取得間隔の待機は次の銘柄の前に行う（最後の銘柄の後には待たない）
+            if limiter is None and fetched:
+                t0 = time.monotonic()
+                time.sleep(polite_delay(args))
+                add_phase(phases, "sleep", time.monotonic() - t0)
+            fetched = True
+            print(f"[{i}/{sink.total}] Fetching {code}...", file=sys.stderr)
+            defer: Dict[str, float] = {}
+            record, reason = scrape_with_retries(
+                session, code, args, opts, limiter=limiter, phases=phases, attempt=attempt,
+                defer=defer if args.defer_retries else None,
+            )
+            if reason == PAGE_CRASHED:
+                session.recover()
+            if not handle_result(work_q, item, record, reason, defer, requeued, args):
+                continue
+            if record is not None:
+                sink.success(code, record, phases)
+            else:
+                sink.failure(code, reason, phases)
+            session.after_code()
+            sink.progress(i)
+
+        session.close()
+
+
+def run_concurrent(
+    items: List[Tuple[int, str]], args, sink: ResultSink, opts: FetchOptions, done_offset: int = 0
+) -> None:
+    """N ワーカーで並列取得。全体レートはトークンバケットで制限し、CSV書き込みは呼び出しスレッドのみが行う。
+
+    sync API のオブジェクトは生成スレッドに束縛されるため、ワーカーごとに Playwright/ブラウザを起動する。
+    """
+    from playwright.sync_api import sync_playwright
+
+    n_workers = max(1, min(args.concurrency, len(items)))
+    limiter = make_limiter(args, n_workers)
+    work_q = WorkQueue(items)
+    requeued: set = set()
+    # (code, record, reason, phases)。reason が None のものは他プロセスが claim 済みでスキップした銘柄
+    result_q: "queue.Queue[Optional[Tuple[str, Optional[Dict[str, str]], Optional[str], Dict[str, float]]]]" = (
+        queue.Queue()
+    )
+    if args.verbose and limiter is not None:
+        print(f"[INFO] concurrency={n_workers}, max rate={limiter.rate:.2f} req/s", file=sys.stderr)
+
+    def worker() -> None:
+        item: Optional[WorkItem] = None
+        try:
+            with sync_playwright() as p:
+                session = PageSession(p, args)
+                try:
+                    while True:
+                        item, wait = work_q.poll()
+                        if item is None:
+                            if wait is None:
+                                break
+                            time.sleep(wait)
+                            continue
+                        i, code, attempt, phases = item
+                        if attempt == 0 and code not in requeued and not sink.claim(code):
+                            work_q.done()
+                            item = None
+                            result_q.put((code, None, None, {}))
+                            continue
+                        print(f"[{i}/{sink.total}] Fetching {code}...", file=sys.stderr)
+                        defer: Dict[str, float] = {}
+                        record, reason = scrape_with_retries(
+                            session, code, args, opts, limiter=limiter, phases=phases, attempt=attempt,
+                            defer=defer if args.defer_retries else None,
+                        )
+                        if reason == PAGE_CRASHED:
+                            session.recover()
+                        handled = handle_result(work_q, item, record, reason, defer, requeued, args)
+                        item = None
+                        if not handled:
+                            continue
+                        result_q.put((code, record, reason, phases))
+                        session.after_code()
+                finally:
+                    session.close()
+        except Exception as e:
+            print(f"[WARN] worker stopped: {e}", file=sys.stderr)
+        finally:
+            # 処理中だった銘柄は他のワーカー（全滅なら未処理扱い）に回す
+            if item is not None:
+                work_q.requeue(item)
+            result_q.put(None)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(n_workers)]
+    for t in threads:
+        t.start()
+
+    done = done_offset
+    alive = n_workers
+    while alive:
+        res = result_q.get()
+        if res is None:
+            alive -= 1
+            continue
+        code, record, reason, phases = res
+        if reason is None:
+            sink.skip_claimed(code)
+        elif record is not None:
+            sink.success(code, record, phases)
+        else:
+            sink.failure(code, reason, phases)
+        done += 1
+        sink.progress(done)
+    for t in threads:
+        t.join()
+
+    # 全ワーカーが異常終了した場合の未処理分は失敗として記録
+    for _, code, _, _ in work_q.drain():
+        print(f"[WARN] not processed: {code}", file=sys.stderr)
+        sink.failure(code, "worker stopped")
+
+
+class NavGate:
+    """--pipeline: 遷移は1つずつ、前の銘柄の読み込み完了から --sleep（ジッター込み）あけて始める
+
+    読み込み完了でゲートを開けるので、前の銘柄の抽出・書き込みと次の銘柄の読み込みが重なる。
+    """
+
+    def __init__(self, args, polite: bool = True):
+        self.args = args
+        self.polite = polite
+        self.last_loaded: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """ゲートを取り、待った秒（前の遷移待ち + 取得間隔）を返す"""
+        t0 = time.monotonic()
+        await self._lock.acquire()
+        if self.polite and self.last_loaded is not None:
+            wait = polite_delay(self.args) - (time.monotonic() - self.last_loaded)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        return time.monotonic() - t0
+
+    def release(self) -> None:
+        self.last_loaded = time.monotonic()
+        self._lock.release()
+
+
+async def run_async(
+    items: List[Tuple[int, str]], args, sink: ResultSink, opts: FetchOptions, done_offset: int = 0
+) -> None:
+    """単一イベントループ上で最大 --concurrency 件を同時に処理する（1ブラウザ・ワーカーごとに1コンテキスト）
+
+    --pipeline では2タブで、読み込みは NavGate で1つずつ・抽出は次の読み込みと並行、書き込みは専用スレッドで行う。
+    """
+    from playwright.async_api import async_playwright
+
+    gate: Optional[NavGate] = None
+    if args.pipeline:
+        n_workers = min(2, len(items))
+        limiter = make_limiter(args, 1)
+        gate = NavGate(args, polite=limiter is None)
+        sink = ThreadedSink(sink)
+    else:
+        n_workers = max(1, min(args.concurrency, len(items)))
+        limiter = make_limiter(args, n_workers)
+    if args.verbose and limiter is not None:
+        print(f"[INFO] async engine: concurrency={n_workers}, max rate={limiter.rate:.2f} req/s", file=sys.stderr)
+    work_q = WorkQueue(items)
+    requeued: set = set()
+    done = done_offset
+
+    async with async_playwright() as p:
+        holder = AsyncBrowserHolder(p, args)
+
+        async def worker() -> None:
+            nonlocal done
+            item: Optional[WorkItem] = None
+            session = AsyncPageSession(holder, args, n_workers)
+            fetched = False
+            try:
+                await session.open()
+            except Exception as e:
+                print(f"[WARN] worker stopped: {e}", file=sys.stderr)
+                return
+            try:
+                while True:
+                    item, wait = work_q.poll()
+                    if item is None:
+                        if wait is None:
+                            break
+                        await asyncio.sleep(wait)
+                        continue
+                    i, code, attempt, phases = item
+                    if attempt == 0 and code not in requeued and not sink.claim(code):
+                        work_q.done()
+                        item = None
+                        sink.skip_claimed(code)
+                        continue
+                    if limiter is None and gate is None and fetched:
+                        t0 = time.monotonic()
+                        await asyncio.sleep(polite_delay(args))
+                        add_phase(phases, "sleep", time.monotonic() - t0)
+                    fetched = True
+                    print(f"[{i}/{sink.total}] Fetching {code}...", file=sys.stderr)
+                    defer: Dict[str, float] = {}
+                    record, reason = await scrape_with_retries_async(
+                        session, code, args, opts, limiter=limiter, phases=phases, attempt=attempt,
+                        defer=defer if args.defer_retries else None, nav_gate=gate,
+                    )
+                    if reason == PAGE_CRASHED:
+                        await session.recover()
+                    handled = handle_result(work_q, item, record, reason, defer, requeued, args)
+                    item = None
+                    if not handled:
+                        continue
+                    if record is not None:
+                        sink.success(code, record, phases)
+                    else:
+                        sink.failure(code, reason, phases)
+                    await session.after_code()
+                    done += 1
+                    sink.progress(done)
+            except Exception as e:
+                print(f"[WARN] worker stopped: {e}", file=sys.stderr)
+            finally:
+                if item is not None:
+                    work_q.requeue(item)
+                await session.close()
+
+        await asyncio.gather(*(worker() for _ in range(n_workers)))
+        await holder.close()
+
+    for _, code, _, _ in work_q.drain():
+        print(f"[WARN] not processed: {code}", file=sys.stderr)
+        sink.failure(code, "worker stopped")
+    if isinstance(sink, ThreadedSink):
+        sink.close()
+
+
+def parse_addr(value: str) -> Tuple[str, int]:
+    """'HOST:PORT' または 'PORT'（ホスト省略時は 127.0.0.1）を (host, port) に変換する"""
+    host, _, port = value.strip().rpartition(":")
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"address must be [HOST:]PORT: {value!r}")
+    return host or "127.0.0.1", int(port)
+
+
+def serve_request_args(base, req: Dict[str, Any]):
+    """--serve: 要求の fields/post/snapshot をサーバーの args に重ねる（抽出計画は要求ごとに決まる）
+
+    fields/post の無い要求（古いクライアント）や未知の項目名は、黙って既定の項目で取得せずに ValueError にする。
+    """
+    fields, post = req.get("fields"), req.get("post")
+    if not isinstance(fields, str) or not isinstance(post, list):
+        raise ValueError("request must carry 'fields' (string) and 'post' (list); client and server versions differ")
+    unknown = [f.strip() for f in fields.split(",") if f.strip() and f.strip() not in FIELD_PARTS]
+    if unknown:
+        raise ValueError(f"unknown field(s): {', '.join(unknown)}")
+    args = copy.copy(base)
+    args.fields = fields
+    args.post = [str(spec) for spec in post]
+    # クライアントが --snapshot-dir を指定したときだけページのスナップショットを結果に含める
+    args.snapshot_dir = "client" if req.get("snapshot") else ""
+    return args
+
+
+class ScrapeServer:
+    """ブラウザを起動したまま常駐し、ローカルソケットで受け取った銘柄を順に取得して結果を返す（--serve）
+
+    プロトコルは UTF-8 の JSON 1行単位。要求 {"codes": [...], "fields": "...", "post": [...], "snapshot": bool} に対し、
+    銘柄ごとに {"code", "record", "phases"} または {"code", "error", "phases"} を返し、最後に {"done": true, "served": N}。
+    不正な要求には {"error": "bad request: ..."} だけを返す。1接続で複数の要求を送れる。接続は1つずつ順に処理する（ページは1枚）。
+    取得の設定（--sleep/--retries/--fast-load/--max-rate など）はサーバー起動時のものを使い、
+    抽出する項目（--fields/--post）とスナップショットの有無は要求ごとにクライアントの指定で決める。
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.session: Optional[PageSession] = None
+        self.limiter = make_limiter(args, 1)
+        self.last_fetch: Optional[float] = None
+        self.served = 0
+
+    def _fetch(self, code: str, args, opts: FetchOptions) -> Dict[str, Any]:
+        phases: Dict[str, float] = {}
+        # 取得間隔は要求・接続をまたいで前回の取得からの経過で判定する
+        if self.limiter is None and self.last_fetch is not None:
+            wait = polite_delay(args) - (time.monotonic() - self.last_fetch)
+            if wait > 0:
+                time.sleep(wait)
+                phases["sleep"] = wait
+        print(f"[SERVE] Fetching {code}...", file=sys.stderr)
+        record, reason = scrape_with_retries(self.session, code, args, opts, limiter=self.limiter, phases=phases)
+        if reason == PAGE_CRASHED:
+            self.session.recover()
+            record, reason = scrape_with_retries(self.session, code, args, opts, limiter=self.limiter, phases=phases)
+            if reason == PAGE_CRASHED:
+                self.session.recover()
+        self.last_fetch = time.monotonic()
+        self.session.after_code()
+        self.served += 1
+        if record is not None:
+            return {"code": code, "record": record, "phases": phases}
+        return {"code": code, "error": reason, "phases": phases}
+
+    def _handle(self, conn: socket.socket) -> None:
+        with conn.makefile("rb") as rf, conn.makefile("wb") as wf:
+
+            def send(msg: Dict[str, Any]) -> None:
+                wf.write(json.dumps(msg, ensure_ascii=False).encode("utf-8") + b"\n")
+                wf.flush()
+
+            for line in rf:
+                if not line.strip():
+                    continue
+                try:
+                    req = json.loads(line)
+                    codes = [str(c).strip() for c in req.get("codes") or [] if str(c).strip()]
+                    args = serve_request_args(self.args, req)
+                    opts = FetchOptions(args)
+                except (ValueError, AttributeError) as e:
+                    print(f"[WARN] rejected request: {e}", file=sys.stderr)
+                    send({"error": f"bad request: {e}"})
+                    continue
+                t0 = time.time()
+                for code in codes:
+                    send(self._fetch(code, args, opts))
+                send({"done": True, "served": self.served})
+                print(f"[SERVE] batch of {len(codes)} codes in {time.time() - t0:.1f}s", file=sys.stderr)
+
+    def run(self) -> None:
+        from playwright.sync_api import sync_playwright
+
+        host, port = parse_addr(self.args.serve)
+        with sync_playwright() as p:
+            t0 = time.time()
+            self.session = PageSession(p, self.args)
+            srv = socket.create_server((host, port))
+            print(
+                f"[INFO] browser ready in {time.time() - t0:.1f}s; serving on {host}:{port} (Ctrl+C to stop)",
+                file=sys.stderr,
+            )
+            try:
+                while True:
+                    conn, addr = srv.accept()
+                    if self.args.verbose:
+                        print(f"[SERVE] connection from {addr[0]}:{addr[1]}", file=sys.stderr)
+                    try:
+                        with conn:
+                            self._handle(conn)
+                    except OSError as e:
+                        # クライアントが途中で切断しても常駐は続ける
+                        print(f"[WARN] connection closed: {e}", file=sys.stderr)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                srv.close()
+                self.session.close()
+        print(f"[DONE] served {self.served} codes", file=sys.stderr)
+
+
+def run_remote(
+    items: List[Tuple[int, str]], args, sink: ResultSink, opts: FetchOptions, done_offset: int = 0
+) -> None:
+    """--serve で常駐しているサーバーに銘柄をまとめて送り、返ってきた結果を順に書き込む（ブラウザ起動なし）"""
+    host, port = parse_addr(args.connect)
+    index: Dict[str, int] = {}
+    done = done_offset
+    for i, code in items:
+        if sink.claim(code):
+            index[code] = i
+        else:
+            sink.skip_claimed(code)
+            done += 1
+    pending = dict(index)
+    # 常駐側は要求の fields/post から抽出計画を作る。返ってきた行に計画の項目が欠けていれば食い違いとして止める
+    wanted = [f for f in CONTENT_FIELDS if opts.plan is None or f in opts.plan.fields]
+    reason = "server unavailable"
+    try:
+        with socket.create_connection((host, port), timeout=10) as conn:
+            conn.settimeout(None)
+            with conn.makefile("rb") as rf, conn.makefile("wb") as wf:
+                req = {
+                    "codes": list(index),
+                    "fields": ",".join(f.strip() for f in args.fields.split(",") if f.strip() in FIELD_PARTS),
+                    "post": list(args.post),
+                    "snapshot": bool(args.snapshot_dir),
+                }
+                wf.write(json.dumps(req, ensure_ascii=False).encode("utf-8") + b"\n")
+                wf.flush()
+                for line in rf:
+                    msg = json.loads(line)
+                    if msg.get("done"):
+                        break
+                    code = msg.get("code")
+                    if code is None and msg.get("error"):
+                        reason = f"server rejected request: {msg['error']}"
+                        raise ValueError(reason)
+                    if code not in pending:
+                        print(f"[WARN] server: {msg.get('error') or msg}", file=sys.stderr)
+                        continue
+                    lacking = [f for f in wanted if msg.get("record") is not None and f not in msg["record"]]
+                    if lacking:
+                        reason = f"server returned {code} without {', '.join(lacking)} (fields mismatch)"
+                        raise ValueError(reason)
+                    i = pending.pop(code)
+                    print(f"[{i}/{sink.total}] Fetched {code} via {host}:{port}", file=sys.stderr)
+                    if msg.get("record") is not None:
+                        sink.success(code, msg["record"], msg.get("phases"))
+                    else:
+                        sink.failure(code, msg.get("error") or "unknown error", msg.get("phases"))
+                    done += 1
+                    sink.progress(done)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] scrape server {host}:{port}: {e}", file=sys.stderr)
+    # 接続できない・途中で切れた・要求が拒否された場合の未処理分は失敗として記録
+    for code in pending:
+        print(f"[WARN] not processed: {code}", file=sys.stderr)
+        sink.failure(code, reason)
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """'i/N'（0 <= i < N）を (i, N) に変換する"""
+    m = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", value)
+    if not m or int(m.group(2)) <= 0 or int(m.group(1)) >= int(m.group(2)):
+        raise ValueError(f"--shard must be i/N with 0 <= i < N: {value!r}")
+    return int(m.group(1)), int(m.group(2))
+
+
+def shard_of(code: str, n_shards: int) -> int:
+    # Python の hash() はプロセスごとに変わるため、マシン間で一致する sha1 を使う
+    return int(hashlib.sha1(code.encode("utf-8")).hexdigest()[:8], 16) % n_shards
+
+
+def merge_shards(
+    result_paths: List[str], failure_paths: List[str], order: List[str]
+) -> Tuple[List[str], List[Dict[str, str]], List[Dict[str, str]]]:
+    """シャードごとの結果/失敗CSVを統合する。
+
+    同じコードが複数の結果にあれば空欄の少ない行を採用（同数なら後に指定したファイル）。
+    結果がある銘柄は失敗から除く。並びは order（codelist の順）、order に無いコードは末尾。
+    """
+    fieldnames: List[str] = []
+    best: Dict[str, Dict[str, str]] = {}
+    for path in result_paths:
+        with open_table_reader(path) as r:
+            for name in r.fieldnames or []:
+                if name not in fieldnames:
+                    fieldnames.append(name)
+            for row in r:
+                code = (row.get("code") or "").strip()
+                if not code:
+                    continue
+                score = sum(1 for k in CONTENT_FIELDS if (row.get(k) or "").strip())
+                prev = best.get(code)
+                if prev is None or score >= sum(1 for k in CONTENT_FIELDS if (prev.get(k) or "").strip()):
+                    best[code] = row
+    fails: Dict[str, Dict[str, str]] = {}
+    for path in failure_paths:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                code = (row.get("code") or "").strip()
+                if code and code not in best:
+                    fails[code] = {"code": code, "reason": row.get("reason") or ""}
+
+    rank = {c: i for i, c in enumerate(order)}
+    def key(c: str) -> Tuple[int, str]:
+        return (rank.get(c, len(rank)), c)
+
+    rows = [best[c] for c in sorted(best, key=key)]
+    failures = [fails[c] for c in sorted(fails, key=key)]
+    return fieldnames, rows, failures
+
+
+def _reextract_one(task: Tuple[str, str, int, bool]) -> Tuple[Optional[Dict[str, str]], str]:
+    code, path, max_industries, use_json = task
+    try:
+        fields = fields_from_snapshot(SnapshotStore.load(path), max_industries=max_industries, use_json=use_json)
+    except Exception as e:
+        return None, f"snapshot: {e}"
+    fields.update({"code": code})
+    return fields, ""
+
+
+def run_reextract(items: List[Tuple[int, str]], args, sink: ResultSink, store: SnapshotStore, done_offset: int = 0) -> None:
+    """保存済みスナップショットからブラウザなしで再抽出（プロセスプールで並列、出力順は refs の順）"""
+    shas = dict(store.refs())
+    max_industries = args.max_industries if args.max_industries > 0 else 999999
+    # 保存時に --capture-json だったかに関わらず、JSON 応答を使うかは今回の --capture-json で決める
+    tasks = [(code, store.object_path(shas[code]), max_industries, args.capture_json) for _, code in items]
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    done = done_offset
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        for (code, _, _, _), (record, reason) in zip(tasks, ex.map(_reextract_one, tasks, chunksize=64)):
+            if record is not None:
+                sink.success(code, record)
+            else:
+                print(f"[WARN] re-extract failed for {code}: {reason}", file=sys.stderr)
+                sink.failure(code, reason)
+            done += 1
+            sink.progress(done)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Shikiho Online scraper")
+    parser.add_argument("--input", default="codelist.csv", help="input CSV path (with header 'code')")
+    parser.add_argument(
+        "--output", default="result.csv", help="output path; format by extension (.csv, .parquet, .arrow, .sqlite)"
+    )
+    parser.add_argument(
+        "--post",
+        action="append",
+        default=[],
+        metavar="STAGE",
+        help="post-processor stage adding columns to a summary output written in the same pass "
+        "(built-in: business = summary.py columns; or module:callable); repeatable",
+    )
+    parser.add_argument(
+        "--summary-output",
+        default="",
+        help="--post: summary output path (default: derived from --output like summary.py, e.g. YYYYMMDD_summary.csv)",
+    )
+    parser.add_argument("--sleep", type=float, default=1.0, help="sleep seconds between requests")
+    parser.add_argument("--limit", type=int, default=0, help="limit number of codes (0=all)")
+    # Concurrency
+    parser.add_argument(
+        "--concurrency", type=int, default=1, help="number of parallel browser pages (1=serial, default)"
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=0.0,
+        help="global request rate ceiling in req/s; replaces the --sleep wait when set "
+        "(0=derive from --sleep for --concurrency > 1)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["sync", "async"],
+        default="sync",
+        help="scraping engine: sync (sync_playwright) or async (playwright.async_api, one event loop)",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="load the next code in a second tab while the current one is extracted; write from a separate thread",
+    )
+    parser.add_argument(
+        "--max-industries", type=int, default=3, help="maximum number of industries to keep (0=unlimited)"
+    )
+    parser.add_argument(
+        "--fields",
+        default="code,company_name,market,feature,business_composition,industries,themes",
+        help="comma-separated output fields (default: all)",
+    )
+    parser.add_argument(
+        "--eta-interval",
+        type=int,
+        default=0,
+        help="print progress and ETA every N items (0=disabled)",
+    )
+    # Timeouts and UA
+    parser.add_argument("--timeout", type=int, default=20000, help="default action timeout in milliseconds")
+    parser.add_argument("--nav-timeout", type=int, default=20000, help="navigation timeout in milliseconds")
+    parser.add_argument(
+        "--user-agent",
+        default=(
+            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+            "AppleWebKit/537.36 (KHTML, like Gecko) "
+            "Chrome/120.0.0.0 Safari/537.36"
+        ),
+        help="custom User-Agent string",
+    )
+    parser.add_argument(
+        "--target-url",
+        default=TARGET_URL,
+        help="page URL template with {code} (e.g. a local benchmark server)",
+    )
+    # Retry/jitter options (defaults keep current behavior: disabled)
+    parser.add_argument("--retries", type=int, default=0, help="number of retries on transient failures")
+    parser.add_argument(
+        "--retry-base", type=float, default=1.0, help="base seconds for exponential backoff"
+    )
+    parser.add_argument(
+        "--retry-factor", type=float, default=1.6, help="multiplicative factor for backoff"
+    )
+    parser.add_argument(
+        "--retry-max", type=float, default=15.0, help="maximum backoff per attempt (seconds)"
+    )
+    parser.add_argument(
+        "--jitter-frac", type=float, default=0.0, help="fractional jitter for --sleep (e.g., 0.3 => ±30%%)"
+    )
+    # Scheduling
+    parser.add_argument(
+        "--defer-retries",
+        action="store_true",
+        help="put codes awaiting a retry into a delayed queue (not-before time) and keep fetching others meanwhile",
+    )
+    parser.add_argument(
+        "--priority",
+        action="store_true",
+        help="fetch stale codes first and historically slow/failing ones last (history: --state-db, "
+        "--refresh-state, previous --metrics)",
+    )
+    # Failure tracking and resume/append
+    parser.add_argument("--failures", default="", help="path to write failed codes CSV (code,reason). empty=disable")
+    parser.add_argument(
+        "--failures-auto",
+        action="store_true",
+        help="auto-append timestamp suffix to failures CSV; if --failures is empty, create failures_YYYYMMDD_HHMM.csv",
+    )
+    # Sharding across machines
+    parser.add_argument(
+        "--shard",
+        default="",
+        help="process only shard i of N (i/N, 0-based) split by a stable hash of the code",
+    )
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        default=[],
+        metavar="RESULT_CSV",
+        help="merge per-shard result CSVs into --output ordered like --input, then exit (no browser)",
+    )
+    parser.add_argument(
+        "--merge-failures",
+        nargs="*",
+        default=[],
+        metavar="FAILURES_CSV",
+        help="--merge: per-shard failures CSVs; codes still failing are written to --failures",
+    )
+    # SQLite run state
+    parser.add_argument(
+        "--state-db",
+        default="",
+        help="SQLite run-state DB (WAL): per-code status/attempts/error/timing/row; done codes are skipped",
+    )
+    parser.add_argument(
+        "--claim-timeout",
+        type=float,
+        default=600.0,
+        help="--state-db: seconds after which a 'running' claim from a crashed process may be taken over",
+    )
+    parser.add_argument(
+        "--retry-failed", action="store_true", help="--state-db: process only codes whose status is 'failed'"
+    )
+    parser.add_argument(
+        "--export-state",
+        default="",
+        help="--state-db: write all done rows to this CSV in input order and exit (no browser)",
+    )
+    # Incremental refresh
+    parser.add_argument(
+        "--incremental",
+        default="",
+        help="previous *_result.csv; codes fetched within --max-age are copied forward instead of re-scraped",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=30.0,
+        help="--incremental: days before a code is re-fetched (spread per code over 50-100%%)",
+    )
+    parser.add_argument(
+        "--refresh-state",
+        default="refresh_state.json",
+        help="--incremental: JSON file with per-code content fingerprint and last-fetched time",
+    )
+    parser.add_argument(
+        "--negative-cache",
+        default="",
+        help="JSON file of codes that returned 404/410 or a page without 特色/所属業界; "
+        "they are skipped until the entry expires",
+    )
+    parser.add_argument(
+        "--negative-ttl",
+        type=float,
+        default=30.0,
+        help="--negative-cache: days a new entry stays valid (stored per entry)",
+    )
+    parser.add_argument(
+        "--recheck-negative",
+        action="store_true",
+        help="--negative-cache: fetch cached codes anyway and update or clear their entries",
+    )
+    parser.add_argument("--resume", action="store_true", help="skip codes already present in --output")
+    parser.add_argument("--append", action="store_true", help="append to --output if it exists (no header)")
+    parser.add_argument("--verbose", action="store_true", help="enable more verbose logs")
+    parser.add_argument(
+        "--from-failures",
+        default="",
+        help="read input codes from a failures CSV (uses 'code' column) instead of --input",
+    )
+    # Adaptive rate control (AIMD)
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="adapt the request rate to observed latency/errors (starts at --max-rate or 1/--sleep)",
+    )
+    parser.add_argument("--rate-min", type=float, default=0.1, help="--adaptive: hard floor in req/s")
+    parser.add_argument("--rate-max", type=float, default=2.0, help="--adaptive: hard ceiling in req/s")
+    parser.add_argument(
+        "--rate-step", type=float, default=0.02, help="--adaptive: additive increase per healthy request (req/s)"
+    )
+    parser.add_argument(
+        "--rate-backoff", type=float, default=0.5, help="--adaptive: multiplicative decrease on errors/latency spikes"
+    )
+    # Metrics
+    parser.add_argument("--metrics", default="", help="write per-code phase timings as JSONL to this path")
+    parser.add_argument(
+        "--phase-stats", action="store_true", help="print p50/p90/p99 per phase at the end (implied by --metrics)"
+    )
+    # Page/browser recycling
+    parser.add_argument(
+        "--recycle-every", type=int, default=0, help="open a fresh browser context every N codes (0=never)"
+    )
+    parser.add_argument(
+        "--max-heap-mb", type=float, default=0.0, help="recycle the context when the page JS heap exceeds N MB (0=off)"
+    )
+    parser.add_argument(
+        "--max-rss-mb",
+        type=float,
+        default=0.0,
+        help="recycle the context when renderer RSS exceeds N MB (Linux /proc; 0=off)",
+    )
+    # Persistent browser server
+    parser.add_argument(
+        "--serve",
+        default="",
+        metavar="[HOST:]PORT",
+        help="keep a warm browser and fetch code batches sent over a local socket (see --connect); no --input",
+    )
+    parser.add_argument(
+        "--connect",
+        default="",
+        metavar="[HOST:]PORT",
+        help="send the codes to a running --serve process instead of launching a browser",
+    )
+    # Page load
+    parser.add_argument(
+        "--fast-load",
+        action="store_true",
+        help="block images/media/fonts and non-allowed hosts; proceed once the 特色/所属業界 dt elements exist",
+    )
+    parser.add_argument(
+        "--allow-hosts",
+        default="toyokeizai.net",
+        help="comma-separated host suffixes allowed under --fast-load (others are aborted)",
+    )
+    parser.add_argument(
+        "--ready-timeout",
+        type=int,
+        default=15000,
+        help="--fast-load: milliseconds to wait for the 特色/所属業界 dt before falling back to networkidle",
+    )
+    parser.add_argument(
+        "--capture-json",
+        action="store_true",
+        help="experimental: map the SPA's own JSON API responses to fields (key names are guessed, see JSON_FIELD_KEYS); "
+        "fall back to the DOM for anything missing",
+    )
+    parser.add_argument(
+        "--json-timeout",
+        type=int,
+        default=3000,
+        help="--capture-json: milliseconds to wait for complete API payloads before the DOM fallback",
+    )
+    parser.add_argument(
+        "--http-first",
+        action="store_true",
+        help="fetch each page with a plain keep-alive HTTP client (gzip) and parse the HTML/embedded JSON; "
+        "start the browser only for codes whose required fields come back empty",
+    )
+    parser.add_argument(
+        "--http-require",
+        default="",
+        help="--http-first: comma-separated fields that must be non-empty to accept the HTTP result "
+        "(default: the output --fields)",
+    )
+    parser.add_argument(
+        "--load-stats", action="store_true", help="print requests/blocked/bytes per page and a total at the end"
+    )
+    # Snapshot store / offline re-extraction
+    parser.add_argument(
+        "--snapshot-dir", default="", help="store each rendered-page snapshot (gzip, content-addressed) under this dir"
+    )
+    parser.add_argument(
+        "--snapshot-date", default="", help="date key YYYYMMDD for --snapshot-dir (default: today)"
+    )
+    parser.add_argument(
+        "--reextract",
+        action="store_true",
+        help="rebuild --output from --snapshot-dir/--snapshot-date without a browser (codes come from the store)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0, help="process pool size for --reextract (0=CPU count)"
+    )
+    # Browser mode
+    parser.add_argument("--headed", dest="headless", action="store_false", help="run with browser UI (non-headless)")
+    parser.add_argument("--headless", dest="headless", action="store_true", help="run headless (default)")
+    parser.set_defaults(headless=True)
+    args = parser.parse_args()
+    if "{code}" not in args.target_url:
+        print("[ERROR] --target-url must contain {code}", file=sys.stderr)
+        sys.exit(2)
+    if not 0 < args.rate_min <= args.rate_max:
+        print("[ERROR] --rate-min must be > 0 and <= --rate-max", file=sys.stderr)
+        sys.exit(2)
+    # 取得先ホストは --fast-load / --capture-json の許可ホストに常に含める
+    target_host = (urlsplit(args.target_url).hostname or "").lower()
+    if target_host and not host_allowed(args.target_url, parse_allow_hosts(args.allow_hosts)):
+        args.allow_hosts = f"{args.allow_hosts},{target_host}"
+
+    if args.pipeline and (args.concurrency > 1 or args.engine == "async"):
+        print("[WARN] --pipeline uses two tabs on the async engine; --concurrency/--engine are ignored", file=sys.stderr)
+    if args.serve or args.connect:
+        try:
+            parse_addr(args.serve or args.connect)
+        except ValueError as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            sys.exit(2)
+    if args.serve:
+        ScrapeServer(args).run()
+        return
+
+    if args.merge:
+        try:
+            order = read_codes(args.input) if os.path.exists(args.input) else []
+            merged_fields, rows, merged_failures = merge_shards(args.merge, args.merge_failures, order)
+            with open_table_writer(args.output, merged_fields) as w:
+                w.writerows(rows)
+            print(f"[DONE] merged {len(rows)} rows from {len(args.merge)} files into {args.output}", file=sys.stderr)
+            if args.failures:
+                with open(args.failures, "w", encoding="utf-8-sig", newline="") as ff:
+                    w = csv.DictWriter(ff, fieldnames=["code", "reason"])
+                    w.writeheader()
+                    w.writerows(merged_failures)
+                print(f"[INFO] {len(merged_failures)} remaining failures written to: {args.failures}", file=sys.stderr)
+        except Exception as e:
+            print(f"[ERROR] merge failed: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    store: Optional[SnapshotStore] = None
+    if args.snapshot_dir:
+        store = SnapshotStore(args.snapshot_dir, args.snapshot_date or time.strftime("%Y%m%d"))
+    elif args.reextract:
+        print("[ERROR] --reextract requires --snapshot-dir", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        if args.reextract and store is not None:
+            codes = [c for c, _ in store.refs()]
+            if args.verbose:
+                print(f"[INFO] loaded {len(codes)} codes from snapshot refs: {store.refs_path}", file=sys.stderr)
+        elif args.from_failures:
+            # Read codes from failures CSV (expects a 'code' header; ignores 'reason')
+            codes: List[str] = []
+            with open(args.from_failures, "r", encoding="utf-8-sig", newline="") as f:
+                r = csv.DictReader(f)
+                if not r.fieldnames or "code" not in r.fieldnames:
+                    raise ValueError("failures CSV must have a 'code' header")
+                seen = set()
+                for row in r:
+                    c = (row.get("code") or "").strip()
+                    if not c or c in seen:
+                        continue
+                    seen.add(c)
+                    codes.append(c)
+            if args.verbose:
+                print(f"[INFO] loaded {len(codes)} codes from failures: {args.from_failures}", file=sys.stderr)
+        else:
+            codes = read_codes(args.input)
+    except Exception as e:
+        src = store.refs_path if (args.reextract and store is not None) else (args.from_failures or args.input)
+        print(f"[ERROR] failed to read {src}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.shard:
+        try:
+            shard_i, shard_n = parse_shard(args.shard)
+        except ValueError as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            sys.exit(1)
+        codes = [c for c in codes if shard_of(c, shard_n) == shard_i]
+        if args.verbose:
+            print(f"[INFO] shard {shard_i}/{shard_n}: {len(codes)} codes", file=sys.stderr)
+
+    if args.limit > 0:
+        codes = codes[: args.limit]
+
+    default_fields = [
+        "code",
+        "company_name",
+        "market",
         "feature",
         "business_composition",
         "industries",
@@ -467,35 +3534,86 @@ def main():
     if "code" not in fieldnames:
         fieldnames.insert(0, "code")
 
-    failures: List[str] = []
-    processed: List[str] = []
+    processed: set = set()
     skipped_count = 0
-    success_count = 0
 
     # Resume support: load already processed codes from existing output
     if args.resume and os.path.exists(args.output):
         try:
-            with open(args.output, "r", encoding="utf-8-sig", newline="") as fr:
-                r = csv.DictReader(fr)
+            with open_table_reader(args.output) as r:
                 if "code" in (r.fieldnames or []):
                     for row in r:
                         c = (row.get("code") or "").strip()
                         if c:
-                            processed.append(c)
+                            processed.add(c)
             if args.verbose:
                 print(f"[INFO] resume enabled: {len(processed)} codes already processed", file=sys.stderr)
         except Exception as e:
             print(f"[WARN] failed to read existing output for resume: {e}", file=sys.stderr)
 
-    # Configure output writer (append or write)
-    out_exists = os.path.exists(args.output)
-    out_mode = "a" if (args.append and out_exists) else "w"
-    # Excelなどでの文字化け回避のためUTF-8 BOM付きで出力
+    # SQLite run state: done codes are skipped like --resume (set lookup per code)
+    state: Optional[StateDB] = None
+    state_done: set = set()
+    if args.state_db:
+        try:
+            state = StateDB(args.state_db, lease_sec=args.claim_timeout)
+            if args.export_state:
+                with open_table_writer(args.export_state, fieldnames) as w:
+                    n = state.export(w)
+                print(f"[DONE] exported {n} rows to {args.export_state}", file=sys.stderr)
+                return
+            state.seed(codes)
+            if args.retry_failed:
+                failed = state.codes_with_status("failed")
+                codes = [c for c in codes if c in failed]
+            state_done = state.codes_with_status("done")
+            if args.verbose:
+                print(f"[INFO] state db: {len(state_done)} codes already done", file=sys.stderr)
+        except Exception as e:
+            print(f"[ERROR] failed to open state db {args.state_db}: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    # Incremental refresh: previous rows and per-code fingerprints
+    refresh: Optional[RefreshState] = None
+    prev_rows: Dict[str, Dict[str, str]] = {}
+    if args.incremental:
+        try:
+            prev_rows = read_result_rows(args.incremental)
+            refresh = RefreshState(args.refresh_state)
+            prev_ts = date_of_result(args.incremental)
+            for c, row in prev_rows.items():
+                refresh.seed(c, row, prev_ts)
+        except Exception as e:
+            print(f"[ERROR] failed to load incremental state: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    # Negative cache: 404/410・内容なしの銘柄は期限まで取得しない（再抽出ではページを取得しないので使わない）
+    negative: Optional[NegativeCache] = None
+    if args.negative_cache and not args.reextract:
+        try:
+            negative = NegativeCache(
+                args.negative_cache, args.negative_ttl, [f for f in NEGATIVE_CHECK_FIELDS if f in fieldnames]
+            )
+        except Exception as e:
+            print(f"[ERROR] failed to load negative cache {args.negative_cache}: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    # --priority: 前回の --metrics は書き込み用に開く（上書きする）前に読んでおく
+    metrics_history: Dict[str, Dict[str, Any]] = {}
+    if args.priority and args.metrics and os.path.exists(args.metrics):
+        try:
+            metrics_history = read_metrics_history(args.metrics)
+        except Exception as e:
+            print(f"[WARN] failed to read metrics history {args.metrics}: {e}", file=sys.stderr)
+
+    # Configure output writer (append or write). 形式は拡張子で判定（.csv / .parquet / .arrow / .sqlite）
     chosen_fail_path = ""
-    with open(args.output, out_mode, encoding="utf-8-sig", newline="") as fo:
-        writer = csv.DictWriter(fo, fieldnames=fieldnames, extrasaction="ignore")
-        if out_mode == "w":
-            writer.writeheader()
+    try:
+        out_table = open_table_writer(args.output, fieldnames, append=args.append)
+    except Exception as e:
+        print(f"[ERROR] cannot open output {args.output}: {e}", file=sys.stderr)
+        sys.exit(1)
+    with out_table as writer:
 
         # Failures CSV writer (optional)
         fail_writer = None
@@ -527,114 +3645,148 @@ def main():
                 target = args.failures or chosen_fail_path or "(auto failures path)"
                 print(f"[WARN] cannot open failures CSV '{target}': {e}", file=sys.stderr)
 
-        start_ts = time.time()
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=args.headless)
-            context = browser.new_context(user_agent=args.user_agent)
-            page = context.new_page()
-            # apply timeouts once per page
+        metrics: Optional[PhaseMetrics] = None
+        metrics_fp = None
+        if args.metrics or args.phase_stats:
+            if args.metrics:
+                try:
+                    metrics_fp = open(args.metrics, "a" if args.append else "w", encoding="utf-8")
+                except Exception as e:
+                    print(f"[WARN] cannot open metrics file '{args.metrics}': {e}", file=sys.stderr)
+            metrics = PhaseMetrics(metrics_fp)
+
+        post: Optional[PostWriter] = None
+        post_table = None
+        if args.post:
             try:
-                page.set_default_timeout(args.timeout)
-                page.set_default_navigation_timeout(args.nav_timeout)
-            except Exception:
-                pass
+                stages = [load_stage(spec) for spec in args.post]
+                if args.summary_output:
+                    summary_path = args.summary_output
+                else:
+                    from summary import derive_output_path
 
-            for i, code in enumerate(codes, 1):
-                if args.resume and code in processed:
-                    if args.verbose:
-                        print(f"[{i}/{len(codes)}] Skip {code} (resume)", file=sys.stderr)
-                    skipped_count += 1
-                    continue
-                print(f"[{i}/{len(codes)}] Fetching {code}...", file=sys.stderr)
-                attempt = 0
-                while True:
-                    try:
-                        record = scrape_one(page, code, max_industries=args.max_industries if args.max_industries > 0 else 999999)
-                        writer.writerow(record)
-                        success_count += 1
-                        break
-                    except NonRetryableError as e:
-                        print(f"[WARN] non-retryable for {code}: {e}", file=sys.stderr)
-                        failures.append(code)
-                        if fail_writer:
-                            try:
-                                fail_writer.writerow({"code": code, "reason": str(e)})
-                            except Exception:
-                                pass
-                        break
-                    except PWTimeoutError:
-                        if attempt < args.retries:
-                            # exponential backoff with full jitter
-                            base = args.retry_base * (args.retry_factor ** attempt)
-                            wait = min(args.retry_max, base)
-                            jitter = random.uniform(0.0, wait)
-                            msg = f"[RETRY] timeout for {code}, attempt {attempt+1}/{args.retries}, wait {jitter:.2f}s"
-                            if args.verbose:
-                                print(msg, file=sys.stderr)
-                            time.sleep(jitter)
-                            attempt += 1
-                            continue
-                        print(f"[WARN] timeout for code {code}", file=sys.stderr)
-                        failures.append(code)
-                        if fail_writer:
-                            try:
-                                fail_writer.writerow({"code": code, "reason": "timeout"})
-                            except Exception:
-                                pass
-                        break
-                    except Exception as e:
-                        if attempt < args.retries:
-                            base = args.retry_base * (args.retry_factor ** attempt)
-                            wait = min(args.retry_max, base)
-                            jitter = random.uniform(0.0, wait)
-                            if args.verbose:
-                                print(
-                                    f"[RETRY] error for {code}: {e}, attempt {attempt+1}/{args.retries}, wait {jitter:.2f}s",
-                                    file=sys.stderr,
-                                )
-                            time.sleep(jitter)
-                            attempt += 1
-                            continue
-                        print(f"[WARN] error for code {code}: {e}", file=sys.stderr)
-                        failures.append(code)
-                        if fail_writer:
-                            try:
-                                fail_writer.writerow({"code": code, "reason": str(e)})
-                            except Exception:
-                                pass
-                        break
+                    summary_path = derive_output_path(args.output)
+                post_table = open_table_writer(
+                    summary_path, post_fieldnames(fieldnames, stages), append=args.append, table="summary"
+                )
+                post = PostWriter(post_table, stages)
+                print(f"[INFO] post stages: {', '.join(args.post)} -> {summary_path}", file=sys.stderr)
+            except Exception as e:
+                print(f"[ERROR] cannot set up --post: {e}", file=sys.stderr)
+                sys.exit(1)
 
-                # baseline sleep with optional jitter
-                if args.jitter_frac > 0:
-                    jf = max(0.0, args.jitter_frac)
-                    delta = args.sleep * random.uniform(-jf, jf)
-                    time.sleep(max(0.0, args.sleep + delta))
-                else:
-                    time.sleep(max(0.0, args.sleep))
-
-                # progress ETA output
-                if args.eta_interval and args.eta_interval > 0:
-                    if (i % args.eta_interval == 0) or (i == len(codes)):
-                        elapsed_so_far = time.time() - start_ts
-                        avg = elapsed_so_far / max(1, i)
-                        remaining = max(0.0, (len(codes) - i) * avg)
-                        eh = int(remaining // 3600)
-                        em = int((remaining % 3600) // 60)
-                        es = int(remaining % 60)
-                        print(
-                            f"[ETA] {i}/{len(codes)} avg={avg:.2f}s eta={eh:02d}:{em:02d}:{es:02d}",
-                            file=sys.stderr,
-                        )
+        start_ts = time.time()
+        sink = ResultSink(
+            writer,
+            fail_writer,
+            len(codes),
+            args.eta_interval,
+            start_ts,
+            store=store,
+            refresh=refresh,
+            state=state,
+            metrics=metrics,
+            post=post,
+            negative=negative,
+        )
+        items: List[Tuple[int, str]] = []
+        negative_skipped: List[str] = []
+        for i, code in enumerate(codes, 1):
+            if args.resume and code in processed:
+                if args.verbose:
+                    print(f"[{i}/{len(codes)}] Skip {code} (resume)", file=sys.stderr)
+                skipped_count += 1
+                continue
+            if code in state_done:
+                if args.verbose:
+                    print(f"[{i}/{len(codes)}] Skip {code} (state db: done)", file=sys.stderr)
+                skipped_count += 1
+                continue
+            neg = negative.lookup(code, start_ts) if negative is not None else None
+            if neg is not None and not args.recheck_negative:
+                if args.verbose:
+                    left = float(neg["ttl"]) - (start_ts - float(neg["at"])) / 86400
+                    print(
+                        f"[{i}/{len(codes)}] Skip {code} (negative cache: {neg['reason']}, {left:.1f} days left)",
+                        file=sys.stderr,
+                    )
+                negative_skipped.append(code)
+                continue
+            if refresh is not None and code in prev_rows and refresh.is_fresh(code, prev_rows[code], start_ts, args.max_age):
+                if args.verbose:
+                    print(f"[{i}/{len(codes)}] Carry {code} (unchanged within --max-age)", file=sys.stderr)
+                sink.carry(i, code, prev_rows[code])
+                continue
+            items.append((i, code))
+        sink.positions = {code: i for i, code in items}
+        if refresh is not None:
+            print(
+                f"[INFO] incremental: carried={len(sink.carried)}, to fetch={len(items)}",
+                file=sys.stderr,
+            )
+        if negative_skipped:
+            detail = f": {', '.join(negative_skipped)}" if len(negative_skipped) <= 20 else ""
+            print(
+                f"[INFO] negative cache: skipped {len(negative_skipped)} codes (--recheck-negative to fetch){detail}",
+                file=sys.stderr,
+            )
+        if args.priority and items:
+            items, n_slow = prioritize(items, state, refresh, metrics_history)
+            print(
+                f"[INFO] priority: {len(items)} codes, stale first; {n_slow} slow/failing codes last",
+                file=sys.stderr,
+            )
 
-            context.close()
-            browser.close()
+        # 抽出計画・許可ホストなどは実行全体で1回だけ作り、銘柄・試行ごとには作り直さない
+        fetch_opts = FetchOptions(args)
+        if args.reextract and store is not None:
+            # 再抽出では読み込み元を上書きしない
+            sink.store = None
+            if items:
+                run_reextract(items, args, sink, store, done_offset=skipped_count)
+        elif args.connect and items:
+            run_remote(items, args, sink, fetch_opts, done_offset=skipped_count)
+        elif (args.engine == "async" or args.pipeline) and items:
+            asyncio.run(run_async(items, args, sink, fetch_opts, done_offset=skipped_count))
+        elif args.concurrency > 1 and items:
+            run_concurrent(items, args, sink, fetch_opts, done_offset=skipped_count)
+        elif items:
+            run_serial(items, args, sink, fetch_opts)
+        sink.flush_carried()
 
         if fail_fp:
             try:
                 fail_fp.close()
             except Exception:
                 pass
+        if metrics_fp:
+            metrics_fp.close()
+        if post_table is not None:
+            post_table.close()
 
+    if state is not None:
+        state.close()
+
+    if negative is not None:
+        try:
+            negative.save()
+        except Exception as e:
+            print(f"[WARN] failed to save negative cache: {e}", file=sys.stderr)
+        if negative.added or negative.cleared:
+            print(
+                f"[INFO] negative cache: added {len(negative.added)}, cleared {len(negative.cleared)} codes",
+                file=sys.stderr,
+            )
+
+    if refresh is not None:
+        try:
+            refresh.save()
+        except Exception as e:
+            print(f"[WARN] failed to save refresh state: {e}", file=sys.stderr)
+        if refresh.changed:
+            print(f"[INFO] content changed: {len(refresh.changed)} codes", file=sys.stderr)
+
+    failures = sink.failures
     if failures:
         if len(failures) <= 20:
             detail = ", ".join(failures)
@@ -646,14 +3798,25 @@ def main():
     else:
         print("[DONE] Completed successfully", file=sys.stderr)
 
+    if args.load_stats:
+        print(fetch_opts.load_totals.summary(), file=sys.stderr)
+    if sink.metrics is not None and sink.metrics.samples:
+        for line in sink.metrics.report():
+            print(line, file=sys.stderr)
+
     # Final summary line (last line)
     elapsed = time.time() - start_ts
     h = int(elapsed // 3600)
     m = int((elapsed % 3600) // 60)
     s = int(elapsed % 60)
     total = len(codes)
+    throughput = (sink.success_count + len(failures)) / elapsed if elapsed > 0 else 0.0
+    engine = "reextract" if args.reextract else ("remote" if args.connect else ("pipeline" if args.pipeline else args.engine))
+    carried = f", carried={sink.carried_count}" if args.incremental else ""
+    negatives = f", negative={len(negative_skipped)}" if negative is not None else ""
+    paths = f", http={sink.paths.get('http', 0)}, browser={sink.paths.get('browser', 0)}" if sink.paths else ""
     print(
-        f"[SUMMARY] success={success_count}, failure={len(failures)}, skipped={skipped_count}, total={total}, elapsed={h:02d}:{m:02d}:{s:02d}",
+        f"[SUMMARY] success={sink.success_count}, failure={len(failures)}, skipped={skipped_count + sink.claimed_elsewhere}{carried}{negatives}{paths}, total={total}, elapsed={h:02d}:{m:02d}:{s:02d}, engine={engine}, rate={throughput:.2f}/s",
         file=sys.stderr,
     )
 
@@ -1,9 +1,17 @@
 import argparse
-import csv
+import glob
+import hashlib
+import json
 import os
 import re
+import sqlite3
 import sys
-from typing import Dict, List, Tuple
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from table_io import open_table_reader, open_table_writer
 
 
 BUSINESS_RE = re.compile(r"^\s*([^\d]+?)(\d+)\((\d+)\)\s*$")
@@ -50,108 +58,375 @@ def parse_business_composition(text: str) -> Tuple[List[Tuple[str, int, int]], i
 
 
 def derive_output_path(input_path: str) -> str:
+    # 出力は入力と同じ形式（拡張子）にする
     base = os.path.basename(input_path)
-    m = re.match(r"(\d{8})_result\.csv$", base)
+    m = re.match(r"(\d{8})_result(\.\w+)$", base)
     if m:
-        ymd = m.group(1)
-        return os.path.join(os.path.dirname(input_path), f"{ymd}_summary.csv")
+        ymd, ext = m.group(1), m.group(2)
+        return os.path.join(os.path.dirname(input_path), f"{ymd}_summary{ext}")
     # Fallbacks for non-standard names
-    if base.endswith("_result.csv"):
-        out = base[:-11] + "_summary.csv"
+    stem, ext = os.path.splitext(base)
+    if stem.endswith("_result"):
+        out = stem[:-7] + "_summary" + ext
         return os.path.join(os.path.dirname(input_path), out)
     # Last resort: append _summary
-    root, _ = os.path.splitext(input_path)
+    root, ext = os.path.splitext(input_path)
     sys.stderr.write(
-        f"[WARN] input filename does not match 'YYYYMMDD_result.csv'; writing {root}_summary.csv\n"
+        f"[WARN] input filename does not match 'YYYYMMDD_result.csv'; writing {root}_summary{ext or '.csv'}\n"
     )
-    return f"{root}_summary.csv"
+    return f"{root}_summary{ext or '.csv'}"
+
+
+# Columns to append (after 'themes')
+EXTRA_COLS = [
+    "business1",
+    "business2",
+    "business3",
+    "business_sales1",
+    "business_sales2",
+    "business_sales3",
+    "business_profit1",
+    "business_profit2",
+    "business_profit3",
+    "overseas",
+]
+
+REQUIRED_COLS = [
+    "code",
+    "company_name",
+    "market",
+    "feature",
+    "business_composition",
+    "industries",
+    "themes",
+]
+
+# 並列時に1タスクで処理する行数と、ワーカーあたりの先行投入チャンク数（メモリ上限）
+DEFAULT_CHUNK_ROWS = 2000
+PENDING_PER_WORKER = 4
+
+
+Parsed = Tuple[List[Tuple[str, int, int]], int]
+
+
+def summary_extras(items: List[Tuple[str, int, int]], overseas: int) -> Dict[str, str]:
+    """parse_business_composition の結果から追加列の値を作る"""
+    # Top 3
+    top = items[:3]
+    # Prepare extra values
+    extras: Dict[str, str] = {}
+    for idx in range(3):
+        name = sales = profit = ""
+        if idx < len(top):
+            bname, bsales, bprofit = top[idx]
+            name = bname
+            sales = str(bsales)
+            bprofit_s = str(bprofit)
+            profit = bprofit_s
+        extras[f"business{idx+1}"] = name
+        extras[f"business_sales{idx+1}"] = sales
+        extras[f"business_profit{idx+1}"] = profit
+    extras["overseas"] = str(overseas) if overseas else ""
+    return extras
+
+
+def parse_chunk(texts: List[str]) -> List[Parsed]:
+    # プロセスプールに渡す単位。行全体ではなく business_composition だけを送る
+    return [parse_business_composition(t) for t in texts]
+
+
+# parse_business_composition の仕様を変えたら上げる（古いキャッシュを無効にする）
+PARSE_VERSION = "1"
+
+
+class ParseCache:
+    """business_composition の解析結果を永続化する SQLite キャッシュ（--cache）
+
+    キーは「PARSE_VERSION + 原文」のハッシュ。実行ごとに参照した行の最終使用時刻を更新し、
+    終了時に max_entries を超えた分を最終使用の古い順に削除する。
+    """
+
+    def __init__(self, path: str, max_entries: int = 200000):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS parsed (key TEXT PRIMARY KEY, items TEXT, overseas INTEGER, used REAL) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS parsed_by_used ON parsed (used)")
+        self.max_entries = max_entries
+        self.now = time.time()
+        self.hits = 0
+        self.misses = 0
+        # 実行中に引いた/解析した結果（同じ文字列は DB を1回しか引かない）と、最終使用時刻を更新するキー
+        self.memo: Dict[str, Parsed] = {}
+        self.touched: List[str] = []
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.blake2b((PARSE_VERSION + "\0" + text).encode("utf-8"), digest_size=16).hexdigest()
+
+    def get_many(self, texts: List[str]) -> Dict[str, Parsed]:
+        found: Dict[str, Parsed] = {}
+        keys: Dict[str, str] = {}
+        for t in texts:
+            hit = self.memo.get(t)
+            if hit is not None:
+                found[t] = hit
+            else:
+                keys[self.key(t)] = t
+        key_list = list(keys)
+        # SQLite のプレースホルダ上限を避けて分割
+        for i in range(0, len(key_list), 500):
+            part = key_list[i : i + 500]
+            marks = ",".join("?" for _ in part)
+            for k, items, overseas in self.conn.execute(
+                f"SELECT key, items, overseas FROM parsed WHERE key IN ({marks})", part
+            ):
+                parsed = ([tuple(x) for x in json.loads(items)], overseas)
+                found[keys[k]] = parsed
+                self.memo[keys[k]] = parsed
+                self.touched.append(k)
+        self.hits += len(found)
+        self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, parsed: Dict[str, Parsed]) -> None:
+        self.memo.update(parsed)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO parsed (key, items, overseas, used) VALUES (?, ?, ?, ?)",
+            [
+                (self.key(t), json.dumps(items, ensure_ascii=False), overseas, self.now)
+                for t, (items, overseas) in parsed.items()
+            ],
+        )
+
+    def close(self) -> int:
+        """参照した行の最終使用時刻を更新し、上限を超えた分を削除して閉じる。削除件数を返す"""
+        self.conn.executemany("UPDATE parsed SET used = ? WHERE key = ?", [(self.now, k) for k in self.touched])
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM parsed").fetchone()
+        evicted = max(0, count - self.max_entries)
+        if evicted:
+            self.conn.execute(
+                "DELETE FROM parsed WHERE key IN (SELECT key FROM parsed ORDER BY used LIMIT ?)", (evicted,)
+            )
+        self.conn.commit()
+        self.conn.close()
+        return evicted
+
+
+def output_fields(fieldnames_in: List[str]) -> List[str]:
+    for col in REQUIRED_COLS:
+        if col not in fieldnames_in:
+            raise ValueError(f"missing required column: {col}")
+    # Build output fieldnames: insert extra cols right after 'themes'
+    out_fields: List[str] = []
+    for name in fieldnames_in:
+        out_fields.append(name)
+        if name == "themes":
+            out_fields.extend(EXTRA_COLS)
+    return out_fields
+
+
+def iter_chunks(reader, size: int) -> Iterator[List[Dict[str, str]]]:
+    chunk: List[Dict[str, str]] = []
+    for row in reader:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def summarize_file(
+    input_path: str,
+    output_path: str,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    pool: Optional[ProcessPoolExecutor] = None,
+    max_pending: int = 1,
+    cache: Optional[ParseCache] = None,
+) -> int:
+    """1ファイルを読み・解析し・書き出す（ストリーミング）。書き込んだ行数を返す
+
+    チャンク内の同じ文字列とキャッシュ済みの文字列は解析しない。pool を渡すと残りの解析を
+    チャンク単位でワーカーに投げ、投入順に書き出す（行順は入力と同じ）。先行投入は max_pending チャンクまで。
+    """
+    n = 0
+    with open_table_reader(input_path) as reader:
+        out_fields = output_fields(reader.fieldnames or [])
+        with open_table_writer(output_path, out_fields, table="summary") as writer:
+
+            def write(rows, texts, known, todo, parsed) -> None:
+                new = dict(zip(todo, parsed))
+                if cache is not None and new:
+                    cache.put_many(new)
+                known.update(new)
+                for row, text in zip(rows, texts):
+                    out = dict(row)
+                    out.update(summary_extras(*known[text]))
+                    writer.writerow(out)
+
+            pending: deque = deque()
+            for chunk in iter_chunks(reader, chunk_rows):
+                texts = [(row.get("business_composition") or "").strip() for row in chunk]
+                unique = list(dict.fromkeys(texts))
+                known = cache.get_many(unique) if cache is not None else {}
+                todo = [t for t in unique if t not in known]
+                if pool is None or not todo:
+                    write(chunk, texts, known, todo, parse_chunk(todo))
+                else:
+                    pending.append((chunk, texts, known, todo, pool.submit(parse_chunk, todo)))
+                    if len(pending) >= max_pending:
+                        rows, t, k, td, fut = pending.popleft()
+                        write(rows, t, k, td, fut.result())
+                n += len(chunk)
+            while pending:
+                rows, t, k, td, fut = pending.popleft()
+                write(rows, t, k, td, fut.result())
+    return n
+
+
+def _summarize_file_job(task: Tuple[str, str, int]) -> Tuple[int, float]:
+    # ファイル単位の並列処理用（各ワーカーが1ファイルを丸ごと処理する）
+    input_path, output_path, chunk_rows = task
+    t0 = time.time()
+    n = summarize_file(input_path, output_path, chunk_rows)
+    return n, time.time() - t0
+
+
+def is_summary_path(path: str) -> bool:
+    return os.path.splitext(os.path.basename(path))[0].endswith("_summary")
+
+
+def expand_inputs(patterns: List[str]) -> List[str]:
+    """--input の値（パスまたはグロブ）を展開する。グロブは名前順、重複は除く
+
+    グロブに一致した *_summary.* （このスクリプトの出力）は入力にしない。明示したパスはそのまま使う。
+    """
+    paths: List[str] = []
+    for pat in patterns:
+        if glob.has_magic(pat):
+            matched = sorted(glob.glob(pat))
+            outputs = [p for p in matched if is_summary_path(p)]
+            if outputs:
+                sys.stderr.write(f"[INFO] skipping {len(outputs)} *_summary files matched by {pat}\n")
+                matched = [p for p in matched if not is_summary_path(p)]
+        else:
+            matched = [pat]
+        if not matched:
+            sys.stderr.write(f"[WARN] no files match {pat}\n")
+        for path in matched:
+            if path not in paths:
+                paths.append(path)
+    return paths
 
 
 def main():
     parser = argparse.ArgumentParser(description="Expand business_composition columns and write *_summary.csv")
-    parser.add_argument("--input", required=True, help="input CSV path (e.g., 20250914_result.csv)")
+    parser.add_argument(
+        "--input",
+        required=True,
+        nargs="+",
+        help="input paths or globs (e.g., 20250914_result.csv or '2024*_result.csv'); "
+        ".parquet, .arrow and .sqlite are also accepted",
+    )
     parser.add_argument(
         "--output",
         default="",
-        help="optional explicit output path; defaults to derived YYYYMMDD_summary.csv",
+        help="optional explicit output path for a single input (format by extension); "
+        "defaults to derived YYYYMMDD_summary.<ext>",
+    )
+    parser.add_argument("--output-dir", default="", help="write derived output files into this directory")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (1=single process, 0=CPU count)")
+    parser.add_argument(
+        "--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="rows per parallel task (default: 2000)"
+    )
+    parser.add_argument(
+        "--cache", default="", help="SQLite cache of parsed business_composition strings reused across runs"
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=200000, help="max cached strings; least recently used are evicted"
     )
     args = parser.parse_args()
 
-    input_path = args.input
-    output_path = args.output or derive_output_path(input_path)
-
-    # Columns to append (after 'themes')
-    extra_cols = [
-        "business1",
-        "business2",
-        "business3",
-        "business_sales1",
-        "business_sales2",
-        "business_sales3",
-        "business_profit1",
-        "business_profit2",
-        "business_profit3",
-        "overseas",
-    ]
+    inputs = expand_inputs(args.input)
+    if not inputs:
+        sys.stderr.write("[ERROR] no input files\n")
+        sys.exit(1)
+    if args.output and len(inputs) > 1:
+        sys.stderr.write("[ERROR] --output can only be used with a single input; use --output-dir\n")
+        sys.exit(1)
+    jobs: List[Tuple[str, str]] = []
+    for input_path in inputs:
+        output_path = args.output or derive_output_path(input_path)
+        if args.output_dir and not args.output:
+            output_path = os.path.join(args.output_dir, os.path.basename(output_path))
+        jobs.append((input_path, output_path))
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
 
-    try:
-        with open(input_path, "r", encoding="utf-8-sig", newline="") as fi:
-            reader = csv.DictReader(fi)
-            fieldnames_in = reader.fieldnames or []
-            required = [
-                "code",
-                "company_name",
-                "market",
-                "feature",
-                "business_composition",
-                "industries",
-                "themes",
-            ]
-            for col in required:
-                if col not in fieldnames_in:
-                    raise ValueError(f"missing required column: {col}")
-
-            # Build output fieldnames: insert extra cols right after 'themes'
-            out_fields: List[str] = []
-            for name in fieldnames_in:
-                out_fields.append(name)
-                if name == "themes":
-                    out_fields.extend(extra_cols)
-
-            with open(output_path, "w", encoding="utf-8-sig", newline="") as fo:
-                writer = csv.DictWriter(fo, fieldnames=out_fields, extrasaction="ignore")
-                writer.writeheader()
-
-                for row in reader:
-                    text = (row.get("business_composition") or "").strip()
-                    items, overseas = parse_business_composition(text)
-                    # Top 3
-                    top = items[:3]
-                    # Prepare extra values
-                    extras: Dict[str, str] = {}
-                    for idx in range(3):
-                        name = sales = profit = ""
-                        if idx < len(top):
-                            bname, bsales, bprofit = top[idx]
-                            name = bname
-                            sales = str(bsales)
-                            bprofit_s = str(bprofit)
-                            profit = bprofit_s
-                        extras[f"business{idx+1}"] = name
-                        extras[f"business_sales{idx+1}"] = sales
-                        extras[f"business_profit{idx+1}"] = profit
-                    extras["overseas"] = str(overseas) if overseas else ""
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    chunk_rows = max(1, args.chunk_rows)
+    start = time.time()
+    total_rows = 0
+    failed = 0
 
-                    out = dict(row)
-                    out.update(extras)
-                    writer.writerow(out)
+    def done(input_path: str, output_path: str, n: int, elapsed: float) -> None:
+        rate = n / elapsed if elapsed > 0 else 0.0
+        sys.stderr.write(f"[DONE] wrote {output_path} ({n} rows, {rate:.0f} rows/s)\n")
 
-        sys.stderr.write(f"[DONE] wrote {output_path}\n")
-    except Exception as e:
-        sys.stderr.write(f"[ERROR] {e}\n")
+    cache: Optional[ParseCache] = None
+    if args.cache:
+        try:
+            cache = ParseCache(args.cache, max(1, args.cache_size))
+        except Exception as e:
+            sys.stderr.write(f"[ERROR] cannot open cache {args.cache}: {e}\n")
+            sys.exit(1)
+
+    pool: Optional[ProcessPoolExecutor] = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # キャッシュはこのプロセスだけが持つため、使う場合はチャンク単位の並列化にする
+        if pool is not None and cache is None and len(jobs) >= workers:
+            # ファイル数がワーカー数以上ならファイル単位で並列化（読み書きも並列になる）
+            futures = [(i, o, pool.submit(_summarize_file_job, (i, o, chunk_rows))) for i, o in jobs]
+            for input_path, output_path, fut in futures:
+                try:
+                    n, elapsed = fut.result()
+                    total_rows += n
+                    done(input_path, output_path, n, elapsed)
+                except Exception as e:
+                    failed += 1
+                    sys.stderr.write(f"[ERROR] {input_path}: {e}\n")
+        else:
+            for input_path, output_path in jobs:
+                t0 = time.time()
+                try:
+                    n = summarize_file(
+                        input_path, output_path, chunk_rows, pool, workers * PENDING_PER_WORKER, cache=cache
+                    )
+                    total_rows += n
+                    done(input_path, output_path, n, time.time() - t0)
+                except Exception as e:
+                    failed += 1
+                    sys.stderr.write(f"[ERROR] {input_path}: {e}\n")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if cache is not None:
+            evicted = cache.close()
+            sys.stderr.write(
+                f"[INFO] cache: hits={cache.hits}, parsed={cache.misses}, evicted={evicted} ({args.cache})\n"
+            )
+
+    elapsed = time.time() - start
+    rate = total_rows / elapsed if elapsed > 0 else 0.0
+    sys.stderr.write(
+        f"[SUMMARY] files={len(jobs) - failed}/{len(jobs)}, rows={total_rows}, "
+        f"elapsed={elapsed:.2f}s, rate={rate:.0f} rows/s, workers={workers}\n"
+    )
+    if failed:
         sys.exit(1)
 
 
 if __name__ == "__main__":
     main()
-
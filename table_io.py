@@ -0,0 +1,370 @@
+"""結果/サマリー表の入出力（CSV・Parquet・Arrow IPC・SQLite）
+
+形式はパスの拡張子で判定する:
+  .csv（既定、UTF-8 BOM）/ .parquet / .arrow・.feather・.ipc（Arrow IPC ファイル）/ .sqlite・.sqlite3・.db
+
+industries/themes はリスト列、summary の数値列は整数列として保存し、読み込み時は CSV と同じ文字列
+（カンマ区切り・空欄）に戻すので、呼び出し側は形式を意識しない。
+Parquet/Arrow は pyarrow が必要（extra "arrow"。必要になった時点で import する）。
+"""
+
+import abc
+import csv
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+LIST_COLUMNS = ("industries", "themes")
+INT_COLUMNS = (
+    "business_sales1",
+    "business_sales2",
+    "business_sales3",
+    "business_profit1",
+    "business_profit2",
+    "business_profit3",
+    "overseas",
+)
+
+FORMAT_BY_EXT = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+    ".sqlite": "sqlite",
+    ".sqlite3": "sqlite",
+    ".db": "sqlite",
+}
+
+# Parquet の行グループ / Arrow のバッチ、SQLite のコミット単位
+BATCH_ROWS = 1000
+# Parquet/Arrow の書き出し済みファイルを更新する間隔（秒）
+CHECKPOINT_SEC = 60.0
+
+
+def table_format(path: str) -> str:
+    return FORMAT_BY_EXT.get(os.path.splitext(path)[1].lower(), "csv")
+
+
+def require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise RuntimeError("pyarrow is required for Parquet/Arrow files; install the 'arrow' extra (uv sync --extra arrow)")
+    return pyarrow
+
+
+def to_typed(col: str, value: Any) -> Any:
+    """CSV の文字列値を列の型に変換する（リスト列は list、数値列は int/None）"""
+    value = "" if value is None else value
+    if col in LIST_COLUMNS:
+        if isinstance(value, list):
+            return value
+        return [t for t in str(value).split(",") if t]
+    if col in INT_COLUMNS:
+        try:
+            return int(value) if str(value).strip() else None
+        except ValueError:
+            return None
+    return str(value)
+
+
+def from_typed(col: str, value: Any) -> str:
+    """to_typed の逆変換（CSV と同じ文字列表現に戻す）"""
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return ",".join(str(v) for v in value)
+    if col in LIST_COLUMNS and isinstance(value, str) and value.startswith("["):
+        # SQLite では JSON 配列として保存している
+        try:
+            return ",".join(str(v) for v in json.loads(value))
+        except ValueError:
+            return value
+    return str(value)
+
+
+class TableWriter(abc.ABC):
+    """csv.DictWriter と同じ writerow/writerows を持つ書き込み口。with で使う"""
+
+    def __init__(self, fieldnames: List[str]):
+        self.fieldnames = list(fieldnames)
+
+    @abc.abstractmethod
+    def writerow(self, row: Dict[str, Any]) -> None:
+        """1行を書く（fieldnames に無いキーは無視）"""
+
+    def writerows(self, rows) -> None:
+        for row in rows:
+            self.writerow(row)
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "TableWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class CsvTableWriter(TableWriter):
+    def __init__(self, path: str, fieldnames: List[str], append: bool = False):
+        super().__init__(fieldnames)
+        mode = "a" if (append and os.path.exists(path)) else "w"
+        # Excelなどでの文字化け回避のためUTF-8 BOM付きで出力
+        self.fp = open(path, mode, encoding="utf-8-sig", newline="")
+        self.writer = csv.DictWriter(self.fp, fieldnames=self.fieldnames, extrasaction="ignore")
+        if mode == "w":
+            self.writer.writeheader()
+
+    def writerow(self, row: Dict[str, Any]) -> None:
+        self.writer.writerow(row)
+
+    def close(self) -> None:
+        self.fp.close()
+
+
+class ArrowTableWriter(TableWriter):
+    """Parquet / Arrow IPC への書き込み。BATCH_ROWS 行ごとにバッチを書き出す
+
+    途中で異常終了しても壊れたファイルを残さないよう一時ファイルに書き、本来のパスへは置き換えで出す。
+    どちらの形式も追記できないので、CHECKPOINT_SEC 秒ごと（またはバッチごと）にそこまでの行を置き換えで書き出し、
+    一時ファイルはその内容を写して書き続ける。強制終了で失うのは最後のチェックポイント以降の行だけで、
+    書き出し済みの行は --resume --append で引き継げる。
+    append では既存ファイルの行を先に書き写す。
+    """
+
+    def __init__(self, path: str, fieldnames: List[str], fmt: str, append: bool = False):
+        super().__init__(fieldnames)
+        pa = require_pyarrow()
+        self.pa = pa
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        fields = []
+        for name in self.fieldnames:
+            if name in LIST_COLUMNS:
+                fields.append(pa.field(name, pa.list_(pa.string())))
+            elif name in INT_COLUMNS:
+                fields.append(pa.field(name, pa.int64()))
+            else:
+                fields.append(pa.field(name, pa.string()))
+        self.schema = pa.schema(fields)
+        self.fmt = fmt
+        self._open()
+        self.buffer: List[Dict[str, Any]] = []
+        self.unsaved = 0
+        self.last_checkpoint = time.monotonic()
+        if append and os.path.exists(path):
+            # 既存の行を写し終えるまではチェックポイントしない（途中で置き換えると写していない行を失う）
+            with open_table_reader(path) as reader:
+                for row in reader:
+                    self.buffer.append(self._typed(row))
+                    if len(self.buffer) >= BATCH_ROWS:
+                        self._write_buffer()
+            self._write_buffer()
+            self.unsaved = 0
+
+    def _typed(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        return {name: to_typed(name, row.get(name)) for name in self.fieldnames}
+
+    def _open(self) -> None:
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema, compression="zstd")
+        else:
+            import pyarrow.ipc as ipc
+
+            self.writer = ipc.new_file(self.tmp_path, self.schema)
+
+    def writerow(self, row: Dict[str, Any]) -> None:
+        self.buffer.append(self._typed(row))
+        if len(self.buffer) >= BATCH_ROWS:
+            self.flush()
+        if self.buffer and time.monotonic() - self.last_checkpoint >= CHECKPOINT_SEC:
+            self.checkpoint()
+
+    def _write_buffer(self) -> None:
+        if not self.buffer:
+            return
+        batch = self.pa.RecordBatch.from_pylist(self.buffer, schema=self.schema)
+        if self.fmt == "parquet":
+            self.writer.write_batch(batch)
+        else:
+            self.writer.write(batch)
+        self.unsaved += len(self.buffer)
+        self.buffer = []
+
+    def flush(self) -> None:
+        self._write_buffer()
+        if self.unsaved >= BATCH_ROWS:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """ここまでの行を本来のパスに書き出し、続きはその内容を写した一時ファイルに書く"""
+        self._write_buffer()
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+        self._open()
+        if self.fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            self.writer.write_table(pq.read_table(self.path), row_group_size=BATCH_ROWS)
+        else:
+            import pyarrow.ipc as ipc
+
+            with self.pa.OSFile(self.path, "rb") as f:
+                table = ipc.open_file(f).read_all().combine_chunks()
+            self.writer.write_table(table, max_chunksize=BATCH_ROWS)
+        self.unsaved = 0
+        self.last_checkpoint = time.monotonic()
+
+    def close(self) -> None:
+        self._write_buffer()
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class SqliteTableWriter(TableWriter):
+    """SQLite のテーブルへ書き込む（code を主キーに INSERT OR REPLACE）
+
+    リスト列は JSON 配列テキスト（json_each で展開可能）、数値列は INTEGER。
+    append でなければ既存の行を消してから書く。BATCH_ROWS 行ごとにコミットする。
+    作成したスレッドとは別の書き込み専用スレッド（scrape.py --pipeline）からも使えるようにする。
+    """
+
+    def __init__(self, path: str, fieldnames: List[str], table: str, append: bool = False):
+        super().__init__(fieldnames)
+        self.table = table
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        cols = []
+        for name in self.fieldnames:
+            ctype = "INTEGER" if name in INT_COLUMNS else "TEXT"
+            cols.append(f'"{name}" {ctype}' + (" PRIMARY KEY" if name == "code" else ""))
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({", ".join(cols)})')
+        existing = {r[1] for r in self.conn.execute(f'PRAGMA table_info("{table}")')}
+        for name in self.fieldnames:
+            if name not in existing:
+                ctype = "INTEGER" if name in INT_COLUMNS else "TEXT"
+                self.conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{name}" {ctype}')
+        if not append:
+            self.conn.execute(f'DELETE FROM "{table}"')
+        self.conn.commit()
+        placeholders = ", ".join("?" for _ in self.fieldnames)
+        names = ", ".join(f'"{n}"' for n in self.fieldnames)
+        self.sql = f'INSERT OR REPLACE INTO "{table}" ({names}) VALUES ({placeholders})'
+        self.pending = 0
+
+    def writerow(self, row: Dict[str, Any]) -> None:
+        values = []
+        for name in self.fieldnames:
+            v = to_typed(name, row.get(name))
+            values.append(json.dumps(v, ensure_ascii=False) if isinstance(v, list) else v)
+        self.conn.execute(self.sql, values)
+        self.pending += 1
+        if self.pending >= BATCH_ROWS:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+
+def open_table_writer(path: str, fieldnames: List[str], append: bool = False, table: str = "result") -> TableWriter:
+    fmt = table_format(path)
+    if fmt in ("parquet", "arrow"):
+        return ArrowTableWriter(path, fieldnames, fmt, append=append)
+    if fmt == "sqlite":
+        return SqliteTableWriter(path, fieldnames, table, append=append)
+    return CsvTableWriter(path, fieldnames, append=append)
+
+
+class TableReader:
+    """csv.DictReader と同様に fieldnames と行（値はすべて CSV と同じ文字列）の反復を提供する"""
+
+    def __init__(self, path: str, table: str = ""):
+        self.path = path
+        self.fmt = table_format(path)
+        self.fp = None
+        self.conn: Optional[sqlite3.Connection] = None
+        if self.fmt == "csv":
+            self.fp = open(path, "r", encoding="utf-8-sig", newline="")
+            self.reader = csv.DictReader(self.fp)
+            self.fieldnames: List[str] = list(self.reader.fieldnames or [])
+        elif self.fmt in ("parquet", "arrow"):
+            require_pyarrow()
+            if self.fmt == "parquet":
+                import pyarrow.parquet as pq
+
+                self.source = pq.ParquetFile(path)
+                self.fieldnames = list(self.source.schema_arrow.names)
+            else:
+                import pyarrow.ipc as ipc
+
+                self.source = ipc.open_file(path)
+                self.fieldnames = list(self.source.schema.names)
+        else:
+            self.conn = sqlite3.connect(path)
+            self.table = table or self._default_table()
+            self.fieldnames = [r[1] for r in self.conn.execute(f'PRAGMA table_info("{self.table}")')]
+            if not self.fieldnames:
+                raise ValueError(f"table '{self.table}' not found in {path}")
+
+    def _default_table(self) -> str:
+        names = [r[0] for r in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+        if len(names) == 1:
+            return names[0]
+        if "result" in names:
+            return "result"
+        raise ValueError(f"cannot choose a table in {self.path}: {', '.join(names) or '(none)'}")
+
+    def _batches(self) -> Iterator[List[Dict[str, Any]]]:
+        if self.fmt == "parquet":
+            for batch in self.source.iter_batches(batch_size=BATCH_ROWS):
+                yield batch.to_pylist()
+        elif self.fmt == "arrow":
+            for i in range(self.source.num_record_batches):
+                yield self.source.get_batch(i).to_pylist()
+        else:
+            # 読み取りロックを持ち続けないよう rowid 順に区切って読む（同じDBへの書き込みと併用できる）
+            names = ", ".join(f'"{n}"' for n in self.fieldnames)
+            last = 0
+            while True:
+                rows = self.conn.execute(
+                    f'SELECT rowid, {names} FROM "{self.table}" WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                    (last, BATCH_ROWS),
+                ).fetchall()
+                if not rows:
+                    return
+                last = rows[-1][0]
+                yield [dict(zip(self.fieldnames, r[1:])) for r in rows]
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        if self.fmt == "csv":
+            yield from self.reader
+            return
+        for batch in self._batches():
+            for row in batch:
+                yield {k: from_typed(k, v) for k, v in row.items()}
+
+    def close(self) -> None:
+        if self.fp is not None:
+            self.fp.close()
+        if self.conn is not None:
+            self.conn.close()
+
+    def __enter__(self) -> "TableReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def open_table_reader(path: str, table: str = "") -> TableReader:
+    return TableReader(path, table)
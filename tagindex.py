@@ -0,0 +1,382 @@
+import argparse
+import csv
+import glob
+import json
+import mmap
+import os
+import re
+import sys
+import time
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+from summary import parse_business_composition
+from table_io import open_table_reader, open_table_writer
+
+
+# インデックスファイル: MAGIC + ヘッダ長(4バイト LE) + JSONヘッダ + 4バイト境界に揃えた uint32 ポスティング
+MAGIC = b"TAGIDX1\0"
+DATE_RE = re.compile(r"(\d{8})_")
+
+# クエリで使うフィールド名（別名 → インデックス上の名前）
+FIELD_ALIASES = {
+    "industry": "industry",
+    "industries": "industry",
+    "theme": "theme",
+    "themes": "theme",
+    "market": "market",
+    "segment": "segment",
+    "code": "code",
+}
+# フィールド名なしの語は所属業界・テーマのどちらかに一致すれば対象
+TAG_FIELDS = ("industry", "theme")
+
+
+def split_list(value: str) -> List[str]:
+    return [t.strip() for t in (value or "").split(",") if t.strip()]
+
+
+def row_terms(row: Dict[str, str]) -> Dict[str, List[str]]:
+    """1行からフィールドごとの語を取り出す。segment は business_composition の事業名（無ければ business1..3）"""
+    if row.get("business_composition"):
+        segments = [name for name, _, _ in parse_business_composition(row["business_composition"])[0]]
+    else:
+        segments = [row.get(f"business{k}") or "" for k in (1, 2, 3)]
+    return {
+        "industry": split_list(row.get("industries") or ""),
+        "theme": split_list(row.get("themes") or ""),
+        "market": [row.get("market") or ""],
+        "segment": segments,
+        "code": [row.get("code") or ""],
+    }
+
+
+def build_index(input_path: str, output_path: str) -> Tuple[int, int]:
+    """結果/サマリー表から転置インデックスを作る。(銘柄数, 語数) を返す"""
+    codes: List[List[str]] = []
+    postings: Dict[str, Dict[str, List[int]]] = {f: {} for f in FIELD_ALIASES.values()}
+    seen: Set[str] = set()
+    with open_table_reader(input_path) as reader:
+        if "code" not in (reader.fieldnames or []):
+            raise ValueError(f"{input_path} has no 'code' column")
+        for row in reader:
+            code = (row.get("code") or "").strip()
+            if not code or code in seen:
+                continue
+            seen.add(code)
+            doc = len(codes)
+            codes.append([code, row.get("company_name") or "", row.get("market") or ""])
+            for field, terms in row_terms(row).items():
+                for term in dict.fromkeys(t for t in terms if t):
+                    postings[field].setdefault(term, []).append(doc)
+
+    # 銘柄番号は入力順に振るので各ポスティングは昇順のまま
+    data = array("I")
+    directory: Dict[str, Dict[str, List[int]]] = {}
+    for field, terms in postings.items():
+        directory[field] = {}
+        for term in sorted(terms):
+            directory[field][term] = [len(data), len(terms[term])]
+            data.extend(terms[term])
+    if sys.byteorder != "little":
+        data.byteswap()
+    m = DATE_RE.match(os.path.basename(input_path))
+    header = json.dumps(
+        {
+            "source": os.path.abspath(input_path),
+            "date": m.group(1) if m else "",
+            "built_at": time.time(),
+            "codes": codes,
+            "fields": directory,
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 4)
+    tmp = output_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(4, "little"))
+        f.write(header)
+        f.write(data.tobytes())
+    os.replace(tmp, output_path)
+    return len(codes), sum(len(t) for t in directory.values())
+
+
+class TagIndex:
+    """build_index で作ったファイルを mmap で開き、ポスティングを必要な分だけ読む"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fp = open(path, "rb")
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a tag index (rebuild with 'tagindex.py build')")
+        n = int.from_bytes(self.mm[len(MAGIC) : len(MAGIC) + 4], "little")
+        start = len(MAGIC) + 4
+        meta = json.loads(self.mm[start : start + n].decode("utf-8"))
+        self.base = start + n
+        self.source: str = meta.get("source") or ""
+        self.date: str = meta.get("date") or ""
+        self.codes: List[List[str]] = meta["codes"]
+        self.fields: Dict[str, Dict[str, List[int]]] = meta["fields"]
+        self.universe: Set[int] = set(range(len(self.codes)))
+
+    def postings(self, field: str, term: str) -> Set[int]:
+        entry = self.fields.get(field, {}).get(term)
+        if entry is None:
+            return set()
+        offset, count = entry
+        lo = self.base + offset * 4
+        with memoryview(self.mm)[lo : lo + count * 4] as raw:
+            if sys.byteorder == "little":
+                with raw.cast("I") as ids:
+                    return set(ids)
+            a = array("I", raw.tobytes())
+            a.byteswap()
+            return set(a)
+
+    def matches(self, field: str, term: str) -> Set[int]:
+        """term が * で終わる場合は前方一致する語すべての和集合"""
+        if not term.endswith("*"):
+            return self.postings(field, term)
+        prefix = term[:-1]
+        out: Set[int] = set()
+        for t in self.fields.get(field, {}):
+            if t.startswith(prefix):
+                out |= self.postings(field, t)
+        return out
+
+    def lookup(self, field: Optional[str], term: str) -> Set[int]:
+        if field is None:
+            out: Set[int] = set()
+            for f in TAG_FIELDS:
+                out |= self.matches(f, term)
+            return out
+        if field == "peers":
+            # 指定銘柄と所属業界を1つ以上共有する銘柄（本人を除く）
+            me = self.postings("code", term)
+            out = set()
+            for ind, _ in self.fields.get("industry", {}).items():
+                ids = self.postings("industry", ind)
+                if ids & me:
+                    out |= ids
+            return out - me
+        return self.matches(field, term)
+
+    def facet(self, field: str, docs: Set[int]) -> List[Tuple[str, int]]:
+        counts = [(term, len(self.postings(field, term) & docs)) for term in self.fields.get(field, {})]
+        return sorted((c for c in counts if c[1]), key=lambda c: (-c[1], c[0]))
+
+    def close(self) -> None:
+        self.mm.close()
+        self.fp.close()
+
+
+TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|((?:[\w]+:)?"[^"]*")|([^\s()]+))')
+
+
+def tokenize(query: str) -> List[str]:
+    tokens: List[str] = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        m = TOKEN_RE.match(query, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"cannot parse query near {query[pos:]!r}")
+        tokens.append(next(g for g in m.groups() if g is not None))
+        pos = m.end()
+    return tokens
+
+
+class Query:
+    """AND / OR / NOT と括弧の式（AND は省略可）。語は field:value または value（所属業界・テーマ）
+
+    value の末尾の * は前方一致。peers:CODE はその銘柄と所属業界を共有する銘柄。
+    例: 'theme:創薬 market:東証グロース'、'(industry:半導体* OR theme:半導体) NOT market:東証プライム'、'peers:7203'
+    """
+
+    def __init__(self, text: str):
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.tree = self._or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"unexpected {self.tokens[self.pos]!r} in query")
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _or(self):
+        node = self._and()
+        while self._peek() == "OR":
+            self.pos += 1
+            node = ("or", node, self._and())
+        return node
+
+    def _and(self):
+        node = self._not()
+        while self._peek() not in (None, "OR", ")"):
+            if self._peek() == "AND":
+                self.pos += 1
+            node = ("and", node, self._not())
+        return node
+
+    def _not(self):
+        if self._peek() == "NOT":
+            self.pos += 1
+            return ("not", self._not())
+        return self._atom()
+
+    def _atom(self):
+        tok = self._peek()
+        if tok is None:
+            raise ValueError("query ends unexpectedly")
+        self.pos += 1
+        if tok == "(":
+            node = self._or()
+            if self._peek() != ")":
+                raise ValueError("missing ')' in query")
+            self.pos += 1
+            return node
+        if tok in ("AND", "OR", ")"):
+            raise ValueError(f"unexpected {tok!r} in query")
+        field: Optional[str] = None
+        value = tok
+        if ":" in tok and not tok.startswith('"'):
+            name, value = tok.split(":", 1)
+            if name.lower() == "peers":
+                field = "peers"
+            elif name.lower() in FIELD_ALIASES:
+                field = FIELD_ALIASES[name.lower()]
+            else:
+                raise ValueError(f"unknown field {name!r} (use {', '.join(sorted(FIELD_ALIASES))}, peers)")
+        return ("term", field, value.strip('"'))
+
+    def evaluate(self, index: TagIndex, node=None) -> Set[int]:
+        node = self.tree if node is None else node
+        kind = node[0]
+        if kind == "term":
+            return index.lookup(node[1], node[2])
+        if kind == "not":
+            return index.universe - self.evaluate(index, node[1])
+        left = self.evaluate(index, node[1])
+        right = self.evaluate(index, node[2])
+        return left & right if kind == "and" else left | right
+
+
+def index_path_for(input_path: str, output_dir: str = "") -> str:
+    root = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir or os.path.dirname(input_path) or ".", root + ".idx")
+
+
+def expand(patterns: List[str]) -> List[str]:
+    paths: List[str] = []
+    for pat in patterns:
+        matched = sorted(glob.glob(pat)) if glob.has_magic(pat) else [pat]
+        if not matched:
+            print(f"[WARN] no files match {pat}", file=sys.stderr)
+        paths.extend(p for p in matched if p not in paths)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inverted index of industries/themes/market/segments with boolean queries")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="build YYYYMMDD_result.idx from result/summary tables (any table format)")
+    p_build.add_argument("inputs", nargs="+", help="input paths or globs")
+    p_build.add_argument("--output-dir", default="", help="write indexes here (default: next to each input)")
+
+    p_query = sub.add_parser("query", help="codes matching a boolean query in one or more snapshots")
+    p_query.add_argument("query", help="e.g. 'theme:創薬 market:東証グロース' or '(industry:半導体 OR 半導体) NOT market:東証プライム'")
+    p_query.add_argument("--index", nargs="+", required=True, help="index paths or globs (one per snapshot)")
+    p_query.add_argument(
+        "--facet", action="append", default=[], help="also count matches per term of this field (industry/theme/market/segment)"
+    )
+    p_query.add_argument("--count", action="store_true", help="print only the number of matches per snapshot")
+    p_query.add_argument("--changes", action="store_true", help="only codes entering/leaving the result between snapshots")
+    p_query.add_argument("--output", default="", help="write rows to this path (.csv/.parquet/.sqlite) instead of stdout")
+
+    p_terms = sub.add_parser("terms", help="list terms of a field with their code counts")
+    p_terms.add_argument("--index", required=True, help="index path")
+    p_terms.add_argument("--field", default="theme", help="industry/theme/market/segment (default: theme)")
+    p_terms.add_argument("--prefix", default="", help="only terms starting with this")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "build":
+            if args.output_dir:
+                os.makedirs(args.output_dir, exist_ok=True)
+            for path in expand(args.inputs):
+                t0 = time.time()
+                out = index_path_for(path, args.output_dir)
+                n_codes, n_terms = build_index(path, out)
+                print(
+                    f"[DONE] {out}: {n_codes} codes, {n_terms} terms, {os.path.getsize(out)} bytes ({time.time() - t0:.2f}s)",
+                    file=sys.stderr,
+                )
+        elif args.command == "query":
+            query = Query(args.query)
+            for f in args.facet:
+                if FIELD_ALIASES.get(f.lower()) is None:
+                    raise ValueError(f"unknown facet field {f!r}")
+            indexes = [TagIndex(p) for p in expand(args.index)]
+            if not indexes:
+                raise ValueError("no index files")
+            # 日付（ファイル名の YYYYMMDD）順に並べる
+            indexes.sort(key=lambda ix: (ix.date, ix.path))
+            rows: List[Dict[str, str]] = []
+            prev: Optional[Dict[str, List[str]]] = None
+            for ix in indexes:
+                t0 = time.perf_counter()
+                docs = query.evaluate(ix)
+                took = (time.perf_counter() - t0) * 1000
+                label = ix.date or os.path.basename(ix.path)
+                print(f"[INFO] {label}: {len(docs)} codes ({took:.1f} ms)", file=sys.stderr)
+                matched = {ix.codes[d][0]: ix.codes[d] for d in sorted(docs)}
+                if args.changes:
+                    if prev is not None:
+                        for code, (c, name, market) in matched.items():
+                            if code not in prev:
+                                rows.append({"date": label, "change": "added", "code": c, "company_name": name, "market": market})
+                        for code, (c, name, market) in prev.items():
+                            if code not in matched:
+                                rows.append({"date": label, "change": "removed", "code": c, "company_name": name, "market": market})
+                    prev = matched
+                elif not args.count:
+                    for c, name, market in matched.values():
+                        rows.append({"date": label, "code": c, "company_name": name, "market": market})
+                for f in args.facet:
+                    for term, n in ix.facet(FIELD_ALIASES[f.lower()], docs):
+                        print(f"[FACET] {label} {f}={term}\t{n}", file=sys.stderr)
+            for ix in indexes:
+                ix.close()
+            if args.count:
+                return
+            fields = ["date", "change", "code", "company_name", "market"] if args.changes else ["date", "code", "company_name", "market"]
+            if args.output:
+                with open_table_writer(args.output, fields, table="query") as w:
+                    w.writerows(rows)
+                print(f"[DONE] {len(rows)} rows written to {args.output}", file=sys.stderr)
+            else:
+                w = csv.DictWriter(sys.stdout, fieldnames=fields, lineterminator="\n")
+                w.writeheader()
+                w.writerows(rows)
+        else:
+            field = FIELD_ALIASES.get(args.field.lower())
+            if field is None:
+                raise ValueError(f"unknown field {args.field!r}")
+            ix = TagIndex(args.index)
+            try:
+                for term, (_, count) in sorted(ix.fields.get(field, {}).items(), key=lambda kv: (-kv[1][1], kv[0])):
+                    if term.startswith(args.prefix):
+                        print(f"{term}\t{count}")
+            finally:
+                ix.close()
+    except Exception as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
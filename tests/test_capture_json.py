@@ -0,0 +1,115 @@
+"""--capture-json（実験的）: 捕捉した JSON 応答の対応付けと DOM へのフォールバック"""
+
+import argparse
+import copy
+import gzip
+import json
+
+from scrape import (
+    JsonCapture,
+    _reextract_one,
+    fields_from_payloads,
+    fields_from_snapshot,
+    payload_fields_complete,
+    run_steps,
+)
+
+SNAP = {
+    "h1": ["極洋"],
+    "body": "極洋\n東証プライム",
+    "dl": [
+        {"dt": "所属業界", "text": "水産 食品", "items": [["水産", 10], ["食品", 11]], "stop_top": None},
+        {"dt": "市場テーマ", "text": "寿司", "items": [["寿司", 30]], "stop_top": None},
+    ],
+    "th": [],
+    "labels": {k: {"text": "", "items": []} for k in ("feature", "business", "comparison", "industries", "themes")},
+}
+DOM = fields_from_snapshot(SNAP)
+
+# どのキーも JSON_FIELD_KEYS に無い応答・本文が JSON オブジェクトでない応答
+UNKNOWN = [
+    {"url": "http://x/api/ads", "body": {"slot": "top", "items": [{"id": 1}, {"id": 2}], "meta": {"version": 3}}},
+    {"url": "http://x/api/ping", "body": None},
+    {"url": "http://x/api/text", "body": "ok"},
+    {"url": "http://x/api/list", "body": [1, "two", None]},
+]
+# 一部の項目だけ、しかも型の合わない値を含む応答
+PARTIAL = [
+    {
+        "url": "http://x/api/stock",
+        "body": {
+            "data": {
+                "stock_name": "極洋（JSON）",
+                "market": 1,
+                "Themes": [{"name": "冷凍食品"}, {"id": 7}, "他"],
+                "industry": {"code": 12},
+            }
+        },
+    }
+]
+
+
+def test_unknown_payloads_are_ignored():
+    assert fields_from_payloads(UNKNOWN) == {}
+    assert not payload_fields_complete(UNKNOWN)
+    snap = dict(copy.deepcopy(SNAP), json=UNKNOWN)
+    assert fields_from_snapshot(snap) == DOM
+
+
+def test_partial_payloads_fall_back_to_dom():
+    assert fields_from_payloads(PARTIAL) == {"company_name": "極洋（JSON）", "themes": "冷凍食品"}
+    assert payload_fields_complete(PARTIAL, ["company_name", "themes"])
+    assert not payload_fields_complete(PARTIAL, ["company_name", "market"])
+    got = fields_from_snapshot(dict(copy.deepcopy(SNAP), json=UNKNOWN + PARTIAL))
+    # JSON で取れた項目だけ上書きし、型の合わない market・dict の industry は DOM の値のまま
+    assert got == dict(DOM, company_name="極洋（JSON）", themes="冷凍食品")
+    assert got["market"] == "東証プライム" and got["industries"] == "水産,食品"
+    # 抽出しない項目は JSON にあっても足さない
+    assert fields_from_snapshot(dict(copy.deepcopy(SNAP), json=PARTIAL), fields=["market"]) == {"market": "東証プライム"}
+
+
+def test_empty_json_values_do_not_override_dom():
+    payloads = [{"url": "http://x/api", "body": {"companyName": "", "themes": []}}]
+    assert fields_from_snapshot(dict(copy.deepcopy(SNAP), json=payloads)) == DOM
+
+
+class Resp:
+    def __init__(self, url, body, resource_type="xhr", status=200, content_type="application/json"):
+        self.url = url
+        self.status = status
+        self.headers = {"content-type": content_type}
+        self.request = argparse.Namespace(resource_type=resource_type)
+        self.body = body
+
+    def json(self):
+        if isinstance(self.body, Exception):
+            raise self.body
+        return self.body
+
+
+def test_capture_filters_responses_and_skips_bad_bodies():
+    capture = JsonCapture(["x"])
+    for resp in [
+        Resp("http://x/api/stock", PARTIAL[0]["body"]),
+        Resp("http://x/app.js", {}, resource_type="script"),
+        Resp("http://x/api/err", {}, status=500),
+        Resp("http://x/page", {}, content_type="text/html"),
+        Resp("http://ads.example/api", {"companyName": "広告"}),
+        Resp("http://x/api/broken", ValueError("not json")),
+    ]:
+        capture.on_response(resp)
+    # 壊れた本文は捨て、読めた応答だけを残す
+    run_steps(capture.drain_steps())
+    assert capture.payloads == [{"url": "http://x/api/stock", "body": PARTIAL[0]["body"]}]
+    assert capture.pending == []
+
+
+def test_reextract_uses_stored_json_only_with_capture_json(tmp_path):
+    path = tmp_path / "snap.json.gz"
+    with gzip.open(path, "wb") as f:
+        f.write(json.dumps(dict(SNAP, json=PARTIAL), ensure_ascii=False).encode("utf-8"))
+    assert _reextract_one(("1301", str(path), 3, False)) == (dict(DOM, code="1301"), "")
+    assert _reextract_one(("1301", str(path), 3, True)) == (
+        dict(DOM, code="1301", company_name="極洋（JSON）", themes="冷凍食品"),
+        "",
+    )
@@ -0,0 +1,156 @@
+"""ExtractPlan（--fields からの抽出計画）と、部品を絞ったスナップショットからの組み立て"""
+
+import argparse
+import copy
+
+import pytest
+
+from scrape import (
+    CONTENT_FIELDS,
+    ExtractPlan,
+    dom_snapshot,
+    extract_plan,
+    extract_planned,
+    fields_from_snapshot,
+    snapshot_args,
+)
+
+
+def labels(**kw):
+    out = {k: {"text": "", "items": []} for k in ("feature", "business", "comparison", "industries", "themes")}
+    out.update(kw)
+    return out
+
+
+# SNAPSHOT_JS の全部品の結果（座標は items の2番目と stop_top）
+FULL = {
+    "h1": ["", "極洋", "", "", ""],
+    "body": "極洋\n東証プライム\n特色 水産大手\n所属業界 水産 食品 寿司 比較会社 ニッスイ\n市場テーマ 寿司 冷凍食品",
+    "dl": [
+        {"dt": "所属業界", "text": "水産 食品 寿司 比較会社 ニッスイ", "items": [["水産", 10], ["食品", 11], ["寿司", 12], ["ニッスイ", 14]], "stop_top": 13},
+        {"dt": "比較会社", "text": "ニッスイ マルハニチロ", "items": [["ニッスイ", 20], ["マルハニチロ", 21]], "stop_top": None},
+        {"dt": "市場テーマ", "text": "寿司 冷凍食品", "items": [["寿司", 30], ["冷凍食品", 31]], "stop_top": None},
+    ],
+    "th": [],
+    "labels": labels(
+        feature={"text": "水産大手", "items": []},
+        business={"text": "水産55(3)、食品45(2) セグメント収益", "items": []},
+        comparison={"text": "ニッスイ マルハニチロ", "items": ["ニッスイ", "マルハニチロ"]},
+        industries={"text": "水産 食品 寿司", "items": ["水産", "食品", "寿司"]},
+        themes={"text": "寿司 冷凍食品", "items": ["寿司", "冷凍食品"]},
+    ),
+}
+# 比較会社・市場テーマの dt が無いページ（ラベル探索と本文の「市場テーマ」行にフォールバックする）
+NO_DL = copy.deepcopy(FULL)
+NO_DL["dl"] = [FULL["dl"][0]]
+NO_DL["labels"]["themes"] = {"text": "", "items": []}
+
+
+class FakePage:
+    """page.evaluate(SNAPSHOT_JS, arg) を、全部品のスナップショットを arg で絞る形で模す"""
+
+    def __init__(self, full):
+        self.full = full
+        self.calls = []
+
+    def evaluate(self, js, arg):
+        self.calls.append(arg)
+        if "parts" not in arg:
+            return copy.deepcopy(self.full)
+        out = {}
+        for p in ("h1", "body", "th"):
+            if p in arg["parts"]:
+                out[p] = self.full[p]
+        if "dl" in arg["parts"]:
+            out["dl"] = [e for e in self.full["dl"] if e["dt"] in arg["dts"]]
+        if arg["groups"]:
+            out["labels"] = {k: self.full["labels"][k] for k in arg["groups"]}
+        return copy.deepcopy(out)
+
+    def locator(self, sel):
+        raise RuntimeError("no modal")
+
+
+def test_plan_closes_over_dependencies():
+    plan = ExtractPlan(["industries"])
+    assert plan.fields == {"industries", "comparison", "themes"}
+    # ラベル探索が要らなければ、フォールバック用のラベルも最初の evaluate には含めない
+    assert plan.parts == ["dl:市場テーマ", "dl:所属業界", "dl:比較会社"]
+
+
+def test_plan_adds_fallback_labels_when_a_label_part_is_collected():
+    plan = ExtractPlan(["feature", "themes"])
+    assert plan.fields == {"feature", "themes", "comparison"}
+    assert plan.parts == ["dl:市場テーマ", "dl:比較会社", "label:comparison", "label:feature", "label:themes"]
+
+
+def test_plan_for_code_only_is_empty():
+    plan = ExtractPlan(["code", "unknown"])
+    assert plan.fields == {"code"}
+    assert plan.parts == []
+
+
+def test_extract_plan_from_args():
+    args = argparse.Namespace(snapshot_dir="", fields="code,market", post=[])
+    assert extract_plan(args).fields == {"code", "market"}
+    # --post business は business_composition を使う
+    args.post = ["business"]
+    assert extract_plan(args).fields == {"code", "market", "business_composition"}
+    # 保存用には全部品を集める
+    args.snapshot_dir = "snapshots"
+    assert extract_plan(args) is None
+    assert extract_plan(argparse.Namespace(snapshot_dir="", fields="", post=[])).fields == set(CONTENT_FIELDS) | {"comparison"}
+
+
+def test_snapshot_args():
+    assert "parts" not in snapshot_args()
+    arg = snapshot_args(["h1", "dl:所属業界", "dl:比較会社", "label:feature"])
+    assert arg["parts"] == ["h1", "dl"]
+    assert arg["dts"] == ["所属業界", "比較会社"]
+    assert list(arg["groups"]) == ["feature"]
+
+
+@pytest.mark.parametrize("full", [FULL, NO_DL], ids=["dl", "fallback"])
+@pytest.mark.parametrize(
+    "fields",
+    [
+        CONTENT_FIELDS,
+        ["company_name"],
+        ["market"],
+        ["feature"],
+        ["business_composition"],
+        ["industries"],
+        ["themes"],
+        ["industries", "market"],
+    ],
+)
+def test_planned_extraction_matches_full_extraction(full, fields):
+    expected = fields_from_snapshot(copy.deepcopy(full), max_industries=3)
+    plan = ExtractPlan(fields)
+    page = FakePage(full)
+    timings = {}
+    snap = dom_snapshot(page, timings, plan.parts)
+    got = extract_planned(page, snap, plan, 3, timings)
+    assert {f: got[f] for f in fields} == {f: expected[f] for f in fields}
+    assert "extract" in timings
+
+
+def test_evaluate_count():
+    # 比較会社の dl があれば1回、無ければ足りない部品だけもう1回
+    plan = ExtractPlan(["industries"])
+    page = FakePage(FULL)
+    extract_planned(page, dom_snapshot(page, {}, plan.parts), plan, 3, {})
+    assert len(page.calls) == 1
+
+    page = FakePage(NO_DL)
+    got = extract_planned(page, dom_snapshot(page, {}, plan.parts), plan, 3, {})
+    # 所属業界は dl で取れるので、比較会社・市場テーマのラベル探索と本文（「市場テーマ」行）だけを1回で集める
+    assert len(page.calls) == 2
+    assert page.calls[1]["parts"] == ["body"]
+    assert set(page.calls[1]["groups"]) == {"comparison", "themes"}
+    assert got["themes"] == "寿司,冷凍食品"
+
+    page = FakePage(FULL)
+    plan = ExtractPlan(["code"])
+    assert dom_snapshot(page, {}, plan.parts) == {"parts": []}
+    assert page.calls == []
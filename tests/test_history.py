@@ -0,0 +1,139 @@
+"""history.py: スナップショットの取り込みと diff（テーマの追加・削除、_status、同じ日付の再取り込み）"""
+
+import csv
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+from history import STATUS_FIELD, HistoryStore, list_delta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIELDS = ["code", "company_name", "market", "themes"]
+
+
+def write_snapshot(dirpath, name, rows, fieldnames=FIELDS):
+    path = dirpath / name
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        w.writeheader()
+        w.writerows(rows)
+    return str(path)
+
+
+@pytest.fixture
+def snapshots(tmp_path):
+    return [
+        write_snapshot(tmp_path, "20250901_result.csv", [
+            {"code": "1301", "company_name": "極洋", "market": "東証プライム", "themes": "水産,寿司"},
+            {"code": "1332", "company_name": "ニッスイ", "market": "東証プライム", "themes": "水産"},
+        ]),
+        # 1301 はテーマが1つ増えて1つ減る。1332 は消え、1333 が新たに現れる
+        write_snapshot(tmp_path, "20250908_result.csv", [
+            {"code": "1301", "company_name": "極洋", "market": "東証プライム", "themes": "水産,冷凍食品"},
+            {"code": "1333", "company_name": "マルハニチロ", "market": "東証プライム", "themes": "水産"},
+        ]),
+        # 1332 が戻る（値は前回と同じ）
+        write_snapshot(tmp_path, "20250915_result.csv", [
+            {"code": "1301", "company_name": "極洋", "market": "東証スタンダード", "themes": "水産,冷凍食品"},
+            {"code": "1332", "company_name": "ニッスイ", "market": "東証プライム", "themes": "水産"},
+            {"code": "1333", "company_name": "マルハニチロ", "market": "東証プライム", "themes": "水産"},
+        ]),
+    ]
+
+
+@pytest.fixture
+def store(tmp_path, snapshots):
+    s = HistoryStore(str(tmp_path / "history.db"))
+    for path, date in zip(snapshots, ["20250901", "20250908", "20250915"]):
+        s.ingest(path, date)
+    yield s
+    s.close()
+
+
+def test_ingest_counts_only_changes(tmp_path, snapshots):
+    s = HistoryStore(str(tmp_path / "h.db"))
+    # 初回は全項目 + _status
+    assert s.ingest(snapshots[0], "20250901") == (2, 8)
+    # 1301 themes、1333 の全項目 + listed、1332 の removed
+    assert s.ingest(snapshots[1], "20250908") == (2, 1 + 4 + 1)
+    assert [d[0] for d in s.dates()] == ["20250901", "20250908"]
+    assert s.kind() == "result"
+    s.close()
+
+
+def test_diff_rows(store):
+    assert store.diff("20250901", "20250908") == [
+        ("1301", "themes", "水産,寿司", "水産,冷凍食品"),
+        ("1332", STATUS_FIELD, "listed", "removed"),
+        ("1333", STATUS_FIELD, "", "listed"),
+        ("1333", "company_name", "", "マルハニチロ"),
+        ("1333", "market", "", "東証プライム"),
+        ("1333", "themes", "", "水産"),
+    ]
+    # 消えて戻った銘柄は、両端の日付で値が同じなら差分に出ない
+    assert store.diff("20250901", "20250915", fields=["market", STATUS_FIELD]) == [
+        ("1301", "market", "東証プライム", "東証スタンダード"),
+        ("1333", STATUS_FIELD, "", "listed"),
+        ("1333", "market", "", "東証プライム"),
+    ]
+    assert store.diff("20250908", "20250915", fields=[STATUS_FIELD]) == [("1332", STATUS_FIELD, "removed", "listed")]
+    # 日付の順序は問わない
+    assert store.diff("20250908", "20250901") == store.diff("20250901", "20250908")
+    assert list_delta("水産,寿司", "水産,冷凍食品") == ("冷凍食品", "寿司")
+
+
+def test_state_and_history(store):
+    assert store.state_at("1332", "20250908")[STATUS_FIELD] == "removed"
+    assert store.state_at("1332", "20250915") == {
+        STATUS_FIELD: "listed", "company_name": "ニッスイ", "market": "東証プライム", "themes": "水産",
+    }
+    assert [(d, f) for d, f, _ in store.history("1301", ["themes", "market"])] == [
+        ("20250901", "market"), ("20250901", "themes"), ("20250908", "themes"), ("20250915", "market"),
+    ]
+
+
+def test_same_date_reingest_is_rejected(store, snapshots):
+    with pytest.raises(ValueError, match="not newer"):
+        store.ingest(snapshots[2], "20250915")
+    with pytest.raises(ValueError, match="not newer"):
+        store.ingest(snapshots[0], "20250901")
+    assert len(store.dates()) == 3
+
+
+def test_partial_does_not_mark_removed(tmp_path, snapshots):
+    s = HistoryStore(str(tmp_path / "h.db"))
+    s.ingest(snapshots[0], "20250901")
+    s.ingest(snapshots[1], "20250908", partial=True)
+    assert s.state_at("1332", "20250908")[STATUS_FIELD] == "listed"
+    s.close()
+
+
+def test_summary_snapshot_is_rejected_in_result_history(tmp_path, store):
+    summary = write_snapshot(tmp_path, "20250922_summary.csv", [{"code": "1301", "overseas": "11"}], ["code", "overseas"])
+    with pytest.raises(ValueError, match="summary table but result snapshots"):
+        store.ingest(summary, "20250922")
+
+
+def run_cli(*argv):
+    return subprocess.run([sys.executable, "history.py", *argv], capture_output=True, text=True, cwd=ROOT)
+
+
+def test_cli_ingest_and_diff(tmp_path, snapshots):
+    db = str(tmp_path / "cli.db")
+    proc = run_cli("--db", db, "ingest", str(tmp_path / "*_result.csv"))
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stderr.count("[DONE]") == 3
+    # 同じ日付は --skip-ingested なら飛ばし、無ければエラー
+    assert run_cli("--db", db, "ingest", snapshots[2]).returncode == 1
+    proc = run_cli("--db", db, "ingest", "--skip-ingested", snapshots[2])
+    assert proc.returncode == 0 and "[INFO] skip" in proc.stderr
+    proc = run_cli("--db", db, "diff", "20250901", "20250908", "--fields", "themes")
+    assert proc.returncode == 0, proc.stderr
+    rows = list(csv.DictReader(io.StringIO(proc.stdout)))
+    assert rows == [
+        {"code": "1301", "field": "themes", "old": "水産,寿司", "new": "水産,冷凍食品", "added": "冷凍食品", "removed": "寿司"},
+        {"code": "1333", "field": "themes", "old": "", "new": "水産", "added": "水産", "removed": ""},
+    ]
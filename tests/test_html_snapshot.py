@@ -0,0 +1,122 @@
+"""HtmlTree / snapshot_from_html（--http-first）が SNAPSHOT_JS と同じ形・同じ値のスナップショットを作ること"""
+
+import re
+
+from bench_server import render_page
+from scrape import HtmlTree, fields_from_snapshot, snapshot_from_html
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>極洋【1301】</title>
+<script>var label = "所属業界";</script>
+<script type="application/json" id="__NEXT_DATA__">{"props": {"code": "1301"}}</script>
+<style>dt { color: red }</style>
+</head>
+<body><header><h1>極洋</h1></header>
+<main>
+<p>東証プライム
+<dl>
+  <dt>特色<dd>水産大手。
+  <dt>連結事業<dd>水産55(3)、食品45(2) <span>セグメント収益</span>
+  <dt>所属業界<dd><a href="/i/1">水産</a><a href="/i/2">食品</a><div>比較会社</div><a href="/s/1332">ニッスイ</a>
+  <dt>市場テーマ<dd><ul><li>寿司<li>冷凍食品</ul>
+</dl>
+<div><strong>比較会社</strong><span><a>マルハニチロ</a></span></div>
+</main></body></html>
+"""
+
+# PAGE に SNAPSHOT_JS を実行したときの値（座標は除き、比較会社より前の items を別に持つ）
+EXPECTED_DL = [
+    ("特色", "水産大手。", [], []),
+    ("連結事業", "水産55(3)、食品45(2) セグメント収益", ["セグメント収益"], ["セグメント収益"]),
+    ("所属業界", "水産食品 比較会社 ニッスイ", ["水産", "食品", "ニッスイ"], ["水産", "食品"]),
+    ("市場テーマ", "寿司 冷凍食品", ["寿司", "冷凍食品"], ["寿司", "冷凍食品"]),
+]
+EXPECTED_LABELS = {
+    "feature": {"text": "水産大手。", "items": []},
+    "business": {"text": "水産55(3)、食品45(2) セグメント収益", "items": []},
+    # 文書順で最初に「比較会社」で始まる候補は dd 内の div（次の兄弟要素は a）
+    "comparison": {"text": "ニッスイ", "items": []},
+    "industries": {"text": "水産食品 比較会社 ニッスイ", "items": ["水産", "食品", "ニッスイ"]},
+    "themes": {"text": "寿司 冷凍食品", "items": []},
+}
+
+
+def dl_without_positions(snap):
+    out = []
+    for e in snap["dl"]:
+        texts = [t for t, _ in e["items"]]
+        before = [t for t, top in e["items"] if e["stop_top"] is None or top < e["stop_top"]]
+        out.append((e["dt"], e["text"], texts, before))
+    return out
+
+
+def test_snapshot_matches_snapshot_js_output():
+    snap = snapshot_from_html(PAGE)
+    assert set(snap) >= {"h1", "body", "dl", "th", "labels"}
+    assert [t for t in snap["h1"] if t][0] == "極洋"
+    assert dl_without_positions(snap) == EXPECTED_DL
+    assert snap["labels"] == EXPECTED_LABELS
+    # innerText と同じく script/style/head の中身は本文に含めない
+    body = re.sub(r"\s+", " ", snap["body"])
+    assert "東証プライム" in body and "市場テーマ 寿司 冷凍食品" in body
+    assert "var label" not in body and "color" not in body and "【1301】" not in body
+
+
+def test_fields_from_html_snapshot():
+    fields = fields_from_snapshot(snapshot_from_html(PAGE), max_industries=3)
+    assert fields == {
+        "company_name": "極洋",
+        "market": "東証プライム",
+        "feature": "水産大手。",
+        "business_composition": "水産55(3)、食品45(2)",
+        "industries": "水産,食品",
+        "themes": "寿司,冷凍食品",
+    }
+
+
+def test_embedded_json_payloads():
+    snap = snapshot_from_html(PAGE)
+    assert snap["json"] == [{"url": "inline", "body": {"props": {"code": "1301"}}}]
+    assert "json" not in snapshot_from_html("<html><body><h1>x</h1></body></html>")
+
+
+def test_implied_end_tags():
+    tree = HtmlTree()
+    tree.feed("<ul><li>a<li>b</ul><p>x<p>y<dl><dt>k<dd>v<dt>k2<dd>v2</dl>")
+    tree.close()
+    by_tag = {}
+    for n in tree.root.descendants():
+        by_tag.setdefault(n.tag, []).append(n)
+    assert [tree.text(n) for n in by_tag["li"]] == ["a", "b"]
+    assert [n.parent.tag for n in by_tag["dd"]] == ["dl", "dl"]
+    assert by_tag["dt"][1].next_element() is by_tag["dd"][1]
+    assert len(by_tag["p"]) == 2 and by_tag["p"][0].elements() == []
+    # dl はブラウザと同じく開いている p を閉じる
+    assert by_tag["dl"][0].parent is tree.root and tree.text(by_tag["p"][1]) == "y"
+
+
+def test_bench_pages_round_trip():
+    rows = [
+        {
+            "code": "1301",
+            "company_name": "極洋",
+            "market": "東証プライム",
+            "feature": "水産品の貿易、加工、買い付け主力。すしネタに強み",
+            "business_composition": "水産55(3)、生鮮22(5)、食品22(3)【海外】11 <25.3>",
+            "industries": "漁業,関東",
+            "themes": "水産",
+        },
+        {
+            "code": "1431",
+            "company_name": "Ｌｉｂ Ｗｏｒｋ",
+            "market": "東証グロース",
+            "feature": "熊本地盤の注文住宅会社",
+            "business_composition": "住宅100(5)",
+            "industries": "戸建て,九州沖縄",
+            "themes": "注文住宅,ＺＥＨ",
+        },
+    ]
+    for row in rows:
+        html = render_page(row["code"], row, ["ニッスイ", "マルハニチロ"])
+        fields = fields_from_snapshot(snapshot_from_html(html), max_industries=3)
+        assert {k: fields[k] for k in fields} == {k: row[k] for k in fields}
@@ -0,0 +1,123 @@
+"""TokenBucket / AdaptiveRate（--adaptive）と make_limiter の選択"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+import pytest
+
+import scrape
+from scrape import AdaptiveRate, TokenBucket, make_limiter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(scrape.time, "monotonic", c)
+    return c
+
+
+def limiter_args(**kw):
+    base = dict(
+        max_rate=0.0, sleep=1.0, adaptive=False, rate_min=0.05, rate_max=5.0, rate_step=0.02, rate_backoff=0.5
+    )
+    base.update(kw)
+    return argparse.Namespace(**base)
+
+
+def test_initial_rate_is_clamped():
+    assert AdaptiveRate(10.0, 0.1, 2.0).rate == 2.0
+    assert AdaptiveRate(0.0, 0.5, 2.0).rate == 0.5
+
+
+def test_additive_increase_stops_at_max(clock):
+    r = AdaptiveRate(1.0, 0.1, 1.1, step=0.04)
+    for _ in range(10):
+        r.observe(0.1)
+    assert r.rate == pytest.approx(1.1)
+
+
+def test_error_backoff_is_bounded_by_min(clock):
+    r = AdaptiveRate(1.0, 0.3, 2.0, backoff=0.5)
+    r.observe(None, error=True)
+    assert r.rate == pytest.approx(0.5)
+    clock.now += 100
+    r.observe(None, error=True)
+    assert r.rate == pytest.approx(0.3)
+
+
+def test_decrease_cooldown(clock):
+    r = AdaptiveRate(1.0, 0.01, 2.0, backoff=0.5)
+    r.observe(None, error=True)
+    r.observe(None, error=True)
+    assert r.rate == pytest.approx(0.5)
+    # 次の減速は現在の間隔の2倍（0.5 req/s なら4秒）経ってから
+    clock.now += 3.9
+    r.observe(None, error=True)
+    assert r.rate == pytest.approx(0.5)
+    clock.now += 0.2
+    r.observe(None, error=True)
+    assert r.rate == pytest.approx(0.25)
+
+
+def test_no_increase_until_error_rate_decays(clock):
+    r = AdaptiveRate(1.0, 0.01, 5.0, step=0.1, backoff=0.5)
+    r.observe(None, error=True)
+    # error_ewma: 0.2 -> 0.16 -> 0.128 -> 0.1024 -> 0.08192（ここで加算が再開）
+    for _ in range(3):
+        r.observe(0.1)
+    assert r.rate == pytest.approx(0.5)
+    r.observe(0.1)
+    assert r.rate == pytest.approx(0.6)
+
+
+def test_latency_spike_decreases(clock):
+    r = AdaptiveRate(1.0, 0.01, 1.0, step=0.1, backoff=0.5, spike=2.0)
+    for _ in range(6):
+        r.observe(0.1)
+    assert r.rate == pytest.approx(1.0)
+    r.observe(0.5)
+    assert r.rate == pytest.approx(0.5)
+
+
+def test_zero_floor_does_not_divide_by_zero(clock):
+    # main() は --rate-min 0 を拒否するが、AdaptiveRate 単体でも 0 req/s で落ちない
+    r = AdaptiveRate(0.0, 0.0, 2.0, backoff=0.5)
+    r.observe(None, error=True)
+    clock.now += 1.0
+    r.observe(None, error=True)
+    assert r.rate == 0.0
+
+
+@pytest.mark.parametrize("argv", [["--rate-min", "0"], ["--rate-min", "3", "--rate-max", "2"]])
+def test_main_rejects_bad_rate_bounds(argv):
+    proc = subprocess.run(
+        [sys.executable, "scrape.py", "--adaptive", *argv], capture_output=True, text=True, cwd=ROOT
+    )
+    assert proc.returncode == 2
+    assert "--rate-min must be > 0 and <= --rate-max" in proc.stderr
+
+
+def test_unlimited_bucket_does_not_wait():
+    TokenBucket(0.0).acquire()
+
+
+def test_make_limiter():
+    assert make_limiter(limiter_args(), 1) is None
+    fixed = make_limiter(limiter_args(sleep=2.0), 4)
+    assert type(fixed) is TokenBucket and fixed.rate == pytest.approx(0.5)
+    serial = make_limiter(limiter_args(max_rate=3.0), 1)
+    assert type(serial) is TokenBucket and serial.rate == pytest.approx(3.0)
+    adaptive = make_limiter(limiter_args(adaptive=True, max_rate=10.0), 1)
+    assert isinstance(adaptive, AdaptiveRate) and adaptive.rate == pytest.approx(5.0)
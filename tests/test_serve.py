@@ -0,0 +1,149 @@
+"""--serve / --connect: 抽出する項目は要求ごとにクライアントの指定で決まり、食い違いは黙って通さない"""
+
+import argparse
+import json
+import socket
+import threading
+
+import pytest
+
+import scrape
+from scrape import CONTENT_FIELDS, FetchOptions, ScrapeServer, extract_plan, run_remote, serve_request_args
+
+
+def make_args(**kw):
+    args = argparse.Namespace(
+        fields="", post=[], snapshot_dir="", connect="", verbose=False,
+        allow_hosts="", capture_json=False, http_require="", max_industries=3,
+    )
+    for k, v in kw.items():
+        setattr(args, k, v)
+    return args
+
+
+class FakeSink:
+    def __init__(self, total):
+        self.total = total
+        self.rows = {}
+        self.failures = {}
+
+    def claim(self, code):
+        return True
+
+    def success(self, code, record, phases=None):
+        self.rows[code] = record
+
+    def failure(self, code, reason, phases=None):
+        self.failures[code] = reason
+
+    def progress(self, done):
+        pass
+
+
+def serve_once(server):
+    """1接続だけ ScrapeServer._handle で処理するスレッドを立て、アドレスを返す"""
+    srv = socket.create_server(("127.0.0.1", 0))
+
+    def run():
+        conn, _ = srv.accept()
+        with conn:
+            server._handle(conn)
+        srv.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return "%d" % srv.getsockname()[1]
+
+
+class PlanServer(ScrapeServer):
+    """ページを開かず、要求から作った抽出計画の項目だけを持つ行を返す"""
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.plans = []
+
+    def _fetch(self, code, args, opts):
+        plan = opts.plan
+        self.plans.append(None if plan is None else sorted(plan.fields))
+        self.served += 1
+        fields = CONTENT_FIELDS if plan is None else [f for f in CONTENT_FIELDS if f in plan.fields]
+        return {"code": code, "record": {"code": code, **{f: f"{f}-{code}" for f in fields}}, "phases": {}}
+
+
+def server_args():
+    return make_args(fields="company_name", post=[], max_rate=0, adaptive=False, sleep=0)
+
+
+def test_request_args_override_server_fields():
+    base = server_args()
+    args = serve_request_args(base, {"codes": ["1301"], "fields": "code,market", "post": ["business"], "snapshot": True})
+    assert (args.fields, args.post, args.snapshot_dir) == ("code,market", ["business"], "client")
+    assert base.fields == "company_name" and base.snapshot_dir == ""
+    assert extract_plan(args) is None
+    args.snapshot_dir = ""
+    assert extract_plan(args).fields == {"code", "market", "business_composition"}
+
+
+@pytest.mark.parametrize(
+    "req, message",
+    [
+        ({"codes": ["1301"]}, "client and server versions differ"),
+        ({"codes": ["1301"], "fields": "code", "post": "business"}, "client and server versions differ"),
+        ({"codes": ["1301"], "fields": "code,sector", "post": []}, "unknown field"),
+    ],
+)
+def test_request_args_reject_mismatches(req, message):
+    with pytest.raises(ValueError, match=message):
+        serve_request_args(server_args(), req)
+
+
+def test_remote_uses_client_fields_and_post():
+    server = PlanServer(server_args())
+    args = make_args(fields="code,market,typo", post=["business"])
+    args.connect = serve_once(server)
+    sink = FakeSink(2)
+    run_remote([(1, "1301"), (2, "1332")], args, sink, FetchOptions(args))
+    assert server.plans == [["business_composition", "code", "market"]] * 2
+    assert sink.failures == {}
+    assert sink.rows["1301"] == {"code": "1301", "market": "market-1301", "business_composition": "business_composition-1301"}
+
+
+def test_remote_fails_loudly_when_server_ignores_fields():
+    class OldServer(PlanServer):
+        def _fetch(self, code, args, opts):
+            # 要求の fields を無視してサーバー起動時の項目で取得する
+            return super()._fetch(code, self.args, FetchOptions(self.args))
+
+    args = make_args(fields="code,market")
+    args.connect = serve_once(OldServer(server_args()))
+    sink = FakeSink(2)
+    run_remote([(1, "1301"), (2, "1332")], args, sink, FetchOptions(args))
+    assert sink.rows == {}
+    assert set(sink.failures) == {"1301", "1332"}
+    assert "fields mismatch" in sink.failures["1301"]
+
+
+def test_server_answers_bad_request_and_keeps_connection():
+    server = PlanServer(server_args())
+    port = serve_once(server)
+    with socket.create_connection(("127.0.0.1", int(port))) as conn:
+        rf, wf = conn.makefile("rb"), conn.makefile("wb")
+        wf.write(b'{"codes": ["1301"]}\n{"codes": ["1301"], "fields": "code,feature", "post": []}\n')
+        wf.flush()
+        lines = [json.loads(rf.readline()) for _ in range(3)]
+    assert set(lines[0]) == {"error"} and "bad request" in lines[0]["error"]
+    assert lines[1]["record"] == {"code": "1301", "feature": "feature-1301"}
+    assert lines[2] == {"done": True, "served": 1}
+
+
+def test_remote_reports_rejected_request(monkeypatch):
+    def reject(base, req):
+        raise ValueError("unknown field(s): sector")
+
+    monkeypatch.setattr(scrape, "serve_request_args", reject)
+    server = PlanServer(server_args())
+    args = make_args(fields="code")
+    args.connect = serve_once(server)
+    sink = FakeSink(2)
+    run_remote([(1, "1301"), (2, "1332")], args, sink, FetchOptions(args))
+    assert server.plans == []
+    assert sink.failures == {c: "server rejected request: bad request: unknown field(s): sector" for c in ("1301", "1332")}
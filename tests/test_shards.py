@@ -0,0 +1,78 @@
+"""--shard の分割と --merge の統合"""
+
+import csv
+
+import pytest
+
+from scrape import merge_shards, parse_shard, shard_of
+
+FIELDS = ["code", "company_name", "market", "feature", "business_composition", "industries", "themes"]
+
+
+def write_csv(path, fieldnames, rows):
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        w.writeheader()
+        w.writerows(rows)
+    return str(path)
+
+
+def row(code, **kw):
+    r = {k: "" for k in FIELDS}
+    r.update(code=code, **kw)
+    return r
+
+
+def test_parse_shard():
+    assert parse_shard("1/4") == (1, 4)
+    assert parse_shard(" 0 / 1 ") == (0, 1)
+    for bad in ("4/4", "1/0", "-1/2", "a/b", "1"):
+        with pytest.raises(ValueError):
+            parse_shard(bad)
+
+
+def test_shard_of_is_stable_and_covers_all_shards():
+    codes = [f"{n:04d}" for n in range(1300, 1700)] + ["130A", "135A"]
+    first = [shard_of(c, 4) for c in codes]
+    assert first == [shard_of(c, 4) for c in codes]
+    assert set(first) == {0, 1, 2, 3}
+    # プロセスごとに変わる hash() ではなく sha1 の先頭8桁による（マシン間で同じ分割）
+    assert shard_of("1301", 7) == int("055550da", 16) % 7
+
+
+def test_merge_prefers_fuller_row_then_later_file(tmp_path):
+    a = write_csv(tmp_path / "a.csv", FIELDS, [
+        row("1301", company_name="極洋", market="東証プライム"),
+        row("1332", company_name="ニッスイ"),
+        row("1333", company_name="旧"),
+    ])
+    b = write_csv(tmp_path / "b.csv", FIELDS, [
+        row("1301", company_name="極洋"),
+        row("1332", company_name="日本水産", market="東証プライム"),
+        row("1333", company_name="新"),
+    ])
+    _, rows, _ = merge_shards([a, b], [], ["1301", "1332", "1333"])
+    by_code = {r["code"]: r for r in rows}
+    assert by_code["1301"]["market"] == "東証プライム"
+    assert by_code["1332"]["company_name"] == "日本水産"
+    # 空欄の数が同じなら後に指定したファイルの行
+    assert by_code["1333"]["company_name"] == "新"
+
+
+def test_merge_order_and_failures(tmp_path):
+    a = write_csv(tmp_path / "a.csv", FIELDS, [row("9999", company_name="x"), row("1332", company_name="y")])
+    b = write_csv(tmp_path / "b.csv", ["code", "company_name", "extra"], [{"code": "1301", "company_name": "z"}])
+    fa = write_csv(tmp_path / "fa.csv", ["code", "reason"], [
+        {"code": "1332", "reason": "timeout"},
+        {"code": "1380", "reason": "HTTP 404 for code 1380"},
+        {"code": "1379", "reason": "timeout"},
+    ])
+    fieldnames, rows, failures = merge_shards([a, b], [fa], ["1301", "1332", "1379", "1380"])
+    assert fieldnames == FIELDS + ["extra"]
+    # codelist の順、codelist に無いコードは末尾
+    assert [r["code"] for r in rows] == ["1301", "1332", "9999"]
+    # 結果がある銘柄は失敗から除く
+    assert failures == [
+        {"code": "1379", "reason": "timeout"},
+        {"code": "1380", "reason": "HTTP 404 for code 1380"},
+    ]
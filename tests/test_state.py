@@ -0,0 +1,149 @@
+"""NegativeCache（有効期限）、RefreshState（前回の行の引き継ぎ）、StateDB（claim とリース切れの引き取り）"""
+
+import json
+
+import pytest
+
+import scrape
+from scrape import NO_CONTENT, NegativeCache, RefreshState, StateDB
+
+DAY = 86400.0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0 * DAY
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(scrape.time, "time", c)
+    return c
+
+
+ROW = {"code": "1301", "company_name": "極洋", "market": "東証プライム", "feature": "水産大手", "industries": "水産", "themes": "寿司"}
+
+
+def test_negative_cache_ttl(tmp_path, clock):
+    path = str(tmp_path / "negative.json")
+    cache = NegativeCache(path, 7, ["feature", "industries"])
+    cache.on_failure("1301", "HTTP 404 for code 1301")
+    # 一時的な失敗は記録しない
+    cache.on_failure("1332", "timeout")
+    cache.on_failure("1333", "HTTP 503 for code 1333")
+    cache.on_success("1334", {"code": "1334", "feature": "", "industries": ""})
+    assert cache.added == ["1301", "1334"]
+    assert cache.lookup("1301", clock.now)["reason"] == "HTTP 404"
+    assert cache.lookup("1334", clock.now)["reason"] == NO_CONTENT
+    assert cache.lookup("1332", clock.now) is None
+    assert cache.lookup("1301", clock.now + 7 * DAY - 1) is not None
+    assert cache.lookup("1301", clock.now + 7 * DAY) is None
+
+    # 有効日数は記録時の値を使う（--negative-ttl を変えても既存のエントリには効かない）
+    cache.save()
+    clock.now += 3 * DAY
+    again = NegativeCache(path, 1, ["feature", "industries"])
+    assert again.lookup("1301", clock.now) is not None
+    again.on_failure("1333", "HTTP 410 for code 1333")
+    # 期限切れで取り直して内容があれば削除
+    clock.now += 5 * DAY
+    assert again.lookup("1301", clock.now) is None
+    again.on_success("1301", ROW)
+    assert again.cleared == ["1301"]
+    # 取り直されなかった期限切れのエントリは保存時に捨てる
+    again.save()
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == {}
+
+
+def test_negative_cache_without_check_fields(tmp_path, clock):
+    cache = NegativeCache(str(tmp_path / "n.json"), 7, [])
+    cache.on_success("1301", {"code": "1301"})
+    assert cache.entries == {} and cache.added == []
+
+
+def test_refresh_state_reuses_carried_rows(tmp_path, clock):
+    path = str(tmp_path / "refresh.json")
+    state = RefreshState(path)
+    # 状態ファイルに無い銘柄は前回の結果の日付で取得済みとみなす
+    state.seed("1301", ROW, clock.now - 2 * DAY)
+    assert state.is_fresh("1301", ROW, clock.now, 30)
+    # 有効期限は銘柄ごとに 50〜100% に分散するが、期限を過ぎれば必ず取り直す
+    assert not state.is_fresh("1301", ROW, clock.now - 2 * DAY + 30 * DAY, 30)
+    assert state.is_fresh("1301", ROW, clock.now - 2 * DAY + 15 * DAY - 1, 30)
+    assert not state.is_fresh("1301", ROW, clock.now, 0)
+    # 引き継ぐ行が最後に取得した内容と違えば取り直す
+    assert not state.is_fresh("1301", dict(ROW, themes="寿司,冷凍食品"), clock.now, 30)
+    # 空白の違いは同じ内容
+    assert state.is_fresh("1301", dict(ROW, feature=" 水産大手 "), clock.now, 30)
+
+    # 取り直した行で更新すると取得時刻が今になり、内容が変われば changed に入る
+    state.update("1301", ROW)
+    state.update("1332", ROW)
+    state.update("1301", dict(ROW, themes="寿司,冷凍食品"))
+    assert state.changed == ["1301"]
+    assert state.entries["1301"]["fetched"] == clock.now
+    state.save()
+
+    # 既に状態ファイルにある銘柄は seed しても変わらない
+    reloaded = RefreshState(path)
+    reloaded.seed("1301", ROW, clock.now - 100 * DAY)
+    assert reloaded.entries == state.entries
+    assert reloaded.is_fresh("1301", dict(ROW, themes="寿司,冷凍食品"), clock.now + DAY, 30)
+
+
+def test_state_db_claim_and_lease_takeover(tmp_path, clock):
+    path = str(tmp_path / "state.db")
+    a = StateDB(path, lease_sec=600)
+    b = StateDB(path, lease_sec=600)
+    b.owner = "other:1"
+    a.seed(["1301", "1332"])
+    assert a.claim("1301")
+    # 実行中の銘柄は他のプロセスから claim できない
+    assert not b.claim("1301")
+    clock.now += 599
+    assert not b.claim("1301")
+    # リースが切れたら引き取れる（試行回数も増える）
+    clock.now += 2
+    assert b.claim("1301")
+    assert not a.claim("1301")
+    row = b.conn.execute("SELECT owner, attempts, started_at FROM codes WHERE code = '1301'").fetchone()
+    assert row == ("other:1", 2, clock.now)
+
+    clock.now += 5
+    b.finish("1301", "done", row={"code": "1301", "company_name": "極洋"})
+    assert not a.claim("1301")
+    assert a.conn.execute("SELECT elapsed FROM codes WHERE code = '1301'").fetchone() == (5.0,)
+    # 失敗した銘柄は再び claim できる
+    assert a.claim("1332")
+    a.finish("1332", "failed", "timeout")
+    clock.now += 10 * 600
+    assert b.claim("1332")
+    assert a.codes_with_status("running") == {"1332"}
+    a.close()
+    b.close()
+
+
+def test_state_db_seed_and_carry(tmp_path, clock):
+    db = StateDB(str(tmp_path / "state.db"))
+    db.seed(["1332", "1301"])
+    db.seed(["1301", "1333"])
+    db.carry("1333", {"code": "1333"})
+    db.carry("1332", {"code": "1332"})
+    assert db.codes_with_status("done") == {"1332", "1333"}
+    # 引き継いだ行は claim されず、投入順に書き出される
+    assert not db.claim("1333")
+
+    class Writer:
+        rows = []
+
+        def writerow(self, row):
+            self.rows.append(row)
+
+    assert db.export(Writer()) == 2
+    assert Writer.rows == [{"code": "1332"}, {"code": "1333"}]
+    db.close()
@@ -0,0 +1,303 @@
+"""sync/async で共通の取得手順（scrape_one / scrape_with_retries など）を、両方の API の偽ページで進める"""
+
+import argparse
+import asyncio
+import copy
+
+import pytest
+
+import scrape
+from scrape import (
+    ExtractPlan,
+    FetchOptions,
+    LoadStats,
+    NavGate,
+    PAGE_CRASHED,
+    RETRY_LATER,
+    TransientHTTPError,
+    prepare_page,
+    prepare_page_async,
+    run_steps,
+    run_steps_async,
+    scrape_one,
+    scrape_one_async,
+    scrape_with_retries,
+    scrape_with_retries_async,
+)
+
+SNAP = {
+    "h1": ["極洋"],
+    "body": "極洋\n東証プライム",
+    "dl": [
+        {"dt": "所属業界", "text": "水産 食品", "items": [["水産", 10], ["食品", 11]], "stop_top": None},
+        {"dt": "市場テーマ", "text": "寿司", "items": [["寿司", 30]], "stop_top": None},
+    ],
+    "th": [],
+    "labels": {k: {"text": "", "items": []} for k in ("feature", "business", "comparison", "industries", "themes")},
+}
+
+
+class FakeTimeout(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def no_playwright(monkeypatch):
+    # playwright を入れていない環境でも TimeoutError の判定ができるように差し替える
+    monkeypatch.setattr(scrape, "pw_timeout_error", lambda: FakeTimeout)
+
+
+class Resp:
+    def __init__(self, status):
+        self.status = status
+
+
+class SyncPage:
+    """sync API の偽ページ。statuses の順に goto の応答を返し、呼ばれた操作を log に残す"""
+
+    def __init__(self, statuses=(200,), ready=True):
+        self.statuses = list(statuses)
+        self.ready = ready
+        self.log = []
+
+    def goto(self, url, wait_until):
+        self.log.append(("goto", url, wait_until))
+        status = self.statuses.pop(0)
+        if isinstance(status, Exception):
+            raise status
+        return Resp(status)
+
+    def wait_for_selector(self, selector, state, timeout):
+        self.log.append(("wait_for_selector",))
+        if not self.ready:
+            raise FakeTimeout("not ready")
+
+    def wait_for_load_state(self, state):
+        self.log.append(("wait_for_load_state", state))
+
+    def evaluate(self, js, arg):
+        self.log.append(("evaluate", tuple(arg.get("parts") or ())))
+        return copy.deepcopy(SNAP)
+
+    def locator(self, sel):
+        raise RuntimeError("no modal")
+
+    def on(self, event, handler):
+        pass
+
+    def remove_listener(self, event, handler):
+        pass
+
+
+class AsyncPage(SyncPage):
+    """async API の偽ページ（同じ操作をコルーチンで返す）"""
+
+    def goto(self, url, wait_until):
+        return self._later(super().goto, url, wait_until)
+
+    def wait_for_selector(self, selector, state, timeout):
+        return self._later(super().wait_for_selector, selector, state, timeout)
+
+    def wait_for_load_state(self, state):
+        return self._later(super().wait_for_load_state, state)
+
+    def evaluate(self, js, arg):
+        return self._later(super().evaluate, js, arg)
+
+    async def _later(self, fn, *args):
+        await asyncio.sleep(0)
+        return fn(*args)
+
+
+class Session:
+    def __init__(self, page):
+        self.page = page
+        self.http = None
+        self.stats = None
+        self.ensured = 0
+
+    def healthy(self):
+        return True
+
+    def ensure(self):
+        self.ensured += 1
+
+
+class AsyncSession(Session):
+    async def ensure(self):
+        self.ensured += 1
+
+
+def make_args(**kw):
+    args = argparse.Namespace(
+        fields="", post=[], snapshot_dir="", allow_hosts="", capture_json=False, http_require="",
+        max_industries=3, fast_load=False, ready_timeout=100, json_timeout=100,
+        target_url="http://bench/stocks/{code}", load_stats=False, retries=2, retry_base=0.0,
+        retry_factor=2.0, retry_max=0.0, verbose=False, sleep=0.0, jitter_frac=0.0,
+    )
+    for k, v in kw.items():
+        setattr(args, k, v)
+    return args
+
+
+def fetch_sync(page, args, **kw):
+    return scrape_with_retries(Session(page), "1301", args, FetchOptions(args), **kw)
+
+
+def fetch_async(page, args, **kw):
+    return asyncio.run(scrape_with_retries_async(AsyncSession(page), "1301", args, FetchOptions(args), **kw))
+
+
+ENGINES = [(SyncPage, fetch_sync), (AsyncPage, fetch_async)]
+
+
+@pytest.mark.parametrize("fast_load, ready", [(False, True), (True, True), (True, False)])
+def test_scrape_one_is_the_same_in_both_apis(fast_load, ready):
+    plan = ExtractPlan(["industries", "market"])
+    sync_page, async_page = SyncPage(ready=ready), AsyncPage(ready=ready)
+    t_sync, t_async = {}, {}
+    kw = dict(fast_load=fast_load, ready_timeout=100, plan=plan)
+    got = scrape_one(sync_page, "1301", timings=t_sync, **kw)
+    assert asyncio.run(scrape_one_async(async_page, "1301", timings=t_async, **kw)) == got
+    assert got == {"code": "1301", "market": "東証プライム", "industries": "水産,食品", "themes": "寿司"}
+    assert sync_page.log == async_page.log
+    assert set(t_sync) == set(t_async) >= {"goto", "modal", "snapshot", "extract"}
+    if fast_load and not ready:
+        # 準備完了の dt が現れなければ networkidle を待つ
+        assert ("wait_for_load_state", "networkidle") in sync_page.log
+
+
+@pytest.mark.parametrize("page_cls, fetch", ENGINES)
+def test_retry_then_success(page_cls, fetch):
+    page = page_cls([503, FakeTimeout("slow"), 200])
+    phases = {}
+    record, reason = fetch(page, make_args(fields="code,market"), phases=phases)
+    assert (record, reason) == ({"code": "1301", "market": "東証プライム"}, "")
+    assert [e[0] for e in page.log].count("goto") == 3
+    assert phases["attempts"] == 3 and "failed" in phases and "retry_wait" in phases
+
+
+@pytest.mark.parametrize("page_cls, fetch", ENGINES)
+def test_retry_classification(page_cls, fetch):
+    # 404 はリトライしない
+    assert fetch(page_cls([404]), make_args()) == (None, "HTTP 404 for code 1301")
+    # リトライを使い切ったタイムアウトは "timeout"
+    assert fetch(page_cls([FakeTimeout("a"), FakeTimeout("b")]), make_args(retries=1)) == (None, "timeout")
+    # --defer-retries では待たずに遅延キューへ
+    defer = {}
+    assert fetch(page_cls([503]), make_args(), defer=defer) == (None, RETRY_LATER)
+    assert defer == {"wait": 0.0}
+
+
+@pytest.mark.parametrize("session_cls, page_cls", [(Session, SyncPage), (AsyncSession, AsyncPage)])
+def test_crashed_session_is_not_retried(session_cls, page_cls):
+    session = session_cls(page_cls())
+    session.healthy = lambda: False
+    args = make_args()
+    steps = scrape.retry_steps(session, "1301", args, FetchOptions(args))
+    result = run_steps(steps) if session_cls is Session else asyncio.run(run_steps_async(steps))
+    assert result == (None, PAGE_CRASHED)
+
+
+def test_nav_gate_is_released_on_error_and_cancel():
+    async def main():
+        gate = NavGate(make_args(), polite=False)
+        page = AsyncPage([TransientHTTPError("HTTP 503")])
+        with pytest.raises(TransientHTTPError):
+            await scrape_one_async(page, "1301", nav_gate=gate)
+        assert not gate._lock.locked()
+
+        class Hanging(AsyncPage):
+            async def _later(self, fn, *args):
+                await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(scrape_one_async(Hanging(), "1301", nav_gate=gate))
+        await asyncio.sleep(0.01)
+        assert gate._lock.locked()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # キャンセルされても手順の finally でゲートを返す
+        assert not gate._lock.locked()
+
+    asyncio.run(main())
+
+
+class Route:
+    def __init__(self, url, resource_type="document"):
+        self.request = argparse.Namespace(url=url, resource_type=resource_type)
+        self.done = ""
+
+    def abort(self):
+        self.done = "abort"
+
+    def continue_(self):
+        self.done = "continue"
+
+
+class AsyncRoute(Route):
+    async def abort(self):
+        self.done = "abort"
+
+    async def continue_(self):
+        self.done = "continue"
+
+
+class Context:
+    def __init__(self):
+        self.handler = None
+
+    def route(self, pattern, handler):
+        self.handler = handler
+
+    def new_cdp_session(self, page):
+        raise RuntimeError("no cdp")
+
+
+class AsyncContext(Context):
+    async def route(self, pattern, handler):
+        self.handler = handler
+
+    async def new_cdp_session(self, page):
+        raise RuntimeError("no cdp")
+
+
+def test_prepare_page_blocks_in_both_apis():
+    args = make_args(fast_load=True, allow_hosts="bench")
+    ctx = Context()
+    stats = prepare_page(ctx, SyncPage(), args)
+    routes = [Route("http://bench/x"), Route("http://ads.example/x"), Route("http://bench/a.png", "image")]
+    for r in routes:
+        ctx.handler(r)
+    assert [r.done for r in routes] == ["continue", "abort", "abort"] and stats.blocked == 2
+
+    async def main():
+        actx = AsyncContext()
+        astats = await prepare_page_async(actx, AsyncPage(), args)
+        aroutes = [AsyncRoute(r.request.url, r.request.resource_type) for r in routes]
+        for r in aroutes:
+            await actx.handler(r)
+        return [r.done for r in aroutes], astats.blocked
+
+    assert asyncio.run(main()) == (["continue", "abort", "abort"], 2)
+    assert prepare_page(Context(), SyncPage(), make_args()) is None
+
+
+def test_load_totals_are_per_run():
+    args = make_args(load_stats=True)
+    runs = [FetchOptions(args), FetchOptions(args)]
+    for opts, n in zip(runs, (1, 2)):
+        stats = LoadStats()
+
+        class CountingPage(SyncPage):
+            def goto(self, url, wait_until):
+                for _ in range(3):
+                    stats.on_request(None)
+                return super().goto(url, wait_until)
+
+        session = Session(CountingPage([200] * n))
+        session.stats = stats
+        for _ in range(n):
+            assert scrape_with_retries(session, "1301", args, opts)[1] == ""
+    assert [(o.load_totals.pages, o.load_totals.requests) for o in runs] == [(1, 3), (2, 6)]
+    assert runs[1].load_totals.summary().startswith("[LOAD] pages=2 avg requests=3.0 ")
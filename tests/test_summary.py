@@ -0,0 +1,16 @@
+"""summary.py: --input のグロブ展開"""
+
+from summary import expand_inputs
+
+
+def test_glob_skips_summary_outputs(tmp_path, capsys):
+    for name in ("20250901_result.csv", "20250901_summary.csv", "20250908_result.parquet", "20250908_summary.parquet"):
+        (tmp_path / name).write_text("code\n")
+    got = expand_inputs([str(tmp_path / "*.csv"), str(tmp_path / "*")])
+    assert got == [str(tmp_path / "20250901_result.csv"), str(tmp_path / "20250908_result.parquet")]
+    assert "[INFO] skipping 1 *_summary files" in capsys.readouterr().err
+    # 名前を指定すれば *_summary でも入力にする
+    explicit = str(tmp_path / "20250901_summary.csv")
+    assert expand_inputs([explicit]) == [explicit]
+    assert expand_inputs([str(tmp_path / "*_summary.csv")]) == []
+    assert "[WARN] no files match" in capsys.readouterr().err
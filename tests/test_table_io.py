@@ -0,0 +1,162 @@
+"""table_io: 形式ごとの書き込みと、CSV と同じ文字列表現での読み戻し"""
+
+import json
+import sqlite3
+
+import pytest
+
+import table_io
+from table_io import open_table_reader, open_table_writer, table_format
+
+FIELDS = ["code", "company_name", "industries", "themes", "business_sales1", "overseas"]
+ROWS = [
+    {"code": "1301", "company_name": "極洋", "industries": "漁業,関東", "themes": "水産", "business_sales1": "55", "overseas": "11"},
+    {"code": "1332", "company_name": "ニッスイ", "industries": "", "themes": "", "business_sales1": "", "overseas": ""},
+]
+
+
+def write(path, rows, append=False, table="result", fieldnames=FIELDS):
+    with open_table_writer(str(path), fieldnames, append=append, table=table) as w:
+        w.writerows(rows)
+
+
+def read(path, table=""):
+    with open_table_reader(str(path), table) as r:
+        return r.fieldnames, list(r)
+
+
+def test_table_format():
+    assert table_format("out/result.CSV") == "csv"
+    assert table_format("x.parquet") == "parquet"
+    assert [table_format(p) for p in ("x.arrow", "x.feather", "x.ipc")] == ["arrow"] * 3
+    assert [table_format(p) for p in ("x.sqlite", "x.sqlite3", "x.db")] == ["sqlite"] * 3
+    assert table_format("noext") == "csv"
+
+
+def test_csv_round_trip_and_append(tmp_path):
+    path = tmp_path / "result.csv"
+    write(path, ROWS[:1])
+    write(path, ROWS[1:], append=True)
+    assert read(path) == (FIELDS, ROWS)
+    # append でなければ作り直す
+    write(path, ROWS[1:])
+    assert read(path)[1] == ROWS[1:]
+    assert path.read_bytes().startswith(b"\xef\xbb\xbf")
+
+
+def test_sqlite_types_and_round_trip(tmp_path):
+    path = tmp_path / "result.sqlite"
+    write(path, [dict(ROWS[0], extra="ignored"), ROWS[1]])
+    conn = sqlite3.connect(str(path))
+    raw = conn.execute('SELECT industries, themes, business_sales1, overseas FROM "result" ORDER BY code').fetchall()
+    types = {r[1]: r[2] for r in conn.execute('PRAGMA table_info("result")')}
+    conn.close()
+    # リスト列は JSON 配列、数値列は INTEGER（空欄は NULL）
+    assert [json.loads(raw[0][0]), json.loads(raw[0][1]), raw[0][2], raw[0][3]] == [["漁業", "関東"], ["水産"], 55, 11]
+    assert raw[1] == ("[]", "[]", None, None)
+    assert types["business_sales1"] == "INTEGER" and types["code"] == "TEXT"
+    # 読み戻すと CSV と同じ文字列（NULL は ""、整数は文字列）
+    assert read(path) == (FIELDS, ROWS)
+
+
+def test_sqlite_replace_on_code_and_truncate(tmp_path):
+    path = tmp_path / "result.sqlite"
+    write(path, ROWS)
+    write(path, [dict(ROWS[0], company_name="極洋（更新）")], append=True)
+    _, rows = read(path)
+    assert [r["company_name"] for r in rows] == ["ニッスイ", "極洋（更新）"]
+    # append=False は既存の行を消してから書く
+    write(path, ROWS[1:])
+    assert read(path)[1] == ROWS[1:]
+
+
+def test_sqlite_adds_missing_columns(tmp_path):
+    path = tmp_path / "result.sqlite"
+    write(path, [{"code": "1301", "company_name": "極洋"}], fieldnames=["code", "company_name"])
+    write(path, ROWS[1:], append=True)
+    fieldnames, rows = read(path)
+    assert fieldnames == FIELDS
+    assert rows[0] == {"code": "1301", "company_name": "極洋", "industries": "", "themes": "", "business_sales1": "", "overseas": ""}
+
+
+def test_sqlite_default_table(tmp_path):
+    path = tmp_path / "out.db"
+    write(path, ROWS[:1], table="summary")
+    # テーブルが1つならそれを読む
+    assert read(path)[1] == ROWS[:1]
+    write(path, ROWS, table="result")
+    # 複数あれば result
+    assert read(path)[1] == ROWS
+    assert read(path, table="summary")[1] == ROWS[:1]
+    write(path, ROWS, table="other")
+    conn = sqlite3.connect(str(path))
+    conn.execute('DROP TABLE "result"')
+    conn.commit()
+    conn.close()
+    with pytest.raises(ValueError, match="cannot choose a table"):
+        read(path)
+    with pytest.raises(ValueError, match="not found"):
+        read(path, table="missing")
+
+
+@pytest.mark.parametrize("name", ["result.parquet", "result.arrow"])
+def test_arrow_round_trip_and_append(tmp_path, name):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / name
+    write(path, ROWS[:1])
+    write(path, ROWS[1:], append=True)
+    assert read(path) == (FIELDS, ROWS)
+    assert not (tmp_path / (name + ".tmp")).exists()
+
+
+def test_parquet_column_types(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = tmp_path / "result.parquet"
+    write(path, ROWS)
+    table = pq.read_table(str(path))
+    assert table.schema.field("industries").type == pa.list_(pa.string())
+    assert table.schema.field("overseas").type == pa.int64()
+    assert table.column("business_sales1").to_pylist() == [55, None]
+
+
+@pytest.mark.parametrize("name", ["result.parquet", "result.arrow"])
+def test_arrow_checkpoints_survive_a_kill(tmp_path, monkeypatch, name):
+    pytest.importorskip("pyarrow")
+    now = [1000.0]
+    monkeypatch.setattr(table_io.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(table_io, "BATCH_ROWS", 3)
+    path = tmp_path / name
+    rows = [dict(ROWS[0], code=str(1300 + n)) for n in range(8)]
+    w = open_table_writer(str(path), FIELDS)
+    w.writerows(rows[:4])
+    # BATCH_ROWS 行でチェックポイント（close 前でも本来のパスから読める）
+    assert [r["code"] for r in read(path)[1]] == ["1300", "1301", "1302"]
+    w.writerow(rows[4])
+    now[0] += table_io.CHECKPOINT_SEC
+    w.writerow(rows[5])
+    # 一定時間ごとにもチェックポイント
+    assert read(path)[1] == rows[:6]
+    w.writerows(rows[6:])
+    # close せずに終了した（強制終了）とみなし、--resume --append と同じく既存の行を引き継いで書き直す
+    w.writer.close()
+    with open_table_writer(str(path), FIELDS, append=True) as w2:
+        w2.writerows(rows[6:])
+    assert read(path)[1] == rows
+    assert not (tmp_path / (name + ".tmp")).exists()
+
+
+def test_arrow_append_copies_all_rows_before_checkpointing(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(table_io, "BATCH_ROWS", 2)
+    path = tmp_path / "result.parquet"
+    rows = [dict(ROWS[1], code=str(1300 + n)) for n in range(5)]
+    write(path, rows)
+    w = open_table_writer(str(path), FIELDS, append=True)
+    # 既存の行を写している途中で置き換えない
+    assert read(path)[1] == rows
+    w.writerows([dict(ROWS[1], code="9999")] * 2)
+    assert len(read(path)[1]) == 7
+    w.close()
@@ -0,0 +1,123 @@
+"""tagindex.py: 小さな表からインデックスを作り、クエリ結果を全行の素朴なフィルタと突き合わせる"""
+
+import csv
+
+import pytest
+
+from tagindex import Query, TagIndex, build_index, row_terms, tokenize
+
+FIELDS = ["code", "company_name", "market", "industries", "themes", "business1", "business2", "business3"]
+ROWS = [
+    {"code": "1301", "company_name": "極洋", "market": "東証プライム", "industries": "水産,食品", "themes": "寿司,冷凍食品", "business1": "水産商事"},
+    {"code": "1332", "company_name": "ニッスイ", "market": "東証プライム", "industries": "水産", "themes": "寿司", "business1": "食品"},
+    {"code": "4565", "company_name": "そーせい", "market": "東証グロース", "industries": "医薬品", "themes": "創薬,バイオ"},
+    {"code": "4592", "company_name": "サンバイオ", "market": "東証グロース", "industries": "医薬品,再生医療", "themes": "再生医療"},
+    {"code": "6920", "company_name": "レーザーテク", "market": "東証プライム", "industries": "半導体製造装置", "themes": "半導体"},
+    {"code": "6857", "company_name": "アドバンテスト", "market": "東証プライム", "industries": "半導体検査", "themes": "半導体,AI"},
+    {"code": "3000", "company_name": "創薬商事", "market": "東証スタンダード", "industries": "商社", "themes": ""},
+    # 重複した code は最初の行だけ
+    {"code": "1301", "company_name": "極洋（重複）", "market": "東証グロース", "industries": "重複", "themes": ""},
+]
+DOCS = ROWS[:-1]
+
+
+def has(row, field, term):
+    terms = row_terms(row)[field]
+    if term.endswith("*"):
+        return any(t.startswith(term[:-1]) for t in terms if t)
+    return term in terms
+
+
+def tag(row, term):
+    return has(row, "industry", term) or has(row, "theme", term)
+
+
+def peers(code):
+    me = next(r for r in DOCS if r["code"] == code)
+    inds = set(row_terms(me)["industry"])
+    return lambda r: r["code"] != code and bool(inds & set(row_terms(r)["industry"]))
+
+
+# (クエリ, 同じ条件を1行ずつ判定する関数)
+CASES = [
+    ("theme:寿司", lambda r: has(r, "theme", "寿司")),
+    ("寿司", lambda r: tag(r, "寿司")),
+    ("theme:創薬 market:東証グロース", lambda r: has(r, "theme", "創薬") and has(r, "market", "東証グロース")),
+    ("theme:創薬 AND market:東証グロース", lambda r: has(r, "theme", "創薬") and has(r, "market", "東証グロース")),
+    # AND は OR より強い: a OR b c == a OR (b AND c)
+    ("theme:寿司 OR market:東証グロース theme:再生医療", lambda r: has(r, "theme", "寿司") or (has(r, "market", "東証グロース") and has(r, "theme", "再生医療"))),
+    ("(theme:寿司 OR market:東証グロース) theme:再生医療", lambda r: (has(r, "theme", "寿司") or has(r, "market", "東証グロース")) and has(r, "theme", "再生医療")),
+    # NOT は直後の語だけに掛かる
+    ("NOT market:東証プライム theme:創薬", lambda r: not has(r, "market", "東証プライム") and has(r, "theme", "創薬")),
+    ("NOT (market:東証プライム OR theme:創薬)", lambda r: not (has(r, "market", "東証プライム") or has(r, "theme", "創薬"))),
+    ("NOT NOT 水産", lambda r: tag(r, "水産")),
+    ("industry:半導体*", lambda r: has(r, "industry", "半導体*")),
+    ("(industry:半導体* OR theme:半導体) NOT market:東証グロース", lambda r: (has(r, "industry", "半導体*") or has(r, "theme", "半導体")) and not has(r, "market", "東証グロース")),
+    ("半導体* OR 医薬*", lambda r: tag(r, "半導体*") or tag(r, "医薬*")),
+    ("segment:水産商事 OR segment:食品", lambda r: has(r, "segment", "水産商事") or has(r, "segment", "食品")),
+    ("code:4565 OR code:9999", lambda r: r["code"] == "4565"),
+    ("peers:4565", peers("4565")),
+    ("peers:1332", peers("1332")),
+    ("peers:1301 OR peers:6920", lambda r: peers("1301")(r) or peers("6920")(r)),
+    ('"冷凍食品"', lambda r: tag(r, "冷凍食品")),
+    ("theme:存在しない", lambda r: False),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    src = tmp_path / "20250901_result.csv"
+    with open(src, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=FIELDS, restval="")
+        w.writeheader()
+        w.writerows(ROWS)
+    out = str(tmp_path / "20250901_result.idx")
+    n_codes, _ = build_index(str(src), out)
+    assert n_codes == len(DOCS)
+    ix = TagIndex(out)
+    yield ix
+    ix.close()
+
+
+@pytest.mark.parametrize("text, pred", CASES, ids=[c[0] for c in CASES])
+def test_query_matches_brute_force(index, text, pred):
+    got = sorted(index.codes[d][0] for d in Query(text).evaluate(index))
+    assert got == sorted(r["code"] for r in DOCS if pred(r))
+
+
+def test_query_parse():
+    assert tokenize('(theme:"再生 医療" OR x)') == ["(", 'theme:"再生 医療"', "OR", "x", ")"]
+    assert Query("a OR b c").tree == ("or", ("term", None, "a"), ("and", ("term", None, "b"), ("term", None, "c")))
+    assert Query("NOT a b").tree == ("and", ("not", ("term", None, "a")), ("term", None, "b"))
+    assert Query("themes:x").tree == ("term", "theme", "x")
+    for bad, message in [("sector:x", "unknown field"), ("(a OR b", "missing"), ("a OR", "ends unexpectedly"), ("a )", "unexpected")]:
+        with pytest.raises(ValueError, match=message):
+            Query(bad)
+
+
+def test_mmap_postings_decode(index):
+    # ポスティングは入力順の銘柄番号。ファイル上の uint32 を読み戻して元の集合になる
+    assert index.date == "20250901"
+    assert [c[0] for c in index.codes] == [r["code"] for r in DOCS]
+    for field in ("industry", "theme", "market", "segment", "code"):
+        for term, (_, count) in index.fields[field].items():
+            expected = {d for d, r in enumerate(DOCS) if term in row_terms(r)[field]}
+            ids = index.postings(field, term)
+            assert ids == expected and len(ids) == count
+    assert index.postings("theme", "無い") == set()
+    assert index.facet("market", index.universe) == [("東証プライム", 4), ("東証グロース", 2), ("東証スタンダード", 1)]
+
+
+def test_postings_are_little_endian_uint32(index):
+    # ファイル上の形式はホストによらず 4 バイト境界の little-endian uint32
+    assert index.base % 4 == 0
+    offset, count = index.fields["industry"]["医薬品"]
+    raw = index.mm[index.base + offset * 4 : index.base + (offset + count) * 4]
+    assert [int.from_bytes(raw[i : i + 4], "little") for i in range(0, len(raw), 4)] == [2, 3]
+
+
+def test_not_an_index(tmp_path):
+    path = tmp_path / "x.idx"
+    path.write_bytes(b"not an index at all")
+    with pytest.raises(ValueError, match="not a tag index"):
+        TagIndex(str(path))
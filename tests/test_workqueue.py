@@ -0,0 +1,113 @@
+"""WorkQueue（--defer-retries の遅延キュー）と prioritize（--priority）"""
+
+import pytest
+
+import scrape
+from scrape import RefreshState, StateDB, WorkQueue, prioritize
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(scrape.time, "monotonic", c)
+    return c
+
+
+def codes_of(items):
+    return [it[1] for it in items]
+
+
+def test_ready_items_in_input_order(clock):
+    q = WorkQueue([(1, "1301"), (2, "1332")])
+    a, _ = q.poll()
+    b, _ = q.poll()
+    assert (a[:3], b[:3]) == ((1, "1301", 0), (2, "1332", 0))
+    # 処理中が残っている間は短い間隔で見直す
+    assert q.poll() == (None, 0.05)
+    q.done()
+    q.done()
+    assert q.poll() == (None, None)
+
+
+def test_deferred_waits_then_goes_before_ready(clock):
+    q = WorkQueue([(1, "1301"), (2, "1332"), (3, "1333")])
+    item, _ = q.poll()
+    q.defer(item, 5.0)
+    nxt, _ = q.poll()
+    assert nxt[1] == "1332"
+    q.done()
+    clock.now += 5.0
+    due, _ = q.poll()
+    # 期限の来た遅延分は未着手の銘柄より先。試行回数は1つ進む
+    assert due[:3] == (1, "1301", 1)
+    q.done()
+    assert q.poll()[0][1] == "1333"
+
+
+def test_wait_until_earliest_deadline(clock):
+    q = WorkQueue([(1, "1301"), (2, "1332")])
+    a, _ = q.poll()
+    b, _ = q.poll()
+    q.defer(a, 8.0)
+    q.defer(b, 3.0)
+    assert q.poll() == (None, pytest.approx(3.0))
+    clock.now += 8.0
+    # 期限順、同じ期限なら遅延させた順
+    assert codes_of([q.poll()[0], q.poll()[0]]) == ["1332", "1301"]
+
+
+def test_same_deadline_keeps_defer_order(clock):
+    q = WorkQueue([(1, "1301"), (2, "1332"), (3, "1333")])
+    items = [q.poll()[0] for _ in range(3)]
+    for it in reversed(items):
+        q.defer(it, 1.0)
+    clock.now += 1.0
+    assert codes_of([q.poll()[0] for _ in range(3)]) == ["1333", "1332", "1301"]
+
+
+def test_requeue_and_drain(clock):
+    q = WorkQueue([(1, "1301"), (2, "1332"), (3, "1333")])
+    a, _ = q.poll()
+    q.requeue(a)
+    assert q.poll()[0][1] == "1301"
+    b, _ = q.poll()
+    q.defer(b, 10.0)
+    assert codes_of(q.drain()) == ["1333", "1332"]
+    assert q.poll() == (None, 0.05)
+
+
+def test_prioritize_stale_first_slow_and_failed_last(tmp_path):
+    items = [(1, "A"), (2, "B"), (3, "C"), (4, "D"), (5, "E"), (6, "F")]
+    refresh = RefreshState(str(tmp_path / "refresh.json"))
+    refresh.entries = {"A": {"fetched": 300.0}, "B": {"fetched": 100.0}}
+    history = {
+        "C": {"status": "done", "ts": 200.0, "total": 2.0},
+        "D": {"status": "failed", "total": 2.0},
+        "E": {"status": "done", "ts": 50.0, "total": 9.0},
+        "A": {"status": "done", "ts": 400.0, "total": 2.0},
+    }
+    ordered, n_slow = prioritize(items, None, refresh, history)
+    # F は未取得（最古扱い）、その後は最終取得の古い順。D（失敗）と E（中央値の3倍以上）は最後で、その中も古い順
+    assert codes_of(ordered) == ["F", "B", "C", "A", "D", "E"]
+    assert n_slow == 2
+
+
+def test_prioritize_uses_state_db_and_keeps_input_order_on_ties(tmp_path):
+    state = StateDB(str(tmp_path / "state.sqlite"))
+    state.seed(["A", "B", "C", "D"])
+    state.claim("B")
+    state.finish("B", "done", row={"code": "B"})
+    state.claim("C")
+    state.finish("C", "failed", error="timeout")
+    ordered, n_slow = prioritize([(1, "A"), (2, "B"), (3, "C"), (4, "D")], state, None, {})
+    state.close()
+    assert codes_of(ordered) == ["A", "D", "B", "C"]
+    assert n_slow == 1